@@ -2,11 +2,22 @@
 bmail - A simple Gmail client library designed for LLM integration
 """
 import os
-from bmail import llm_email_tools
+import importlib
 
 __version__ = '0.1.0'
 __author__ = 'Ben Rinauto'
 __all__ = ['llm_email_tools']
 
-# Used for sending emails - not author email
-__email__ = os.environ['BMAIL_SENDER']
+def __getattr__(name: str):
+    # llm_email_tools is imported on first use, so a short-lived process that
+    # only needs a submodule does not load every tool module up front.
+    if name == 'llm_email_tools':
+        return importlib.import_module('bmail.llm_email_tools')
+    if name == '__email__':
+        # Used for sending emails - not author email. Read on access so that
+        # importing bmail does not require BMAIL_SENDER to be set.
+        try:
+            return os.environ['BMAIL_SENDER']
+        except KeyError:
+            raise AttributeError(f'module {__name__!r} has no attribute {name!r} (set BMAIL_SENDER)') from None
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
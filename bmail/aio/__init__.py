@@ -0,0 +1,13 @@
+"""
+bmail.aio - asyncio API for bmail
+
+bmail.aio.gmail_client and bmail.aio.llm_email_tools mirror their blocking
+namesakes. Requests are made with aiohttp over one connection pool per event
+loop; call close() before the loop shuts down.
+
+Requires the optional aiohttp dependency: pip install "bmail[aio]"
+"""
+from bmail.aio import gmail_client, llm_email_tools
+from bmail.aio.gmail_client import AsyncService, close, get_gmail_service
+
+__all__ = ['gmail_client', 'llm_email_tools', 'AsyncService', 'close', 'get_gmail_service']
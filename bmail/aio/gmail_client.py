@@ -0,0 +1,399 @@
+"""
+Asyncio counterpart of bmail.gmail_client.
+
+Calls go straight to the Gmail REST endpoints over aiohttp instead of
+googleapiclient/httplib2, so they never block the event loop. All services on
+one event loop share a single aiohttp session and therefore one connection
+pool, which lets hundreds of mailbox operations run concurrently.
+
+These calls do not yet go through bmail.ratelimit's quota buckets and AIMD
+limits, and emit no bmail.metrics records. Instead each AsyncService keeps at
+most MAX_CONCURRENCY requests in flight and retries throttling (429, 403 rate
+limit) and 5xx responses with the process-wide scheduler's backoff, honouring
+Retry-After. The message cache is SQLite, so its reads and writes run on the
+default executor rather than on the event loop.
+
+Requires the optional aiohttp dependency: pip install "bmail[aio]"
+"""
+import os
+import json
+import asyncio
+import functools
+import threading
+import weakref
+from typing import Iterable, Union
+try:
+    import aiohttp
+except ImportError as e:
+    raise ImportError('bmail.aio requires aiohttp; install it with: pip install "bmail[aio]"') from e
+import httplib2
+import google_auth_httplib2
+from google.oauth2 import service_account
+from bmail import ratelimit
+from bmail.auth import SCOPES, _cache_key
+from bmail.gmail_client import BATCH_MODIFY_LIMIT, REPLY_HEADERS, build_send_body, reply_headers, thread_messages
+from bmail.message import ArchiveResult, Message, MessageSummary, parse_message, parse_summary
+from bmail.message_cache import MessageCache, resolve_cache
+
+GMAIL_API_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/'
+
+# Connections per event loop shared by every AsyncService on that loop.
+POOL_SIZE = 100
+
+# Requests one AsyncService (one mailbox) has in flight at once.
+MAX_CONCURRENCY = 10
+
+class AsyncService:
+    """Gmail API access for one delegated identity over a shared aiohttp session.
+
+    Credentials are refreshed in a worker thread only when they have expired, so
+    the event loop never waits on the token endpoint otherwise.
+    """
+
+    def __init__(self, credentials, session: 'aiohttp.ClientSession', base_url: str=None, max_concurrency: int=MAX_CONCURRENCY):
+        """
+        Args:
+            credentials: google-auth credentials for the mailbox
+            session: aiohttp session (and connection pool) to send requests on
+            base_url: Gmail API root for the mailbox (default GMAIL_API_URL or BMAIL_GMAIL_API_URL)
+            max_concurrency: Requests in flight at once for this mailbox
+        """
+        self.credentials = credentials
+        self.session = session
+        self.base_url = base_url or os.environ.get('BMAIL_GMAIL_API_URL') or GMAIL_API_URL
+        if not self.base_url.endswith('/'):
+            self.base_url += '/'
+        self.sender_address = None
+        self._refresh_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def request(self, method: str, path: str, params: dict=None, body: dict=None) -> dict:
+        """
+        Make one Gmail API call, retrying throttling and transient errors.
+
+        Args:
+            method: HTTP method
+            path: Path below the users/me/ root, e.g. 'messages/send'
+            params: Query parameters; list values are sent as repeated parameters
+            body: JSON request body
+
+        Returns:
+            dict: Decoded JSON response ({} for an empty body)
+
+        Raises:
+            GmailError: If Gmail answers with a non-retryable error status or retries run out
+        """
+        query = []
+        for key, value in (params or {}).items():
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                query.append((key, str(item).lower() if isinstance(item, bool) else str(item)))
+        scheduler = ratelimit.get_scheduler()
+        attempt = 0
+        while True:
+            try:
+                async with self._slots:
+                    return await self._send(method, path, query, body)
+            except GmailError as e:
+                if not e.retryable or attempt >= scheduler.max_retries:
+                    raise
+                delay = scheduler.backoff(attempt)
+                retry_after = (e.headers or {}).get('Retry-After')
+                if retry_after and str(retry_after).isdigit():
+                    delay = max(delay, min(scheduler.max_delay, float(retry_after)))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= scheduler.max_retries:
+                    raise
+                delay = scheduler.backoff(attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, method: str, path: str, query: list, body: dict=None) -> dict:
+        headers = await self._auth_headers()
+        async with self.session.request(method, self.base_url + path, params=query, json=body, headers=headers) as response:
+            text = await response.text()
+            data = json.loads(text) if text else {}
+            if response.status >= 400:
+                error = data.get('error', {}) if isinstance(data, dict) else {}
+                reasons = [item.get('reason') for item in error.get('errors', []) if isinstance(item, dict)]
+                raise GmailError(response.request_info, response.history, status=response.status, message=error.get('message', text), headers=response.headers, reasons=reasons)
+            return data
+
+    async def _auth_headers(self) -> dict:
+        if not self.credentials.valid:
+            async with self._refresh_lock:
+                if not self.credentials.valid:
+                    request = google_auth_httplib2.Request(httplib2.Http())
+                    await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, request)
+        headers = {}
+        self.credentials.apply(headers)
+        return headers
+
+class GmailError(aiohttp.ClientResponseError):
+    """Error status from Gmail, with the reasons listed in its error body."""
+
+    def __init__(self, *args, reasons: Iterable[str]=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reasons = list(reasons)
+
+    @property
+    def retryable(self) -> bool:
+        """True for throttling and transient server errors, as bmail.ratelimit.is_retryable."""
+        if self.status in ratelimit.RETRY_STATUSES:
+            return True
+        return self.status == 403 and any((reason in self.reasons for reason in ratelimit.RATE_LIMIT_REASONS))
+
+# Sessions and services are bound to an event loop; credentials are not.
+_SESSIONS = weakref.WeakKeyDictionary()
+_SERVICES = weakref.WeakKeyDictionary()
+_CREDENTIALS = {}
+_LOCK = threading.Lock()
+
+def get_session() -> 'aiohttp.ClientSession':
+    """Return the aiohttp session shared by all services on the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=POOL_SIZE))
+        _SESSIONS[loop] = session
+    return session
+
+async def close() -> None:
+    """Close the shared session of the running event loop and forget its services."""
+    loop = asyncio.get_running_loop()
+    _SERVICES.pop(loop, None)
+    session = _SESSIONS.pop(loop, None)
+    if session is not None:
+        await session.close()
+
+async def get_gmail_service(credentials_path: str, delegated_email: str, scopes: Iterable[str]=SCOPES) -> Union[AsyncService, str]:
+    """Get an AsyncService for a delegated mailbox, cached like auth.get_gmail_service.
+
+    Args:
+        credentials_path (str): Path to the service account JSON key file
+        delegated_email (str): Email address to delegate access to
+        scopes (Iterable[str], optional): OAuth scopes to request. Defaults to SCOPES.
+
+    Returns:
+        Union[AsyncService, str]: Either a verified service or an error message
+    """
+    key = _cache_key(credentials_path, delegated_email, scopes)
+    services = _SERVICES.setdefault(asyncio.get_running_loop(), {})
+    if key in services:
+        return services[key]
+    if not os.path.exists(credentials_path):
+        return f'Error: Credentials file not found at {credentials_path}'
+    try:
+        with _LOCK:
+            credentials = _CREDENTIALS.get(key)
+            if credentials is None:
+                credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=list(scopes)).with_subject(delegated_email)
+                _CREDENTIALS[key] = credentials
+        service = AsyncService(credentials, get_session())
+        try:
+            profile = await service.request('GET', 'profile')
+        except Exception as e:
+            return f'Error verifying service: {str(e)}'
+    except Exception as e:
+        return f'Error during authentication: {str(e)}'
+    service.sender_address = profile.get('emailAddress', delegated_email)
+    return services.setdefault(key, service)
+
+async def get_sender_address(service: AsyncService) -> str:
+    """Return the mailbox address of a service, calling getProfile only the first time."""
+    if service.sender_address is None:
+        profile = await service.request('GET', 'profile')
+        service.sender_address = profile['emailAddress']
+    return service.sender_address
+
+async def send_gmail(service: AsyncService, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, from_addr: str=None) -> str:
+    """
+    Send an email. Async counterpart of bmail.gmail_client.send_gmail.
+
+    Returns:
+        str: Success message or error description
+    """
+    try:
+        if not from_addr:
+            from_addr = await get_sender_address(service)
+        send_body = build_send_body(from_addr, to_addr, cc, bcc, subject, body, thread_id, in_reply_to, references)
+        result = await service.request('POST', 'messages/send', body=send_body)
+        return f"Email sent successfully. Message ID: {result.get('id')}"
+    except Exception as e:
+        return f'Failed to send email: {str(e)}'
+
+async def _blocking(fn, *args):
+    """Run a blocking call (the SQLite message cache) on the default executor."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+async def get_email(service: AsyncService, email_id: str, cache: Union[MessageCache, bool, None]=None, format: str='full') -> Union[Message, str]:
+    """
+    Retrieve an email as a lazily decoded Message. Async counterpart of bmail.gmail_client.get_email.
+
+    Returns:
+        Union[Message, str]: The message or error message
+    """
+    try:
+        cache = await _blocking(resolve_cache, cache)
+        mailbox = await get_sender_address(service) if cache else None
+        message = await _blocking(cache.get, mailbox, email_id, format) if cache else None
+        if message is None:
+            message = await service.request('GET', f'messages/{email_id}', {'format': format})
+            if cache:
+                await _blocking(cache.put, mailbox, message)
+        return parse_message(message)
+    except Exception as e:
+        return f'Failed to retrieve email: {str(e)}'
+
+async def get_thread(service: AsyncService, thread_id: str, cache: Union[MessageCache, bool, None]=None) -> Union[list, str]:
+    """
+    Retrieve every message of a thread in one call. Async counterpart of bmail.gmail_client.get_thread.
+
+    Returns:
+        Union[list, str]: Messages oldest first, or error message
+    """
+    try:
+        thread = await service.request('GET', f'threads/{thread_id}', {'format': 'full'})
+        cache = await _blocking(resolve_cache, cache)
+        return await _blocking(thread_messages, thread, await get_sender_address(service) if cache else None, cache or False)
+    except Exception as e:
+        return f'Failed to retrieve thread: {str(e)}'
+
+async def get_reply_headers(service: AsyncService, email_id: str, cache: Union[MessageCache, bool, None]=None) -> Union[dict, str]:
+    """
+    Fetch only the headers needed to reply. Async counterpart of bmail.gmail_client.get_reply_headers.
+
+    Returns:
+        Union[dict, str]: Headers as returned by bmail.gmail_client.reply_headers, or error message
+    """
+    try:
+        cache = await _blocking(resolve_cache, cache)
+        message = await _blocking(cache.get, await get_sender_address(service), email_id) if cache else None
+        if message is None:
+            message = await service.request('GET', f'messages/{email_id}', {'format': 'metadata', 'metadataHeaders': REPLY_HEADERS})
+        return reply_headers(message)
+    except Exception as e:
+        return f'Failed to retrieve email: {str(e)}'
+
+async def get_summaries(service: AsyncService, email_ids: list) -> list:
+    """
+    Fetch summaries concurrently (at most the service's MAX_CONCURRENCY at once). Async counterpart of bmail.gmail_client.get_summaries.
+
+    Returns:
+        list[MessageSummary]: One per ID, in input order
+    """
+    params = {'format': 'metadata', 'metadataHeaders': ['subject', 'date']}
+    responses = await asyncio.gather(*(service.request('GET', f'messages/{email_id}', params) for email_id in email_ids), return_exceptions=True)
+    summaries = []
+    for email_id, message in zip(email_ids, responses):
+        if isinstance(message, Exception):
+            summaries.append(MessageSummary(email_id, '', '', error=str(message)))
+        else:
+            summaries.append(parse_summary(email_id, message))
+    return summaries
+
+async def list_summaries(service: AsyncService, query: str=None, max_results: int=20, page_token: str=None) -> tuple:
+    """
+    Fetch one page of inbox summaries. Async counterpart of bmail.gmail_client.list_summaries.
+
+    Returns:
+        tuple[list[MessageSummary], Optional[str]]: Summaries and the token for the next page, if any
+    """
+    search_query = 'in:inbox'
+    if query:
+        search_query = f'{search_query} {query}'
+    params = {'maxResults': max_results, 'q': search_query}
+    if page_token:
+        params['pageToken'] = page_token
+    results = await service.request('GET', 'messages', params)
+    messages = results.get('messages', [])
+    if not messages:
+        # Gmail can return an empty page that still has a nextPageToken.
+        return ([], results.get('nextPageToken'))
+    return (await get_summaries(service, [msg['id'] for msg in messages]), results.get('nextPageToken'))
+
+async def summarize_emails(service: AsyncService, email_ids: list) -> list:
+    """
+    Fetch "id:timestamp:subject" summaries concurrently. Async counterpart of bmail.gmail_client.summarize_emails.
+
+    Returns:
+        list[str]: One summary line per ID, in input order
+    """
+    return [str(summary) for summary in await get_summaries(service, email_ids)]
+
+async def list_email_page(service: AsyncService, query: str=None, max_results: int=20, page_token: str=None) -> tuple:
+    """
+    Fetch one page of inbox summary lines. Async counterpart of bmail.gmail_client.list_email_page.
+
+    Returns:
+        tuple[list[str], Optional[str]]: Summary lines and the token for the next page, if any
+    """
+    summaries, next_token = await list_summaries(service, query, max_results, page_token)
+    return ([str(summary) for summary in summaries], next_token)
+
+async def list_emails(service: AsyncService, query: str=None, max_results: int=20) -> str:
+    """
+    List inbox emails as "id:timestamp:subject" lines. Async counterpart of bmail.gmail_client.list_emails.
+
+    Returns:
+        str: Newline-separated list of "id:timestamp:subject" or error message
+    """
+    try:
+        email_list, _ = await list_email_page(service, query, max_results)
+        if not email_list:
+            return 'No emails found'
+        return '\n'.join(email_list)
+    except Exception as e:
+        return f'Failed to list emails: {str(e)}'
+
+async def archive_email(service: AsyncService, email_id: str) -> str:
+    """
+    Archive one email. Async counterpart of bmail.gmail_client.archive_email.
+
+    Returns:
+        str: Success message or error description
+    """
+    try:
+        message = await service.request('GET', f'messages/{email_id}', {'format': 'minimal'})
+        if 'INBOX' not in message.get('labelIds', []):
+            return f'Email {email_id} is not in inbox'
+        result = await service.request('POST', f'messages/{email_id}/modify', body={'removeLabelIds': ['INBOX']})
+        cache = await _blocking(resolve_cache, None)
+        if cache:
+            await _blocking(cache.set_labels, await get_sender_address(service), email_id, result.get('labelIds', []))
+        if 'INBOX' in result.get('labelIds', []):
+            return f'Failed to remove INBOX label from email {email_id}'
+        return f'Email {email_id} archived successfully'
+    except Exception as e:
+        return f'Failed to archive email {email_id}: {str(e)}'
+
+async def archive_emails(service: AsyncService, email_ids: list, verify: bool=False) -> list:
+    """
+    Archive many emails with batchModify. Async counterpart of bmail.gmail_client.archive_emails.
+
+    Returns:
+        list: One ArchiveResult per ID, in input order
+    """
+    email_ids = list(dict.fromkeys(email_ids))
+    cache = await _blocking(resolve_cache, None)
+    outcomes = {}
+    pending = email_ids
+    if verify:
+        messages = await asyncio.gather(*(service.request('GET', f'messages/{email_id}', {'format': 'minimal'}) for email_id in email_ids), return_exceptions=True)
+        pending = []
+        for email_id, message in zip(email_ids, messages):
+            if isinstance(message, Exception):
+                outcomes[email_id] = ArchiveResult(email_id, False, f'Failed to archive email {email_id}: {str(message)}')
+            elif 'INBOX' not in message.get('labelIds', []):
+                outcomes[email_id] = ArchiveResult(email_id, False, f'Email {email_id} is not in inbox')
+            else:
+                pending.append(email_id)
+    for start in range(0, len(pending), BATCH_MODIFY_LIMIT):
+        chunk = pending[start:start + BATCH_MODIFY_LIMIT]
+        try:
+            await service.request('POST', 'messages/batchModify', body={'ids': chunk, 'removeLabelIds': ['INBOX']})
+            if cache:
+                await _blocking(cache.remove_labels, await get_sender_address(service), chunk, ['INBOX'])
+            outcomes.update(((email_id, ArchiveResult(email_id, True, f'Email {email_id} archived successfully')) for email_id in chunk))
+        except Exception as e:
+            outcomes.update(((email_id, ArchiveResult(email_id, False, f'Failed to archive email {email_id}: {str(e)}')) for email_id in chunk))
+    return [outcomes[email_id] for email_id in email_ids]
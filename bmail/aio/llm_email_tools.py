@@ -0,0 +1,102 @@
+"""
+Asyncio counterpart of bmail.llm_email_tools.
+
+Each tool takes the same arguments and returns the same strings as its
+blocking namesake, but can be awaited on the agent's event loop.
+"""
+import os
+import asyncio
+import functools
+from typing import List, Optional, Union
+from bmail import email_handler
+from bmail.aio import gmail_client
+from bmail.gmail_client import build_reply
+from bmail.llm_email_tools import DEFAULT_ATTACHMENT_MAX_CHARS, DEFAULT_MAX_CHARS, DEFAULT_THREAD_MAX_CHARS
+
+async def _get_service(creds_path: str, use_sender: bool=True) -> Union[gmail_client.AsyncService, str]:
+    """Async counterpart of bmail.email_handler._get_service."""
+    env_var = 'BMAIL_SENDER' if use_sender else 'BMAIL_TEST_EMAIL'
+    try:
+        delegated_email = os.environ[env_var]
+    except KeyError:
+        return f'Error: {env_var} environment variable not set'
+    return await gmail_client.get_gmail_service(creds_path, delegated_email)
+
+async def send_email(to: str, cc: str, bcc: str, subject: str, body: str, cred_filepath: Optional[str]=None, queue: bool=False, attachments: Optional[List[str]]=None) -> str:
+    """Send an email. Async counterpart of bmail.llm_email_tools.send_email."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    if queue:
+        # One local SQLite insert; fast enough to run on the event loop.
+        return email_handler.queue_email(creds, to, cc, bcc, subject, body, attachments=attachments)
+    if attachments:
+        # The resumable upload is blocking file and socket I/O; keep it off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(email_handler.send_email, creds, to, cc, bcc, subject, body, attachments=attachments))
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    return await gmail_client.send_gmail(service, to, cc, bcc, subject, body)
+
+async def read_email(email_id: str, cred_filepath: Optional[str]=None, max_chars: Optional[int]=DEFAULT_MAX_CHARS) -> str:
+    """Retrieve content of a specific email. Async counterpart of bmail.llm_email_tools.read_email."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    # The identity is resolved first: cached messages are only served to their own mailbox.
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    return email_handler.format_email(await gmail_client.get_email(service, email_id), max_chars)
+
+async def read_thread(thread_id: str, max_chars_per_message: Optional[int]=DEFAULT_THREAD_MAX_CHARS, cred_filepath: Optional[str]=None) -> str:
+    """Retrieve a whole conversation in one API call. Async counterpart of bmail.llm_email_tools.read_thread."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    return email_handler.format_thread(thread_id, await gmail_client.get_thread(service, thread_id), max_chars_per_message)
+
+async def get_attachment(email_id: str, attachment: Optional[str]=None, max_chars: Optional[int]=DEFAULT_ATTACHMENT_MAX_CHARS, cred_filepath: Optional[str]=None) -> str:
+    """List or download an attachment. Async counterpart of bmail.llm_email_tools.get_attachment."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    # Downloads are decoded and hashed to disk; keep that off the event loop.
+    return await asyncio.get_running_loop().run_in_executor(None, email_handler.get_attachment, creds, email_id, attachment, max_chars)
+
+async def reply_to_email(email_id: str, body: str, sender: str, cred_filepath: Optional[str]=None) -> str:
+    """Reply to a specific email. Async counterpart of bmail.llm_email_tools.reply_to_email."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    reply = build_reply(await gmail_client.get_reply_headers(service, email_id))
+    if isinstance(reply, str):
+        return reply
+    return await gmail_client.send_gmail(service, reply.pop('to_addr'), '', '', reply.pop('subject'), body, **reply)
+
+async def check_inbox(query: str=None, cred_filepath: Optional[str]=None, cursor: Optional[str]=None, max_results: int=20) -> str:
+    """List inbox contents a page at a time. Async counterpart of bmail.llm_email_tools.check_inbox."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    page_token = None
+    if cursor:
+        decoded = email_handler._decode_cursor(cursor)
+        if isinstance(decoded, str):
+            return decoded
+        query, page_token = decoded
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    try:
+        summaries, next_token = await gmail_client.list_summaries(service, query, max_results, page_token)
+    except Exception as e:
+        return f'Failed to list emails: {str(e)}'
+    return email_handler.format_summaries(summaries, email_handler._encode_cursor(query, next_token) if next_token else None)
+
+async def archive_emails(email_ids: Union[str, List[str]], cred_filepath: Optional[str]=None, verify: bool=False) -> str:
+    """Archive one or more emails. Async counterpart of bmail.llm_email_tools.archive_emails."""
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    if isinstance(email_ids, str):
+        email_ids = email_ids.replace(',', ' ').split()
+    email_ids = [email_id.replace('.eml', '') if email_id.endswith('.eml') else email_id for email_id in email_ids]
+    if not email_ids:
+        return 'Error: No email IDs given'
+    service = await _get_service(creds)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    return email_handler.format_archive_results(await gmail_client.archive_emails(service, email_ids, verify=verify))
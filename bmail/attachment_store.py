@@ -0,0 +1,158 @@
+"""
+Content-addressed on-disk store of downloaded attachments.
+
+Each attachment is saved once under the SHA-256 of its bytes,
+BMAIL_CACHE_DIR/attachments/objects/<first two hex digits>/<sha256>, so a PDF
+forwarded to fifty messages takes the disk space of one. A small SQLite index
+maps (mailbox, message ID, part ID) to the digest, so asking for the same
+attachment again costs no API call at all:
+
+    store = get_default_store()
+    stored = store.lookup('bot@example.com', email_id, '1')
+    if stored is None:
+        stored = store.add('bot@example.com', email_id, '1', 'report.pdf', 'application/pdf', chunks)
+
+Files are written to a temporary name while being hashed and renamed into
+place, so a crash never leaves a partial object under a digest name.
+"""
+import os
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from typing import Iterable, NamedTuple, Optional
+from bmail.message_cache import cache_dir
+
+class StoredAttachment(NamedTuple):
+    """An attachment saved in the store.
+
+    Attributes:
+        path: Local path of the attachment's bytes (shared by identical attachments)
+        sha256: Hex SHA-256 digest of the bytes
+        filename: File name given in the message
+        mime_type: MIME type given in the message
+        size: Size in bytes
+        downloaded: True if this call fetched it from Gmail, False if it was already stored
+    """
+    path: str
+    sha256: str
+    filename: str
+    mime_type: str
+    size: int
+    downloaded: bool
+
+class AttachmentStore:
+    """Attachment files named by content digest, indexed by message and part."""
+
+    def __init__(self, root: str=None):
+        """
+        Args:
+            root: Directory of the store (default BMAIL_CACHE_DIR/attachments)
+        """
+        self.root = root or os.path.join(cache_dir(), 'attachments')
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS refs (mailbox TEXT NOT NULL, message_id TEXT NOT NULL, part_id TEXT NOT NULL, sha256 TEXT NOT NULL, filename TEXT NOT NULL, mime_type TEXT NOT NULL, size INTEGER NOT NULL, PRIMARY KEY (mailbox, message_id, part_id))')
+
+    def close(self) -> None:
+        """Close the index database."""
+        with self._lock:
+            self._conn.close()
+
+    def object_path(self, sha256: str) -> str:
+        """Return the path where bytes with this digest are stored."""
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def lookup(self, mailbox: str, message_id: str, part_id: str) -> Optional[StoredAttachment]:
+        """
+        Return a previously stored attachment, or None.
+
+        Args:
+            mailbox: Mailbox the message belongs to
+            message_id: Gmail message ID
+            part_id: Gmail partId of the attachment
+
+        Returns:
+            Optional[StoredAttachment]: The stored attachment, or None if it was never stored or its file is gone
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT sha256, filename, mime_type, size FROM refs WHERE mailbox = ? AND message_id = ? AND part_id = ?', (mailbox.lower(), message_id, part_id)).fetchone()
+        if row is None:
+            return None
+        sha256, filename, mime_type, size = row
+        path = self.object_path(sha256)
+        if not os.path.exists(path):
+            return None
+        return StoredAttachment(path, sha256, filename, mime_type, size, False)
+
+    def add(self, mailbox: str, message_id: str, part_id: str, filename: str, mime_type: str, chunks: Iterable[bytes]) -> StoredAttachment:
+        """
+        Write an attachment's bytes into the store and index them.
+
+        Chunks are hashed and written as they arrive; if an object with the
+        same digest already exists the new copy is discarded.
+
+        Args:
+            mailbox: Mailbox the message belongs to
+            message_id: Gmail message ID
+            part_id: Gmail partId of the attachment
+            filename: File name given in the message
+            mime_type: MIME type given in the message
+            chunks: The attachment's bytes, in order
+
+        Returns:
+            StoredAttachment: The stored attachment (downloaded=True)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(prefix='.incoming-', dir=os.path.join(self.root, 'objects'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.object_path(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(temp_path)
+            else:
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO refs (mailbox, message_id, part_id, sha256, filename, mime_type, size) VALUES (?, ?, ?, ?, ?, ?, ?)', (mailbox.lower(), message_id, part_id, sha256, filename, mime_type, size))
+        return StoredAttachment(path, sha256, filename, mime_type, size, True)
+
+    def objects(self) -> int:
+        """Return the number of distinct attachment files in the store."""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(DISTINCT sha256) FROM refs').fetchone()[0]
+
+_DEFAULT_STORE = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_default_store() -> AttachmentStore:
+    """Return the process-wide store at BMAIL_CACHE_DIR/attachments."""
+    global _DEFAULT_STORE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_STORE is None:
+            _DEFAULT_STORE = AttachmentStore()
+        return _DEFAULT_STORE
+
+def reset_default_store() -> None:
+    """Close the process-wide store so the next use re-reads the environment."""
+    global _DEFAULT_STORE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_STORE is not None:
+            _DEFAULT_STORE.close()
+        _DEFAULT_STORE = None
+
+def resolve_store(store: Optional[AttachmentStore]) -> AttachmentStore:
+    """Map a store argument to a store: None means the default store."""
+    return get_default_store() if store is None else store
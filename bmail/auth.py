@@ -1,19 +1,51 @@
+from __future__ import annotations
 import os.path
-import pickle
-from typing import Union
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.discovery import Resource
-from google.oauth2 import service_account
-from googleapiclient.discovery import build, Resource
-
-def get_gmail_service(credentials_path: str, delegated_email: str) -> Union[Resource, str]:
+import threading
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+from bmail import discovery, gmail_client
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+SCOPES = ('https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.compose', 'https://www.googleapis.com/auth/gmail.send')
+
+# Built services keyed by (credentials path, delegated email, scopes). The
+# google-auth transport attached to each service refreshes its token only
+# when it has expired, so a cached service never re-reads the key file.
+_SERVICE_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+# Service account credentials keyed by (credentials path, scopes). Each
+# delegated identity derives its credentials from these with with_subject,
+# so serving many users reads and parses the key file once.
+_KEY_CACHE = {}
+
+def _cache_key(credentials_path: str, delegated_email: str, scopes: Iterable[str]) -> tuple:
+    return (os.path.abspath(credentials_path), delegated_email.lower(), tuple(sorted(scopes)))
+
+def _load_key(credentials_path: str, scopes: Iterable[str]):
+    key = (os.path.abspath(credentials_path), tuple(sorted(scopes)))
+    with _CACHE_LOCK:
+        credentials = _KEY_CACHE.get(key)
+    if credentials is None:
+        # Imported here so that importing bmail does not load the Google auth stack.
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=list(scopes))
+        with _CACHE_LOCK:
+            credentials = _KEY_CACHE.setdefault(key, credentials)
+    return credentials
+
+def get_gmail_service(credentials_path: str, delegated_email: str, scopes: Iterable[str]=SCOPES) -> Union[Resource, str]:
     """Get an authenticated Gmail API service object using service account credentials.
 
+    Services are cached per (credentials_path, delegated_email, scopes), so only
+    the first call for an identity loads the key file, builds the API client and
+    verifies it with getProfile. Later calls return the cached service. The
+    client is built from the pruned discovery document in bmail.discovery.
+
     Args:
         credentials_path (str): Path to the service account JSON key file
-        delegated_email (str, optional): Email address to delegate access to. If None, uses config default.
+        delegated_email (str): Email address to delegate access to
+        scopes (Iterable[str], optional): OAuth scopes to request. Defaults to SCOPES.
 
     Returns:
         Union[Resource, str]: Either an authenticated Gmail service object or an error message
@@ -23,17 +55,67 @@ def get_gmail_service(credentials_path: str, delegated_email: str) -> Union[Reso
         1. Domain-wide delegation enabled
         2. Required Gmail API scopes authorized in Google Workspace
     """
+    key = _cache_key(credentials_path, delegated_email, scopes)
+    with _CACHE_LOCK:
+        service = _SERVICE_CACHE.get(key)
+    if service is not None:
+        return service
     if not os.path.exists(credentials_path):
         return f'Error: Credentials file not found at {credentials_path}'
     try:
-        SCOPES = ['https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.compose', 'https://www.googleapis.com/auth/gmail.send']
-        credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
+        credentials = _load_key(credentials_path, scopes)
         delegated_credentials = credentials.with_subject(delegated_email)
-        service = build('gmail', 'v1', credentials=delegated_credentials)
+        service = discovery.build_gmail(credentials=delegated_credentials)
         try:
-            service.users().getProfile(userId='me').execute()
-            return service
+            profile = service.users().getProfile(userId='me').execute()
         except Exception as e:
             return f'Error verifying service: {str(e)}'
     except Exception as e:
         return f'Error during authentication: {str(e)}'
+    # The verification call already told us the mailbox address; keep it for send_gmail.
+    gmail_client.remember_sender_address(service, profile.get('emailAddress', delegated_email))
+    with _CACHE_LOCK:
+        # Another thread may have built the same service meanwhile; keep the first.
+        return _SERVICE_CACHE.setdefault(key, service)
+
+def install_service(credentials_path: str, delegated_email: str, service: Resource, scopes: Iterable[str]=SCOPES) -> None:
+    """Place a prebuilt service in the cache so get_gmail_service returns it.
+
+    Used to route bmail at a stand-in backend such as bmail.fake_gmail; the
+    credentials file does not need to exist.
+
+    Args:
+        credentials_path (str): Credentials path callers will pass
+        delegated_email (str): Delegated address callers will pass
+        service (Resource): Service to return for that identity
+        scopes (Iterable[str], optional): OAuth scopes the key is built with. Defaults to SCOPES.
+    """
+    gmail_client.remember_sender_address(service, delegated_email)
+    with _CACHE_LOCK:
+        _SERVICE_CACHE[_cache_key(credentials_path, delegated_email, scopes)] = service
+
+def invalidate_service(credentials_path: Optional[str]=None, delegated_email: Optional[str]=None) -> int:
+    """Drop cached Gmail services so the next call rebuilds them.
+
+    Use this when a service account key is revoked or rotated, or when delegation
+    for a user is withdrawn. Arguments act as filters; with no arguments the whole
+    cache is cleared. Unless delegated_email is given, the loaded key file is
+    forgotten too, so a rotated key is re-read.
+
+    Args:
+        credentials_path (str, optional): Only evict services built from this key file
+        delegated_email (str, optional): Only evict services delegated to this address
+
+    Returns:
+        int: Number of cached services removed
+    """
+    path = os.path.abspath(credentials_path) if credentials_path else None
+    email = delegated_email.lower() if delegated_email else None
+    with _CACHE_LOCK:
+        stale = [key for key in _SERVICE_CACHE if (path is None or key[0] == path) and (email is None or key[1] == email)]
+        for key in stale:
+            del _SERVICE_CACHE[key]
+        if email is None:
+            for key in [key for key in _KEY_CACHE if path is None or key[0] == path]:
+                del _KEY_CACHE[key]
+    return len(stale)
@@ -0,0 +1,84 @@
+"""
+Startup benchmark for short-lived agent processes.
+
+Each scenario runs in a fresh interpreter and the wall time of the whole
+process is measured, so interpreter start, imports and (for first_call)
+building the Gmail client and making one API call are all included:
+
+    python -m bmail.bench_startup --runs 10
+
+first_call runs check_inbox against bmail.fake_gmail, so no credentials or
+network are needed. It is measured both with a cold cache directory (no
+cached discovery document) and a warm one.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import NamedTuple
+
+FIRST_CALL = """
+from bmail import llm_email_tools, loadtest
+from bmail.fake_gmail import FakeGmail
+backend = FakeGmail(seed=0)
+loadtest.seed_mailbox(backend, 1)
+with loadtest.fake_environment(backend):
+    llm_email_tools.check_inbox()
+"""
+
+SCENARIOS = {'baseline': 'pass', 'import_bmail': 'import bmail', 'import_tools': 'import bmail.llm_email_tools', 'first_call': FIRST_CALL}
+
+class StartupStats(NamedTuple):
+    """Wall times of one scenario in seconds."""
+    name: str
+    median: float
+    best: float
+    runs: int
+
+    def __str__(self):
+        return f'{self.name:<20} median {self.median * 1000:7.1f} ms  best {self.best * 1000:7.1f} ms  ({self.runs} runs)'
+
+def time_process(code: str, env: dict) -> float:
+    """Run code in a fresh interpreter and return its wall time."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    return time.perf_counter() - start
+
+def run_benchmark(runs: int=10) -> list:
+    """
+    Time every scenario.
+
+    Args:
+        runs: Processes started per scenario
+
+    Returns:
+        list: StartupStats per scenario, plus first_call_cold with an empty cache directory each run
+    """
+    env = dict(os.environ)
+    env.setdefault('BMAIL_SENDER', 'bot@example.com')
+    results = []
+    with tempfile.TemporaryDirectory() as warm:
+        env['BMAIL_CACHE_DIR'] = warm
+        time_process(FIRST_CALL, env)
+        for name, code in SCENARIOS.items():
+            times = [time_process(code, env) for _ in range(runs)]
+            results.append(StartupStats(name, statistics.median(times), min(times), runs))
+    times = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cold:
+            env['BMAIL_CACHE_DIR'] = cold
+            times.append(time_process(FIRST_CALL, env))
+    results.append(StartupStats('first_call_cold', statistics.median(times), min(times), runs))
+    return results
+
+def main(argv: list=None) -> None:
+    parser = argparse.ArgumentParser(description='Measure bmail import and first-call time in fresh processes.')
+    parser.add_argument('--runs', type=int, default=10, help='processes started per scenario')
+    args = parser.parse_args(argv)
+    for stats in run_benchmark(args.runs):
+        print(stats)
+if __name__ == '__main__':
+    main()
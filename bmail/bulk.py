@@ -0,0 +1,161 @@
+from __future__ import annotations
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple, Optional
+from bmail import gmail_client
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+DEFAULT_WORKERS = 8
+
+_LOCAL = threading.local()
+
+def worker_http(service: Resource):
+    """
+    Return an HTTP transport for the calling thread that authenticates like the service.
+
+    httplib2 connections are not thread safe, so each thread gets its own
+    AuthorizedHttp wrapped around the service's (shared) credentials. Services
+    built without google-auth credentials (e.g. test doubles) get None, meaning
+    "use the service's own transport".
+
+    Args:
+        service: Authenticated Gmail API service object
+
+    Returns:
+        Optional[AuthorizedHttp]: Transport private to the current thread, or None
+    """
+    credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+    if credentials is None:
+        return None
+    transports = getattr(_LOCAL, 'transports', None)
+    if transports is None:
+        transports = _LOCAL.transports = {}
+    http = transports.get(id(credentials))
+    if http is None:
+        import httplib2
+        import google_auth_httplib2
+        http = transports[id(credentials)] = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return http
+
+class SendResult(NamedTuple):
+    """Outcome of one message sent by send_many.
+
+    Attributes:
+        index: Position of the message in the input
+        to_addr: Recipient the message was addressed to
+        result: send_gmail's success message or error description
+        ok: True if the message was sent
+        seconds: Time spent sending this message
+    """
+    index: int
+    to_addr: str
+    result: str
+    ok: bool
+    seconds: float
+
+class SendManyReport(NamedTuple):
+    """Summary of a send_many run.
+
+    Attributes:
+        results: SendResult per message, in input order (empty if results were not kept)
+        sent: Number of messages sent
+        failed: Number of messages that failed
+        elapsed: Wall-clock seconds for the whole run
+    """
+    results: list
+    sent: int
+    failed: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        """Messages sent per second."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f'Sent {self.sent} of {self.sent + self.failed} emails ({self.failed} failed) in {self.elapsed:.1f}s, {self.throughput:.1f} emails/s'
+
+def ordered_map(fn: Callable, items: Iterable, max_workers: int=DEFAULT_WORKERS) -> Iterator:
+    """
+    Call fn(index, item) for each item on a bounded thread pool, yielding results in input order.
+
+    Items are consumed lazily and at most 2 * max_workers calls are in flight.
+    Workers run in a copy of the caller's context, so API calls keep its
+    metrics operation tag.
+
+    Args:
+        fn: Callable(index, item) run on a worker thread
+        items: Inputs, read lazily
+        max_workers: Number of worker threads
+
+    Yields:
+        The return value of fn for each item, in input order
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bmail-send') as executor:
+        pending = deque()
+        for index, item in enumerate(items):
+            pending.append(executor.submit(contextvars.copy_context().run, fn, index, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_send(service: Resource, messages: Iterable[dict], max_workers: int=DEFAULT_WORKERS, http_factory: Optional[Callable]=None) -> Iterator[SendResult]:
+    """
+    Send messages on a bounded worker pool, yielding results in input order.
+
+    Messages are consumed lazily and at most 2 * max_workers are in flight, so
+    arbitrarily long (even generated) inputs use bounded memory.
+
+    Args:
+        service: Authenticated Gmail API service object
+        messages: Dicts of send_gmail keyword arguments (to_addr, cc, bcc, subject, body, ...)
+        max_workers: Number of concurrent senders
+        http_factory: Optional callable(service) giving the calling thread its transport;
+            defaults to worker_http
+
+    Yields:
+        SendResult: One per message, in input order
+
+    Raises:
+        Exception: If the sender address cannot be looked up (before anything is sent)
+    """
+    http_factory = http_factory or worker_http
+    # Resolve the From address once, before threads could race to look it up.
+    from_addr = gmail_client.get_sender_address(service)
+
+    def send(index, message):
+        started = time.perf_counter()
+        kwargs = {'cc': '', 'bcc': '', 'from_addr': from_addr}
+        kwargs.update(message)
+        try:
+            result = gmail_client.send_gmail(service, http=http_factory(service), **kwargs)
+        except Exception as e:
+            result = f'Failed to send email: {str(e)}'
+        return SendResult(index, kwargs.get('to_addr', ''), result, result.startswith('Email sent successfully'), time.perf_counter() - started)
+    yield from ordered_map(send, messages, max_workers)
+
+def send_many(service: Resource, messages: Iterable[dict], max_workers: int=DEFAULT_WORKERS, http_factory: Optional[Callable]=None) -> SendManyReport:
+    """
+    Send many messages in parallel and report per-message results.
+
+    Args:
+        service: Authenticated Gmail API service object
+        messages: Dicts of send_gmail keyword arguments (to_addr, cc, bcc, subject, body, ...)
+        max_workers: Number of concurrent senders
+        http_factory: Optional callable(service) giving the calling thread its transport
+
+    Returns:
+        SendManyReport: Results in input order with sent/failed counts and throughput
+
+    Raises:
+        Exception: If the sender address cannot be looked up (before anything is sent)
+    """
+    started = time.perf_counter()
+    results = list(iter_send(service, messages, max_workers, http_factory))
+    sent = sum((1 for r in results if r.ok))
+    return SendManyReport(results, sent, len(results) - sent, time.perf_counter() - started)
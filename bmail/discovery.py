@@ -0,0 +1,110 @@
+from __future__ import annotations
+import os
+import json
+import threading
+from typing import TYPE_CHECKING
+from bmail.message_cache import cache_dir
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+# The parts of the Gmail API bmail calls. Everything else is pruned from the
+# cached discovery document, which keeps it a fraction of the full size.
+USED_RESOURCES = ('messages', 'history', 'threads')
+USED_USER_METHODS = ('getProfile',)
+
+_DOCUMENT = None
+_LOCK = threading.Lock()
+
+def _source_document() -> dict:
+    """Return the full Gmail v1 discovery document shipped with googleapiclient."""
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        text = get_static_doc('gmail', 'v1')
+    except ImportError:
+        text = None
+    if text is None:
+        import httplib2
+        from googleapiclient.discovery import build
+        return build('gmail', 'v1', http=httplib2.Http(), cache_discovery=False)._rootDesc
+    return json.loads(text)
+
+def _refs(node, found: set) -> None:
+    if isinstance(node, dict):
+        if '$ref' in node:
+            found.add(node['$ref'])
+        for value in node.values():
+            _refs(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _refs(value, found)
+
+def prune(document: dict) -> dict:
+    """
+    Reduce a Gmail discovery document to the resources and schemas bmail uses.
+
+    Args:
+        document: Full discovery document
+
+    Returns:
+        dict: Copy keeping users.getProfile, the USED_RESOURCES and every schema they reference
+    """
+    users = document['resources']['users']
+    pruned = {key: value for key, value in document.items() if key not in ('resources', 'schemas', 'icons', 'description')}
+    pruned['resources'] = {'users': {'methods': {name: users['methods'][name] for name in USED_USER_METHODS if name in users.get('methods', {})}, 'resources': {name: users['resources'][name] for name in USED_RESOURCES if name in users.get('resources', {})}}}
+    schemas = document.get('schemas', {})
+    wanted = set()
+    _refs(pruned['resources'], wanted)
+    pending = list(wanted)
+    while pending:
+        found = set()
+        _refs(schemas.get(pending.pop(), {}), found)
+        pending.extend(found - wanted)
+        wanted |= found
+    pruned['schemas'] = {name: schemas[name] for name in sorted(wanted) if name in schemas}
+    return pruned
+
+def cache_path() -> str:
+    """Path of the cached document; it is keyed by googleapiclient version, which ships the source."""
+    from googleapiclient.version import __version__
+    return os.path.join(cache_dir(), f'gmail-v1-discovery-{__version__}.json')
+
+def load_document() -> dict:
+    """
+    Return the pruned Gmail discovery document.
+
+    It is read from the bmail cache directory, so every process after the
+    first skips loading and pruning the full document. Within a process it
+    is parsed once.
+    """
+    global _DOCUMENT
+    with _LOCK:
+        if _DOCUMENT is not None:
+            return _DOCUMENT
+        path = cache_path()
+        try:
+            with open(path, encoding='utf-8') as f:
+                _DOCUMENT = json.load(f)
+        except (OSError, ValueError):
+            _DOCUMENT = prune(_source_document())
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp = f'{path}.{os.getpid()}.tmp'
+                with open(temp, 'w', encoding='utf-8') as f:
+                    json.dump(_DOCUMENT, f, separators=(',', ':'))
+                os.replace(temp, path)
+            except OSError:
+                pass
+        return _DOCUMENT
+
+def build_gmail(**kwargs) -> Resource:
+    """
+    Build a Gmail v1 service from the cached document.
+
+    Args:
+        **kwargs: Passed to googleapiclient.discovery.build_from_document (credentials, http, ...)
+
+    Returns:
+        Resource: Gmail API service object
+    """
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(load_document(), **kwargs)
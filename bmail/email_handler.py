@@ -1,11 +1,20 @@
 import os
-from typing import Union
+import json
+import mimetypes
+from typing import Optional, Union
 from email import message_from_string
 from email.message import EmailMessage
 from email.mime.text import MIMEText
 import base64
 from bmail.auth import get_gmail_service
-from bmail import gmail_client
+from bmail import bulk, gmail_client, mailmerge, metrics, outbox
+from bmail.attachment_store import StoredAttachment
+from bmail.message import Message, html_to_text
+from bmail.search_index import get_default_index
+from bmail.sync import get_default_sync
+
+# Page tokens of results answered by the local search index carry this prefix.
+LOCAL_PAGE_PREFIX = 'local:'
 
 def _get_service(creds_path: str, use_sender: bool=True) -> Union[str, object]:
     """Get Gmail service using credentials and delegated email from environment.
@@ -21,7 +30,8 @@ def _get_service(creds_path: str, use_sender: bool=True) -> Union[str, object]:
     except KeyError:
         return f'Error: {env_var} environment variable not set'
 
-def send_email(creds_path: str, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None) -> str:
+@metrics.operation('send_email')
+def send_email(creds_path: str, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, from_addr: str=None, attachments: list=None) -> str:
     """Send an email using Gmail API.
 
     Args:
@@ -34,6 +44,8 @@ def send_email(creds_path: str, to_addr: str, cc: str, bcc: str, subject: str, b
         thread_id (str, optional): Gmail thread ID for replies
         in_reply_to (str, optional): Message-ID being replied to
         references (str, optional): References header for threading
+        from_addr (str, optional): From address override (defaults to the mailbox address)
+        attachments (list, optional): Paths of files to attach (streamed via resumable upload)
 
     Returns:
         str: Success message or error description
@@ -41,53 +53,300 @@ def send_email(creds_path: str, to_addr: str, cc: str, bcc: str, subject: str, b
     service = _get_service(creds_path)
     if isinstance(service, str):
         return f'Authentication error: {service}'
-    return gmail_client.send_gmail(service, to_addr, cc, bcc, subject, body, thread_id, in_reply_to, references)
+    return gmail_client.send_gmail(service, to_addr, cc, bcc, subject, body, thread_id, in_reply_to, references, from_addr=from_addr, attachments=attachments)
+
+def queue_email(creds_path: str, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, from_addr: str=None, attachments: list=None) -> str:
+    """Queue an email in the persistent outbox and return without waiting for Gmail.
+
+    The message is written to the outbox spool before this returns and is sent
+    by a background worker, retried until Gmail accepts it. Takes the same
+    arguments as send_email; attachment files are read when the message is
+    sent, so they must stay in place until then.
+
+    Returns:
+        str: Confirmation with the message's Message-ID, or error description
+    """
+    sender = os.environ.get('BMAIL_SENDER')
+    if not sender:
+        return 'Error: BMAIL_SENDER environment variable not set'
+    fields = {'to_addr': to_addr, 'cc': cc, 'bcc': bcc, 'subject': subject, 'body': body, 'thread_id': thread_id, 'in_reply_to': in_reply_to, 'references': references, 'from_addr': from_addr, 'attachments': attachments}
+    try:
+        message_id = outbox.get_default_outbox().enqueue(creds_path, sender, {k: v for k, v in fields.items() if v is not None})
+        outbox.ensure_worker()
+    except Exception as e:
+        return f'Failed to queue email: {str(e)}'
+    return f'Email queued. Message-ID: {message_id}'
+
+@metrics.operation('reply_to_email')
+def reply_to_email(creds_path: str, email_id: str, body: str) -> str:
+    """Reply to an email on its thread.
+
+    Only the original's reply headers are fetched (format='metadata'), never
+    its body or attachments.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        email_id (str): Gmail message ID to reply to
+        body (str): Reply body text
+
+    Returns:
+        str: Success message or error description
+    """
+    service = _get_service(creds_path)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    reply = gmail_client.build_reply(gmail_client.get_reply_headers(service, email_id))
+    if isinstance(reply, str):
+        return reply
+    return gmail_client.send_gmail(service, reply.pop('to_addr'), '', '', reply.pop('subject'), body, **reply)
+
+@metrics.operation('send_many')
+def send_many(creds_path: str, messages: list, max_workers: int=bulk.DEFAULT_WORKERS) -> str:
+    """Send many emails in parallel, each worker thread on its own HTTP transport.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        messages (list): Dicts of send_email keyword arguments (to_addr, cc, bcc, subject, body, ...)
+        max_workers (int): Number of concurrent senders
+
+    Returns:
+        str: Summary line followed by one "index:to_addr:error" line per failed message
+    """
+    service = _get_service(creds_path)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    try:
+        report = bulk.send_many(service, messages, max_workers)
+    except Exception as e:
+        return f'Failed to send emails: {str(e)}'
+    lines = [str(report)]
+    lines.extend((f'{r.index}:{r.to_addr}:{r.result}' for r in report.results if not r.ok))
+    return '\n'.join(lines)
+
+def mail_merge(creds_path: str, subject: str, body: str, recipients: list, to: str='{email}', max_workers: int=bulk.DEFAULT_WORKERS) -> str:
+    """Send one personalised email per recipient from a {field} template.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        subject (str): Subject template, e.g. "Your {month} statement"
+        body (str): Plain text body template
+        recipients (list): Dicts of field values, one per recipient
+        to (str): To template (default "{email}")
+        max_workers (int): Number of concurrent senders
+
+    Returns:
+        str: Summary line followed by one "index:to_addr:error" line per failed recipient
+    """
+    try:
+        template = mailmerge.MergeTemplate(subject, body, to=to)
+    except ValueError as e:
+        return f'Invalid template: {str(e)}'
+    service = _get_service(creds_path)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    try:
+        report = mailmerge.send_merge(service, template, recipients, max_workers)
+    except Exception as e:
+        return f'Failed to send mail merge: {str(e)}'
+    lines = [str(report)]
+    lines.extend((f'{r.index}:{r.to_addr}:{r.result}' for r in report.results if not r.ok))
+    return '\n'.join(lines)
 
-def receive_email(creds_path: str, email_id: str) -> str:
+@metrics.operation('receive_email')
+def receive_email(creds_path: str, email_id: str, max_chars: Optional[int]=None) -> str:
     """Receive a specific email.
 
     Args:
         creds_path (str): Path to Gmail API credentials file
         email_id (str): Gmail message ID to fetch
+        max_chars (int, optional): Return at most this many characters of body text
 
     Returns:
         str: Formatted email content or error description
     """
+    # The identity is resolved first: cached messages are only served to their own mailbox.
     service = _get_service(creds_path)
     if isinstance(service, str):
         return f'Authentication error: {service}'
-    result = gmail_client.get_email(service, email_id)
+    return format_email(gmail_client.get_email(service, email_id), max_chars)
+
+def format_email(result: Union[Message, str], max_chars: Optional[int]=None) -> str:
+    """Format a gmail_client.get_email result as the text read_email returns.
+
+    Args:
+        result: Message or error message from get_email
+        max_chars: Truncate the body to this many characters; only that much is decoded
+
+    Returns:
+        str: Formatted email content or error description
+    """
     if isinstance(result, str):
         return result
-    if not isinstance(result, tuple) or len(result) != 2:
+    if not isinstance(result, Message):
         return 'Error: Unexpected response format from gmail_client'
-    raw_content, metadata = result
-    try:
-        from email import message_from_bytes
-        email_msg = message_from_bytes(raw_content)
-        formatted_content = []
-        formatted_content.append(f"From: {email_msg['from']}")
-        formatted_content.append(f"Subject: {email_msg['subject']}")
-        formatted_content.append(f"To: {email_msg['to']}")
-        if metadata.get('message_id'):
-            formatted_content.append(f"Message-ID: {metadata['message_id']}")
-        if metadata.get('thread_id'):
-            formatted_content.append(f"Thread-ID: {metadata['thread_id']}")
-        formatted_content.append('\nBody:')
-        if email_msg.is_multipart():
-            for part in email_msg.walk():
-                if part.get_content_type() == 'text/plain':
-                    formatted_content.append(part.get_payload(decode=True).decode('utf-8'))
+    formatted_content = [f'From: {result.sender}', f'Subject: {result.subject}', f'To: {result.to}']
+    if result.message_id:
+        formatted_content.append(f'Message-ID: {result.message_id}')
+    if result.thread_id:
+        formatted_content.append(f'Thread-ID: {result.thread_id}')
+    formatted_content.append('\nBody:')
+    if max_chars is None:
+        formatted_content.append(result.body)
+    else:
+        # Asking for one extra character tells us whether anything was cut.
+        body = result.text(max_chars + 1)
+        formatted_content.append(body[:max_chars])
+        if len(body) > max_chars:
+            formatted_content.append(f'[Body truncated after {max_chars} characters]')
+    return '\n'.join(formatted_content)
+
+@metrics.operation('read_thread')
+def read_thread(creds_path: str, thread_id: str, max_chars_per_message: Optional[int]=None, strip_quotes: bool=True) -> str:
+    """Read a whole thread in one API call.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        thread_id (str): Gmail thread ID
+        max_chars_per_message (int, optional): Return at most this many body characters per message
+        strip_quotes (bool): If True, drop quoted history from each message body
+
+    Returns:
+        str: Formatted thread or error description
+    """
+    service = _get_service(creds_path)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    return format_thread(thread_id, gmail_client.get_thread(service, thread_id), max_chars_per_message, strip_quotes)
+
+def format_thread(thread_id: str, result: Union[list, str], max_chars_per_message: Optional[int]=None, strip_quotes: bool=True) -> str:
+    """Format a gmail_client.get_thread result as the text read_thread returns.
+
+    The thread subject is given once; each message gets a one-line header
+    (position, ID, sender, date) followed by its body.
+
+    Args:
+        thread_id: ID of the thread
+        result: Messages or error message from get_thread
+        max_chars_per_message: Truncate each body to this many characters; only that much is decoded
+        strip_quotes: If True, drop quoted history from each body
+
+    Returns:
+        str: Formatted thread or error description
+    """
+    if isinstance(result, str):
+        return result
+    if not result:
+        return f'Error: Thread {thread_id} has no messages'
+    formatted_content = [f'Thread-ID: {thread_id}', f'Subject: {result[0].subject}', f'Messages: {len(result)}']
+    for position, message in enumerate(result, 1):
+        formatted_content.append(f"\n[{position}/{len(result)}] ID: {message.id} | From: {message.sender} | Date: {message.header('date')}")
+        limit = max_chars_per_message + 1 if max_chars_per_message is not None else None
+        body = message.unquoted_text(limit) if strip_quotes else message.text(limit)
+        if limit is not None and len(body) > max_chars_per_message:
+            formatted_content.append(body[:max_chars_per_message])
+            formatted_content.append(f'[Body truncated after {max_chars_per_message} characters]')
         else:
-            payload = email_msg.get_payload(decode=True)
-            if payload:
-                formatted_content.append(payload.decode('utf-8'))
+            formatted_content.append(body)
+    return '\n'.join(formatted_content)
+
+def format_attachments(email_id: str, result: Union[list, str]) -> str:
+    """Format a gmail_client.list_attachments result as "part_id:filename:mime_type:size" lines.
+
+    Args:
+        email_id: ID of the email the attachments belong to
+        result: Attachment list or error message from list_attachments
+
+    Returns:
+        str: One line per attachment, "No attachments in email <id>", or error description
+    """
+    if isinstance(result, str):
+        return result
+    if not result:
+        return f'No attachments in email {email_id}'
+    return '\n'.join((f'{a.part_id}:{a.filename}:{a.mime_type}:{a.size}' for a in result))
+
+def attachment_text(stored: StoredAttachment, max_chars: int) -> Optional[str]:
+    """Extract up to max_chars characters of text from a saved attachment.
+
+    Text and HTML attachments are read directly; PDFs are read with pypdf when
+    it is installed (pip install "bmail[pdf]"). Other types have no extract.
+    Attachments labelled application/octet-stream are typed by file name.
+
+    Args:
+        stored: Attachment saved by gmail_client.download_attachment
+        max_chars: Maximum number of characters to return
+
+    Returns:
+        Optional[str]: The extract, or None if the type has none
+    """
+    mime_type = stored.mime_type.lower()
+    if mime_type == 'application/octet-stream':
+        # Many mailers label every attachment octet-stream; trust the file name instead.
+        mime_type = mimetypes.guess_type(stored.filename)[0] or mime_type
+    if mime_type.startswith('text/'):
+        # Markup is stripped after reading, so an HTML budget covers the markup too.
+        budget = max_chars * 4 if mime_type == 'text/html' else max_chars
+        with open(stored.path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read(budget + 1)
+        return html_to_text(text)[:max_chars + 1] if mime_type == 'text/html' else text
+    if mime_type == 'application/pdf':
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            return None
+        chunks = []
+        remaining = max_chars + 1
+        for page in PdfReader(stored.path).pages:
+            chunk = page.extract_text() or ''
+            chunks.append(chunk[:remaining])
+            remaining -= len(chunks[-1])
+            if remaining <= 0:
+                break
+        return '\n'.join(chunks)
+    return None
+
+@metrics.operation('get_attachment')
+def get_attachment(creds_path: str, email_id: str, attachment: str=None, max_chars: Optional[int]=None) -> str:
+    """List an email's attachments, or save one to the local attachment store.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        email_id (str): Gmail message ID
+        attachment (str, optional): Part ID or file name of the attachment to save;
+            without it the attachments are listed
+        max_chars (int, optional): Characters of extracted text to include (0 for none)
+
+    Returns:
+        str: Attachment list, or the saved file's path and details followed by a text extract, or error description
+    """
+    service = _get_service(creds_path)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    attachments = gmail_client.list_attachments(service, email_id)
+    if attachment is None or isinstance(attachments, str):
+        return format_attachments(email_id, attachments)
+    match = next((a for a in attachments if a.part_id == attachment), None) or next((a for a in attachments if a.filename == attachment), None)
+    if match is None:
+        return f'Email {email_id} has no attachment {attachment!r}'
+    stored = gmail_client.download_attachment(service, email_id, match.part_id)
+    if isinstance(stored, str):
+        return stored
+    lines = [f'Saved: {stored.path}', f'Filename: {stored.filename}', f'Type: {stored.mime_type}', f'Size: {stored.size} bytes', f'SHA-256: {stored.sha256}']
+    if max_chars != 0:
+        try:
+            text = attachment_text(stored, max_chars if max_chars is not None else stored.size)
+        except Exception as e:
+            text = f'[Text extraction failed: {str(e)}]'
+        if text is not None:
+            lines.append('\nText:')
+            if max_chars is not None and len(text) > max_chars:
+                lines.append(text[:max_chars])
+                lines.append(f'[Text truncated after {max_chars} characters]')
             else:
-                formatted_content.append(email_msg.get_payload())
-        return '\n'.join(formatted_content)
-    except Exception as e:
-        return f'Error parsing email content: {str(e)}'
+                lines.append(text)
+    return '\n'.join(lines)
 
+@metrics.operation('archive_email')
 def archive_email(creds_path: str, email_id: str, use_sender: bool=True) -> str:
     """Archive an email.
 
@@ -103,21 +362,167 @@ def archive_email(creds_path: str, email_id: str, use_sender: bool=True) -> str:
     service = _get_service(creds_path, use_sender)
     if isinstance(service, str):
         return f'Authentication error: {service}'
-    return gmail_client.archive_email(service, gmail_id)
+    # The single-ID form of archive_emails does the same get-then-modify check, with a structured outcome.
+    results = gmail_client.archive_emails(service, [gmail_id], verify=True)
+    _forget_archived(service, results)
+    return format_archive_results(results)
 
-def list_emails(creds_path: str, query: str=None, use_sender: bool=True) -> str:
-    """List emails in the inbox.
+@metrics.operation('archive_emails')
+def archive_emails(creds_path: str, email_ids: list, use_sender: bool=True, verify: bool=False) -> str:
+    """Archive many emails in as few API calls as possible.
 
     Args:
         creds_path (str): Path to Gmail API credentials file
-        query (str, optional): Gmail search query to filter results
+        email_ids (list): IDs of emails to archive
         use_sender (bool): If True, use BMAIL_SENDER account, else use TEST_EMAIL
+        verify (bool): If True, check each email exists and is in the inbox first
 
     Returns:
-        str: Newline-separated list of "sender: subject" or error message
+        str: One result line per email ID or error description
     """
+    gmail_ids = [email_id.replace('.eml', '') if email_id.endswith('.eml') else email_id for email_id in email_ids]
+    if not gmail_ids:
+        return 'Error: No email IDs given'
     service = _get_service(creds_path, use_sender)
     if isinstance(service, str):
         return f'Authentication error: {service}'
-    return gmail_client.list_emails(service, query=query)
-    return gmail_client.list_emails(service, query=query)
\ No newline at end of file
+    results = gmail_client.archive_emails(service, gmail_ids, verify=verify)
+    _forget_archived(service, results)
+    return format_archive_results(results)
+
+def _search_locally(service, query: Optional[str], max_results: int, page_token: Optional[str]) -> Optional[tuple]:
+    """Answer a listing from the local search index, or return None if the server must."""
+    index = get_default_index()
+    if index is None or (page_token and not page_token.startswith(LOCAL_PAGE_PREFIX)):
+        return None
+    offset = int(page_token[len(LOCAL_PAGE_PREFIX):]) if page_token else 0
+    try:
+        result = index.search(service, query, max_results, offset)
+    except Exception:
+        # A failed refresh leaves the index stale; the server still has the answer.
+        return None
+    if result is None:
+        return None
+    summaries, next_offset = result
+    return (summaries, f'{LOCAL_PAGE_PREFIX}{next_offset}' if next_offset is not None else None)
+
+def _forget_archived(service, results: list) -> None:
+    """Drop archived messages from the local search index so it does not wait for a refresh."""
+    index = get_default_index()
+    if index is None:
+        return
+    archived = [result.id for result in results if result.ok]
+    if archived:
+        index.remove(gmail_client.get_sender_address(service), archived)
+
+def _encode_cursor(query: Optional[str], page_token: str) -> str:
+    """Pack a query and Gmail page token into one opaque cursor string."""
+    payload = json.dumps({'q': query, 'p': page_token}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor: str) -> Union[tuple, str]:
+    """Unpack a cursor from _encode_cursor into (query, page_token) or an error message."""
+    try:
+        padded = cursor.strip() + '=' * (-len(cursor.strip()) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (payload['q'], payload['p'])
+    except Exception:
+        return f'Error: Invalid cursor {cursor!r}'
+
+def format_summaries(summaries: list, next_cursor: Optional[str]=None) -> str:
+    """Format MessageSummary objects as "id:timestamp:subject" lines.
+
+    Args:
+        summaries (list): MessageSummary objects, in display order
+        next_cursor (str, optional): Cursor for the next page, appended as "Next cursor: <cursor>"
+
+    Returns:
+        str: Newline-separated lines, or "No emails found" (followed by the cursor if there are more pages)
+    """
+    lines = [str(summary) for summary in summaries] or ['No emails found']
+    if next_cursor:
+        lines.append(f'Next cursor: {next_cursor}')
+    return '\n'.join(lines)
+
+def format_archive_results(results: list) -> str:
+    """Format ArchiveResult objects as one result line per email ID.
+
+    Args:
+        results (list): ArchiveResult objects, in input order
+
+    Returns:
+        str: Newline-separated result lines
+    """
+    return '\n'.join((str(result) for result in results))
+
+@metrics.operation('list_emails')
+def list_emails(creds_path: str, query: str=None, use_sender: bool=True, cursor: str=None, max_results: int=20) -> str:
+    """List emails in the inbox, one page at a time.
+
+    When more results exist, the last line is "Next cursor: <cursor>". Passing that
+    cursor back returns the following page of the same query.
+
+    With BMAIL_SEARCH_INDEX=1, queries the local search index understands are
+    answered from it (see bmail.search_index) and others go to Gmail.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        query (str, optional): Gmail search query to filter results (ignored when cursor is given)
+        use_sender (bool): If True, use BMAIL_SENDER account, else use TEST_EMAIL
+        cursor (str, optional): Cursor returned by a previous call
+        max_results (int): Number of emails per page (default 20)
+
+    Returns:
+        str: Newline-separated list of "id:timestamp:subject" or error message
+    """
+    page_token = None
+    if cursor:
+        decoded = _decode_cursor(cursor)
+        if isinstance(decoded, str):
+            return decoded
+        query, page_token = decoded
+    service = _get_service(creds_path, use_sender)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    try:
+        local = _search_locally(service, query, max_results, page_token)
+        if local is not None:
+            summaries, next_token = local
+        else:
+            if page_token and page_token.startswith(LOCAL_PAGE_PREFIX):
+                # The index went away between pages; start over on the server.
+                page_token = None
+            summaries, next_token = gmail_client.list_summaries(service, query, max_results, page_token)
+    except Exception as e:
+        return f'Failed to list emails: {str(e)}'
+    return format_summaries(summaries, _encode_cursor(query, next_token) if next_token else None)
+
+@metrics.operation('list_new_emails')
+def list_new_emails(creds_path: str, use_sender: bool=True) -> str:
+    """List inbox emails that arrived since the previous call.
+
+    Uses the Gmail history API, so a check with nothing new costs a single small
+    request. The first call for a mailbox (or one after the stored history has
+    expired) records a new starting point and lists the current inbox instead.
+
+    Args:
+        creds_path (str): Path to Gmail API credentials file
+        use_sender (bool): If True, use BMAIL_SENDER account, else use TEST_EMAIL
+
+    Returns:
+        str: Newline-separated list of "id:timestamp:subject", "No new emails", or error message
+    """
+    service = _get_service(creds_path, use_sender)
+    if isinstance(service, str):
+        return f'Authentication error: {service}'
+    try:
+        result = get_default_sync().sync(service)
+        if result.full:
+            summaries, _ = gmail_client.list_summaries(service)
+        elif not result.added:
+            return 'No new emails'
+        else:
+            summaries = gmail_client.get_summaries(service, result.added)
+    except Exception as e:
+        return f'Failed to check for new emails: {str(e)}'
+    return format_summaries(summaries)
@@ -0,0 +1,537 @@
+"""
+In-process stand-in for the Gmail v1 endpoints bmail uses.
+
+FakeGmail keeps mailboxes in memory and answers profile, messages
+list/get/send/modify/batchModify, attachments.get, history.list and threads.get
+requests, including multipart batch requests and resumable uploads to
+messages.send. It plugs into googleapiclient at
+the HTTP layer, so everything above the transport (bmail.gmail_client,
+email_handler, llm_email_tools) runs unmodified:
+
+    backend = FakeGmail(latency=0.02, error_rate=0.01)
+    backend.add_mailbox('bot@example.com')
+    service = backend.build_service('bot@example.com')
+
+The same backend can be served over real HTTP for bmail.aio with serve().
+Latency, random error rate and a per-user quota (answered with 429 once
+exceeded) are configurable, and every API call is counted per method.
+"""
+import re
+import json
+import time
+import base64
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email import message_from_bytes, policy
+from email.parser import BytesParser
+from email.utils import getaddresses, make_msgid, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+import httplib2
+from bmail.ratelimit import DEFAULT_UNITS, QUOTA_UNITS
+
+# Path of the session URIs handed out for resumable uploads.
+UPLOAD_SESSION_PATH = '/upload/fake-session/'
+
+NOT_FOUND = (404, {'error': {'code': 404, 'message': 'Requested entity was not found.', 'errors': [{'reason': 'notFound'}]}})
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def _error(status: int, message: str, reason: str) -> tuple:
+    return (status, {'error': {'code': status, 'message': message, 'errors': [{'reason': reason}]}})
+
+class FakeMessage:
+    """One stored message: raw RFC 822 bytes plus Gmail bookkeeping."""
+
+    def __init__(self, message_id: str, thread_id: str, raw: bytes, label_ids: list, internal_date: int):
+        self.id = message_id
+        self.thread_id = thread_id
+        self.raw = raw
+        self.label_ids = list(label_ids)
+        self.internal_date = internal_date
+        self.mime = message_from_bytes(raw, policy=policy.compat32)
+        self.attachments = {}
+        self.payload = self._payload(self.mime, '')
+
+    def header(self, name: str) -> str:
+        return str(self.mime.get(name, ''))
+
+    def _payload(self, part, part_id: str) -> dict:
+        headers = [{'name': name, 'value': str(value)} for name, value in part.items()]
+        node = {'partId': part_id, 'mimeType': part.get_content_type(), 'filename': part.get_filename() or '', 'headers': headers}
+        if part.is_multipart():
+            node['body'] = {'size': 0}
+            prefix = f'{part_id}.' if part_id else ''
+            node['parts'] = [self._payload(sub, f'{prefix}{i}') for i, sub in enumerate(part.get_payload())]
+            return node
+        data = part.get_payload(decode=True) or b''
+        if node['filename']:
+            attachment_id = f'att-{self.id}-{part_id or 0}'
+            self.attachments[attachment_id] = data
+            node['body'] = {'size': len(data), 'attachmentId': attachment_id}
+        else:
+            node['body'] = {'size': len(data), 'data': _b64(data)}
+        return node
+
+    def snippet(self) -> str:
+        for part in self.mime.walk():
+            if part.get_content_type() == 'text/plain':
+                text = (part.get_payload(decode=True) or b'').decode('utf-8', 'replace')
+                return ' '.join(text.split())[:200]
+        return ''
+
+    def resource(self, fmt: str='full', metadata_headers: list=None) -> dict:
+        result = {'id': self.id, 'threadId': self.thread_id, 'labelIds': list(self.label_ids), 'snippet': self.snippet(), 'internalDate': str(self.internal_date), 'sizeEstimate': len(self.raw)}
+        if fmt == 'raw':
+            result['raw'] = _b64(self.raw)
+        elif fmt == 'metadata':
+            wanted = [h.lower() for h in metadata_headers or []]
+            headers = [h for h in self.payload['headers'] if not wanted or h['name'].lower() in wanted]
+            result['payload'] = {'mimeType': self.payload['mimeType'], 'headers': headers}
+        elif fmt != 'minimal':
+            result['payload'] = self.payload
+        return result
+
+    def ref(self) -> dict:
+        return {'id': self.id, 'threadId': self.thread_id, 'labelIds': list(self.label_ids)}
+
+class FakeMailbox:
+    """Messages and history of one user."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.messages = {}
+        self.history = []
+        self.history_id = 1000
+        self.quota_used = []
+
+    def record(self, kind: str, message: FakeMessage, labels: list=None) -> None:
+        self.history_id += 1
+        entry = {'message': message.ref()}
+        if labels is not None:
+            entry['labelIds'] = labels
+        self.history.append({'id': str(self.history_id), kind: [entry]})
+
+class FakeGmail:
+    """In-memory Gmail backend with configurable latency, errors and quota."""
+
+    def __init__(self, latency: Union[float, Callable[[], float]]=0.0, error_rate: float=0.0, user_units_per_second: Optional[float]=None, history_retention: int=10000, seed: int=None):
+        """
+        Args:
+            latency: Seconds to sleep per HTTP round trip, or a callable returning it
+            error_rate: Probability that an API call fails with a 503
+            user_units_per_second: Per-user quota; calls beyond it get 429 (None for unlimited)
+            history_retention: Number of history records kept; older startHistoryIds get 404
+            seed: Seed for the error-injection random generator
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.user_units_per_second = user_units_per_second
+        self.history_retention = history_retention
+        self.mailboxes = {}
+        self.uploads = {}
+        self.calls = Counter()
+        self.round_trips = 0
+        self._random = random.Random(seed)
+        self._next_id = 0x18c0000000000000
+        self._lock = threading.RLock()
+
+    def add_mailbox(self, address: str) -> FakeMailbox:
+        """Create (or return) the mailbox for an address."""
+        with self._lock:
+            return self.mailboxes.setdefault(address.lower(), FakeMailbox(address))
+
+    def reset_counters(self) -> None:
+        """Zero the call and round-trip counters."""
+        with self._lock:
+            self.calls.clear()
+            self.round_trips = 0
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return format(self._next_id, 'x')
+
+    def insert(self, address: str, raw: bytes, label_ids=('INBOX', 'UNREAD'), thread_id: str=None) -> FakeMessage:
+        """Store raw RFC 822 bytes in a mailbox and record it in the history."""
+        with self._lock:
+            mailbox = self.add_mailbox(address)
+            mime = message_from_bytes(raw)
+            if thread_id is None:
+                wanted = set(re.findall('<[^>]+>', f"{mime.get('In-Reply-To', '')} {mime.get('References', '')}"))
+                thread_id = next((m.thread_id for m in mailbox.messages.values() if m.header('Message-ID') in wanted), None)
+            try:
+                internal_date = int(parsedate_to_datetime(mime['Date']).timestamp() * 1000)
+            except Exception:
+                internal_date = int(time.time() * 1000)
+            message_id = self._new_id()
+            message = FakeMessage(message_id, thread_id or message_id, raw, label_ids, internal_date)
+            mailbox.messages[message_id] = message
+            mailbox.record('messagesAdded', message)
+            return message
+
+    def add_message(self, address: str, sender: str='sender@example.com', subject: str='Test Subject', body: str='Test body', date: datetime=None, label_ids=('INBOX', 'UNREAD'), attachments: dict=None, headers: dict=None) -> FakeMessage:
+        """Build and insert a plain text message, optionally with {filename: bytes} attachments."""
+        from email.mime.application import MIMEApplication
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        mime = MIMEText(body, 'plain')
+        if attachments:
+            outer = MIMEMultipart()
+            outer.attach(mime)
+            for filename, data in attachments.items():
+                part = MIMEApplication(data)
+                part.add_header('Content-Disposition', 'attachment', filename=filename)
+                outer.attach(part)
+            mime = outer
+        mime['From'] = sender
+        mime['To'] = address
+        mime['Subject'] = subject
+        mime['Date'] = (date or datetime.now(timezone.utc)).strftime('%a, %d %b %Y %H:%M:%S %z')
+        mime['Message-ID'] = make_msgid(domain='example.com')
+        for name, value in (headers or {}).items():
+            mime[name] = value
+        return self.insert(address, mime.as_bytes(), label_ids)
+
+    def build_service(self, address: str):
+        """Build a googleapiclient Gmail service whose transport is this backend."""
+        from bmail import discovery
+        self.add_mailbox(address)
+        return discovery.build_gmail(http=FakeGmailHttp(self, address))
+
+    def handle(self, user: str, method: str, uri: str, body: bytes=b'', headers: dict=None) -> tuple:
+        """
+        Answer one HTTP request (a single call or a whole batch).
+
+        Returns:
+            tuple: (status, headers dict, body bytes)
+        """
+        self._sleep()
+        with self._lock:
+            self.round_trips += 1
+        path = urlsplit(uri).path
+        if path == '/batch' or path.startswith('/batch/'):
+            return self._handle_batch(user, body, headers or {})
+        if path.startswith(UPLOAD_SESSION_PATH):
+            return self._upload_chunk(user, path[len(UPLOAD_SESSION_PATH):], body, headers or {})
+        if path.startswith('/upload/') and 'resumable' in parse_qs(urlsplit(uri).query).get('uploadType', []):
+            return self._start_upload(user, uri, body)
+        status, data = self.dispatch(user, method, uri, body)
+        return (status, {'content-type': 'application/json; charset=UTF-8'}, json.dumps(data).encode('utf-8') if data is not None else b'')
+
+    def dispatch(self, user: str, method: str, uri: str, body: bytes=b'') -> tuple:
+        """Route one API call; returns (status, JSON-able response)."""
+        parts = urlsplit(uri)
+        query = parse_qs(parts.query, keep_blank_values=True)
+        match = re.match('^(?:/upload)?/gmail/v1/users/([^/]+)/(.*)$', parts.path)
+        if not match:
+            return _error(404, f'Unknown path {parts.path}', 'notFound')
+        address = user if match.group(1) == 'me' else match.group(1)
+        route = match.group(2).rstrip('/')
+        segments = route.split('/')
+        name = self._method_name(method, segments)
+        with self._lock:
+            self.calls[name] += 1
+            mailbox = self.mailboxes.get(address.lower())
+            if mailbox is None:
+                return _error(400, 'Mail service not enabled', 'failedPrecondition')
+            if self._over_quota(mailbox, QUOTA_UNITS.get(name, DEFAULT_UNITS)):
+                return _error(429, 'User-rate limit exceeded.', 'userRateLimitExceeded')
+            if self.error_rate and self._random.random() < self.error_rate:
+                return _error(503, 'The service is currently unavailable.', 'backendError')
+            handler = getattr(self, '_' + name.replace('.', '_'), None)
+            if handler is None:
+                return _error(404, f'Unsupported method {name}', 'notFound')
+            try:
+                payload = json.loads(body) if body and not name.endswith('send') else None
+            except ValueError:
+                payload = None
+            return handler(mailbox, segments, query, payload if payload is not None else body)
+
+    @staticmethod
+    def _method_name(method: str, segments: list) -> str:
+        if segments == ['profile']:
+            return 'getProfile'
+        if segments[0] == 'messages':
+            if len(segments) == 1:
+                return 'messages.list'
+            if segments[1] in ('send', 'batchModify', 'import', 'insert'):
+                return f'messages.{segments[1]}'
+            if len(segments) == 2:
+                return 'messages.get' if method == 'GET' else 'messages.delete'
+            if segments[2] == 'attachments':
+                return 'messages.attachments.get'
+            return f'messages.{segments[2]}'
+        if segments[0] == 'history':
+            return 'history.list'
+        if segments[0] == 'threads':
+            return 'threads.list' if len(segments) == 1 else 'threads.get' if len(segments) == 2 else f'threads.{segments[2]}'
+        return '.'.join(segments)
+
+    def _sleep(self) -> None:
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+
+    def _over_quota(self, mailbox: FakeMailbox, units: float) -> bool:
+        if self.user_units_per_second is None:
+            return False
+        now = time.monotonic()
+        mailbox.quota_used = [(t, u) for t, u in mailbox.quota_used if now - t < 1.0]
+        if sum((u for _, u in mailbox.quota_used)) + units > self.user_units_per_second:
+            return True
+        mailbox.quota_used.append((now, units))
+        return False
+
+    def _getProfile(self, mailbox, segments, query, body):
+        return (200, {'emailAddress': mailbox.address, 'messagesTotal': len(mailbox.messages), 'threadsTotal': len({m.thread_id for m in mailbox.messages.values()}), 'historyId': str(mailbox.history_id)})
+
+    def _messages_list(self, mailbox, segments, query, body):
+        matches = [m for m in sorted(mailbox.messages.values(), key=lambda m: (m.internal_date, m.id), reverse=True) if self.matches(m, query.get('q', [''])[0], query.get('labelIds', []))]
+        start = int(query.get('pageToken', ['0'])[0])
+        size = min(int(query.get('maxResults', ['100'])[0]), 500)
+        page = matches[start:start + size]
+        result = {'resultSizeEstimate': len(matches)}
+        if page:
+            result['messages'] = [{'id': m.id, 'threadId': m.thread_id} for m in page]
+        if start + size < len(matches):
+            result['nextPageToken'] = str(start + size)
+        return (200, result)
+
+    def _messages_get(self, mailbox, segments, query, body):
+        message = mailbox.messages.get(segments[1])
+        if message is None:
+            return NOT_FOUND
+        return (200, message.resource(query.get('format', ['full'])[0], query.get('metadataHeaders')))
+
+    def _messages_attachments_get(self, mailbox, segments, query, body):
+        message = mailbox.messages.get(segments[1])
+        data = message.attachments.get(segments[3]) if message else None
+        if data is None:
+            return NOT_FOUND
+        return (200, {'attachmentId': segments[3], 'size': len(data), 'data': _b64(data)})
+
+    def _messages_send(self, mailbox, segments, query, body):
+        if isinstance(body, (bytes, str)) and body[:1] in (b'{', '{'):
+            body = json.loads(body)
+        if isinstance(body, dict):
+            raw = base64.urlsafe_b64decode(body['raw'] + '=' * (-len(body['raw']) % 4))
+            thread_id = body.get('threadId')
+        else:
+            raw, thread_id = (body.encode() if isinstance(body, str) else body, None)
+        mime = message_from_bytes(raw)
+        if not mime['Message-ID']:
+            raw = f"Message-ID: {make_msgid(domain='fake.gmail')}\r\n".encode() + raw
+        if not mime['Date']:
+            raw = f"Date: {datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')}\r\n".encode() + raw
+        sent = self.insert(mailbox.address, raw, ['SENT'], thread_id)
+        recipients = getaddresses(mime.get_all('to', []) + mime.get_all('cc', []) + mime.get_all('bcc', []))
+        for _, address in recipients:
+            if address.lower() in self.mailboxes and address.lower() != mailbox.address.lower():
+                self.insert(address, raw, ['INBOX', 'UNREAD'])
+            elif address.lower() == mailbox.address.lower():
+                sent.label_ids = ['SENT', 'INBOX', 'UNREAD']
+        return (200, sent.ref())
+
+    def _relabel(self, mailbox, message, add, remove):
+        before = set(message.label_ids)
+        message.label_ids = [label for label in message.label_ids if label not in remove] + [label for label in add if label not in message.label_ids]
+        removed = sorted(before - set(message.label_ids))
+        added = sorted(set(message.label_ids) - before)
+        if removed:
+            mailbox.record('labelsRemoved', message, removed)
+        if added:
+            mailbox.record('labelsAdded', message, added)
+
+    def _messages_modify(self, mailbox, segments, query, body):
+        message = mailbox.messages.get(segments[1])
+        if message is None:
+            return NOT_FOUND
+        self._relabel(mailbox, message, body.get('addLabelIds', []), body.get('removeLabelIds', []))
+        return (200, message.ref())
+
+    def _messages_batchModify(self, mailbox, segments, query, body):
+        ids = body.get('ids', [])
+        if len(ids) > 1000:
+            return _error(400, 'Too many ids', 'invalidArgument')
+        for message_id in ids:
+            message = mailbox.messages.get(message_id)
+            if message is not None:
+                self._relabel(mailbox, message, body.get('addLabelIds', []), body.get('removeLabelIds', []))
+        return (204, None)
+
+    def _history_list(self, mailbox, segments, query, body):
+        start = int(query['startHistoryId'][0])
+        retained = mailbox.history[-self.history_retention:]
+        if retained and start < int(retained[0]['id']) - 1:
+            return NOT_FOUND
+        records = [r for r in retained if int(r['id']) > start]
+        types = query.get('historyTypes')
+        if types:
+            keys = {f'{t[0].lower()}{t[1:]}s'.replace('messageAddeds', 'messagesAdded').replace('messageDeleteds', 'messagesDeleted').replace('labelAddeds', 'labelsAdded').replace('labelRemoveds', 'labelsRemoved') for t in types}
+            records = [r for r in records if keys & set(r)]
+        page_start = int(query.get('pageToken', ['0'])[0])
+        size = min(int(query.get('maxResults', ['100'])[0]), 500)
+        result = {'historyId': str(mailbox.history_id)}
+        if records[page_start:page_start + size]:
+            result['history'] = records[page_start:page_start + size]
+        if page_start + size < len(records):
+            result['nextPageToken'] = str(page_start + size)
+        return (200, result)
+
+    def _threads_get(self, mailbox, segments, query, body):
+        messages = sorted((m for m in mailbox.messages.values() if m.thread_id == segments[1]), key=lambda m: (m.internal_date, m.id))
+        if not messages:
+            return NOT_FOUND
+        fmt = query.get('format', ['full'])[0]
+        return (200, {'id': segments[1], 'historyId': str(mailbox.history_id), 'messages': [m.resource(fmt, query.get('metadataHeaders')) for m in messages]})
+
+    def matches(self, message: FakeMessage, q: str, label_ids: list=()) -> bool:
+        """Evaluate the subset of Gmail search syntax bmail relies on."""
+        if any((label not in message.label_ids for label in label_ids)):
+            return False
+        for negate, key, value in re.findall('(-?)(?:(\\w+):)?("[^"]*"|\\S+)', q or ''):
+            value = value.strip('"').lower()
+            key = key.lower()
+            if key == 'in' or key == 'label':
+                ok = value.upper() in message.label_ids or value in [l.lower() for l in message.label_ids]
+            elif key in ('subject', 'from', 'to', 'cc'):
+                ok = value in message.header(key).lower()
+            elif key == 'rfc822msgid':
+                ok = message.header('Message-ID').strip('<>').lower() == value.strip('<>')
+            elif key in ('after', 'before'):
+                stamp = datetime.strptime(value.replace('-', '/'), '%Y/%m/%d').replace(tzinfo=timezone.utc).timestamp() * 1000 if '/' in value or '-' in value else int(value) * 1000
+                ok = message.internal_date >= stamp if key == 'after' else message.internal_date < stamp
+            else:
+                ok = value in message.header('subject').lower() or value in message.snippet().lower() or value in message.header('from').lower()
+            if ok == bool(negate):
+                return False
+        return True
+
+    def _start_upload(self, user: str, uri: str, body: bytes) -> tuple:
+        """Open a resumable upload session; the metadata body is kept for the final call."""
+        with self._lock:
+            self.calls['upload.start'] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                status, data = _error(503, 'The service is currently unavailable.', 'backendError')
+                return (status, {'content-type': 'application/json'}, json.dumps(data).encode())
+            session = self._new_id()
+            self.uploads[session] = (uri.replace('uploadType=resumable', 'uploadType=media'), json.loads(body) if body else {}, bytearray())
+        return (200, {'location': f'https://gmail.googleapis.com{UPLOAD_SESSION_PATH}{session}', 'content-length': '0'}, b'')
+
+    def _upload_chunk(self, user: str, session: str, body: bytes, headers: dict) -> tuple:
+        """Append a chunk (or answer a status query) for a resumable upload session."""
+        content_range = next((v for k, v in headers.items() if k.lower() == 'content-range'), '')
+        with self._lock:
+            self.calls['upload.chunk'] += 1
+            upload = self.uploads.get(session)
+            if upload is None:
+                status, data = NOT_FOUND
+                return (status, {'content-type': 'application/json'}, json.dumps(data).encode())
+            uri, metadata, received = upload
+            match = re.match('bytes (?:(\\d+)-(\\d+)|\\*)/(\\d+|\\*)', content_range)
+            if match and match.group(1) is not None:
+                if self.error_rate and self._random.random() < self.error_rate:
+                    status, data = _error(503, 'The service is currently unavailable.', 'backendError')
+                    return (status, {'content-type': 'application/json'}, json.dumps(data).encode())
+                if int(match.group(1)) != len(received):
+                    return (400, {'content-type': 'application/json'}, json.dumps(_error(400, 'Bad chunk offset', 'badRequest')[1]).encode())
+                received.extend(body)
+            total = match.group(3) if match else '*'
+            if total == '*' or len(received) < int(total):
+                headers = {'content-length': '0'}
+                if received:
+                    headers['range'] = f'bytes=0-{len(received) - 1}'
+                return (308, headers, b'')
+        raw = base64.urlsafe_b64encode(bytes(received)).decode()
+        payload = dict(metadata, raw=raw)
+        status, data = self.dispatch(user, 'POST', uri, json.dumps(payload).encode())
+        if status < 400:
+            with self._lock:
+                self.uploads.pop(session, None)
+        else:
+            # The client retries the last chunk after a failed completion.
+            del received[int(match.group(1)) if match and match.group(1) else len(received):]
+        return (status, {'content-type': 'application/json; charset=UTF-8'}, json.dumps(data).encode('utf-8'))
+
+    def _handle_batch(self, user: str, body: bytes, headers: dict) -> tuple:
+        content_type = next((v for k, v in headers.items() if k.lower() == 'content-type'), '')
+        envelope = BytesParser(policy=policy.compat32).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        parts = envelope.get_payload()
+        if len(parts) > 100:
+            status, data = _error(400, 'Too many requests in batch', 'invalidArgument')
+            return (status, {'content-type': 'application/json'}, json.dumps(data).encode())
+        boundary = 'batch_fake_gmail'
+        chunks = []
+        for part in parts:
+            request = part.get_payload()
+            head, _, inner_body = request.replace('\r\n', '\n').partition('\n\n')
+            request_line = head.split('\n', 1)[0]
+            method, uri, _ = request_line.split(' ', 2)
+            status, data = self.dispatch(user, method, uri, inner_body.encode('utf-8'))
+            content_id = part['Content-ID'] or ''
+            reason = 'OK' if status < 400 else 'Error'
+            payload = json.dumps(data) if data is not None else ''
+            chunks.append(f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id.strip("<>")}>\r\n\r\nHTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=UTF-8\r\nContent-Length: {len(payload)}\r\n\r\n{payload}\r\n')
+        chunks.append(f'--{boundary}--\r\n')
+        return (200, {'content-type': f'multipart/mixed; boundary={boundary}'}, ''.join(chunks).encode('utf-8'))
+
+class FakeGmailHttp:
+    """httplib2.Http stand-in that answers requests from a FakeGmail backend as one user."""
+
+    def __init__(self, backend: FakeGmail, user: str):
+        self.backend = backend
+        self.user = user
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        status, response_headers, content = self.backend.handle(self.user, method, uri, body or b'', headers or {})
+        response_headers = dict(response_headers, status=str(status))
+        return (httplib2.Response(response_headers), content)
+
+    def close(self):
+        pass
+
+def serve(backend: FakeGmail, user: str, host: str='127.0.0.1', port: int=0) -> ThreadingHTTPServer:
+    """
+    Serve a backend over real HTTP (for bmail.aio) in a daemon thread.
+
+    Point BMAIL_GMAIL_API_URL at f'http://{host}:{server.server_port}/gmail/v1/users/me/'
+    and call server.shutdown() when done.
+
+    Args:
+        backend: Backend to serve
+        user: Mailbox that 'me' refers to
+        host: Interface to bind
+        port: Port to bind (0 picks a free one)
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _respond(self):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            body = self.rfile.read(length) if length else b''
+            status, headers, content = backend.handle(user, self.command, self.path, body, dict(self.headers))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,211 @@
+"""
+Run mailbox operations across many delegated users in parallel.
+
+With domain-wide delegation one service account key can act as every user in
+the domain. The functions here take a list of users (or (user, argument)
+pairs) and run list/read/archive for all of them on a bounded worker pool,
+streaming a UserResult as each one finishes:
+
+    for result in fanout.list_emails('credentials.json', staff, query='is:unread'):
+        print(result.user, result.ok, result.result)
+
+Two limits bound the work: max_workers calls in flight overall and per_user
+calls in flight for any one mailbox. Per-user quota is metered separately
+for each mailbox by bmail.ratelimit, so one busy user cannot starve the
+others. The key file is loaded once and a service is built (and verified)
+once per user through bmail.auth's cache; later runs reuse them.
+"""
+import time
+import threading
+import contextvars
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional, Union
+from bmail import bulk, discovery, email_handler, gmail_client, metrics
+from bmail.auth import get_gmail_service
+from bmail.message import Message
+
+DEFAULT_WORKERS = 16
+DEFAULT_PER_USER = 2
+# Tasks held in memory per worker: READ_AHEAD normally, up to MAX_READ_AHEAD while
+# workers are idle only because every queued user is at its per_user limit.
+READ_AHEAD = 4
+MAX_READ_AHEAD = 256
+
+_LOCAL = threading.local()
+
+class UserResult(NamedTuple):
+    """Outcome of one operation on one user's mailbox.
+
+    Attributes:
+        user: Delegated address the operation ran as
+        operation: 'list', 'read', 'archive' or the name given to run()
+        key: The per-task argument (email ID, list of IDs, query), or None
+        result: Tool-style result text or error description
+        ok: True if the operation succeeded
+        seconds: Time the operation took, including building the service
+    """
+    user: str
+    operation: str
+    key: Any
+    result: str
+    ok: bool
+    seconds: float
+
+def _thread_service(service, user: str):
+    """Return a copy of a user's service with a transport private to the calling thread."""
+    http = bulk.worker_http(service)
+    if http is None:
+        return service
+    services = getattr(_LOCAL, 'services', None)
+    if services is None:
+        services = _LOCAL.services = {}
+    local = services.get(id(http))
+    if local is None:
+        local = services[id(http)] = discovery.build_gmail(http=http)
+        gmail_client.remember_sender_address(local, user)
+    return local
+
+def run(creds_path: str, tasks: Iterable[tuple], max_workers: int=DEFAULT_WORKERS, per_user: int=DEFAULT_PER_USER) -> Iterator[UserResult]:
+    """
+    Run (user, operation, key, fn) tasks with bounded overall and per-user concurrency.
+
+    fn(service, key) returns (result text, ok). Tasks are read lazily; normally
+    at most READ_AHEAD * max_workers wait in memory. When workers are idle
+    because every waiting task belongs to a user already at per_user, reading
+    continues (up to MAX_READ_AHEAD * max_workers waiting) to find work for
+    other users, so input grouped by user still keeps the pool busy. Results
+    are yielded as they complete, so they arrive in completion order, not input
+    order. API calls are tagged with the metrics operation 'fanout_<operation>'
+    unless the caller set one.
+
+    Args:
+        creds_path: Path to the service account key file
+        tasks: Iterable of (user, operation name, key, fn)
+        max_workers: Calls in flight across all users
+        per_user: Calls in flight for any one user
+
+    Yields:
+        UserResult: One per task
+    """
+
+    def call(user, operation, key, fn):
+        started = time.perf_counter()
+        with metrics.operation(f'fanout_{operation}'):
+            service = get_gmail_service(creds_path, user)
+            if isinstance(service, str):
+                return UserResult(user, operation, key, f'Authentication error: {service}', False, time.perf_counter() - started)
+            try:
+                if per_user > 1:
+                    # Several threads may serve this user at once; httplib2 transports are not thread safe.
+                    service = _thread_service(service, user)
+                result, ok = fn(service, key)
+            except Exception as e:
+                result, ok = (f'Failed to {operation} for {user}: {str(e)}', False)
+        return UserResult(user, operation, key, result, ok, time.perf_counter() - started)
+    tasks = iter(tasks)
+    queued = {}
+    waiting = 0
+    in_flight = Counter()
+    futures = {}
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bmail-fanout') as executor:
+
+        def submit(user):
+            nonlocal waiting
+            queue = queued[user]
+            while queue and in_flight[user] < per_user and len(futures) < max_workers:
+                in_flight[user] += 1
+                waiting -= 1
+                # Workers run in a copy of the caller's context so calls keep its metrics operation tag.
+                futures[executor.submit(contextvars.copy_context().run, call, *queue.popleft())] = user
+            if not queue:
+                del queued[user]
+        while True:
+            for user in list(queued):
+                submit(user)
+            # After the pass above, idle workers mean every waiting user is at per_user.
+            while not exhausted and (waiting < READ_AHEAD * max_workers or (len(futures) < max_workers and waiting < MAX_READ_AHEAD * max_workers)):
+                try:
+                    task = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                user = task[0].lower()
+                queued.setdefault(user, deque()).append(task)
+                waiting += 1
+                submit(user)
+            if not futures:
+                return
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight[futures.pop(future)] -= 1
+                yield future.result()
+
+def _list(query: Optional[str], max_results: int) -> Callable:
+
+    def fn(service, key):
+        summaries, _ = gmail_client.list_summaries(service, query, max_results)
+        return (email_handler.format_summaries(summaries), True)
+    return fn
+
+def _read(max_chars: Optional[int]) -> Callable:
+
+    def fn(service, email_id):
+        # The message cache is keyed by the service's mailbox, so users never see each other's cached copies.
+        message = gmail_client.get_email(service, email_id)
+        return (email_handler.format_email(message, max_chars), isinstance(message, Message))
+    return fn
+
+def _archive(service, email_ids) -> tuple:
+    results = gmail_client.archive_emails(service, list(email_ids))
+    return (email_handler.format_archive_results(results), all((result.ok for result in results)))
+
+def list_emails(creds_path: str, users: Iterable[str], query: str=None, max_results: int=20, max_workers: int=DEFAULT_WORKERS) -> Iterator[UserResult]:
+    """
+    List the first page of each user's inbox.
+
+    Args:
+        creds_path: Path to the service account key file
+        users: Delegated addresses
+        query: Optional Gmail search query applied in every mailbox
+        max_results: Emails per mailbox
+        max_workers: Mailboxes listed at once
+
+    Yields:
+        UserResult: Per user, result is the "id:timestamp:subject" lines (or "No emails found")
+    """
+    fn = _list(query, max_results)
+    yield from run(creds_path, ((user, 'list', query, fn) for user in users), max_workers)
+
+def read_emails(creds_path: str, items: Iterable[tuple], max_chars: Optional[int]=None, max_workers: int=DEFAULT_WORKERS, per_user: int=DEFAULT_PER_USER) -> Iterator[UserResult]:
+    """
+    Read emails from many mailboxes.
+
+    Args:
+        creds_path: Path to the service account key file
+        items: (user, email ID) pairs
+        max_chars: Truncate each body to this many characters
+        max_workers: Emails fetched at once overall
+        per_user: Emails fetched at once from any one mailbox
+
+    Yields:
+        UserResult: Per email, result is formatted like read_email; key is the email ID
+    """
+    fn = _read(max_chars)
+    yield from run(creds_path, ((user, 'read', email_id, fn) for user, email_id in items), max_workers, per_user)
+
+def archive_emails(creds_path: str, items: Union[dict, Iterable[tuple]], max_workers: int=DEFAULT_WORKERS) -> Iterator[UserResult]:
+    """
+    Archive emails in many mailboxes, with one batchModify per 1000 IDs per user.
+
+    Args:
+        creds_path: Path to the service account key file
+        items: Mapping of user to email IDs, or (user, email IDs) pairs
+        max_workers: Mailboxes archived in at once
+
+    Yields:
+        UserResult: Per user, result has one line per email ID; ok only if all were archived
+    """
+    pairs = items.items() if isinstance(items, dict) else items
+    yield from run(creds_path, ((user, 'archive', list(email_ids), _archive) for user, email_ids in pairs), max_workers)
@@ -1,12 +1,273 @@
-from typing import Union
-from googleapiclient.discovery import Resource
+from __future__ import annotations
+import os
+import time
+import uuid
+import tempfile
+import threading
+import weakref
+import mimetypes
+from typing import TYPE_CHECKING, BinaryIO, Iterator, Optional, Union
 import base64
 from email import message_from_bytes, message_from_string
 from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.header import decode_header
+from bmail import metrics, ratelimit
+from bmail.message import ArchiveResult, Message, MessageSummary, parse_message, parse_summary
+from bmail.attachment_store import AttachmentStore, StoredAttachment, resolve_store
+from bmail.message_cache import MessageCache, resolve_cache
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
 
-def send_gmail(service: Resource, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None) -> str:
+# Gmail accepts at most 100 calls in one batch HTTP request.
+BATCH_LIMIT = 100
+
+# messages.batchModify accepts at most 1000 message IDs per call.
+BATCH_MODIFY_LIMIT = 1000
+
+# Largest message messages.send accepts through the upload endpoint (35 MB).
+MAX_UPLOAD_BYTES = 36700160
+
+# Bytes sent per resumable upload request; a multiple of 256 KiB. It bounds
+# the memory an upload holds and the data resent after a dropped connection.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Attachment bytes read and base64-encoded at a time (a multiple of 57, one 76-column line).
+_ENCODE_BLOCK = 57 * 1024
+
+# Base64 characters decoded at a time when saving an attachment (a multiple of 4).
+_DECODE_BLOCK = 256 * 1024
+
+# Headers a reply needs; fetched with format='metadata' instead of the whole message.
+REPLY_HEADERS = ['From', 'Reply-To', 'Subject', 'Message-ID', 'References']
+
+# Mailbox address per service object, so the From header costs at most one
+# getProfile call per delegated identity rather than one per send.
+_SENDER_ADDRESSES = weakref.WeakKeyDictionary()
+_SENDER_LOCK = threading.Lock()
+
+def remember_sender_address(service: Resource, address: str) -> None:
+    """
+    Record the mailbox address of a service so sends need not look it up.
+
+    Args:
+        service: Authenticated Gmail API service object
+        address: Email address of the mailbox the service acts as
+    """
+    with _SENDER_LOCK:
+        _SENDER_ADDRESSES[service] = address
+
+def get_sender_address(service: Resource) -> str:
+    """
+    Return the mailbox address of a service, calling getProfile only the first time.
+
+    Args:
+        service: Authenticated Gmail API service object
+
+    Returns:
+        str: Email address of the authenticated mailbox
+
+    Raises:
+        Exception: If the getProfile call fails
+    """
+    with _SENDER_LOCK:
+        address = _SENDER_ADDRESSES.get(service)
+    if address is None:
+        address = ratelimit.execute(service, service.users().getProfile(userId='me'))['emailAddress']
+        remember_sender_address(service, address)
+    return address
+
+def build_send_body(from_addr: str, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, message_id: str=None) -> dict:
+    """
+    Build the request body for users.messages.send.
+
+    Args:
+        from_addr: From address
+        to_addr: Recipient email address
+        cc: CC recipients (comma-separated)
+        bcc: BCC recipients (comma-separated)
+        subject: Email subject
+        body: Email body text
+        thread_id: Optional Gmail thread ID to reply to
+        in_reply_to: Optional Message-ID being replied to
+        references: Optional References header for threading
+        message_id: Optional Message-ID header (Gmail keeps it, so the message can be found by it)
+
+    Returns:
+        dict: {'raw': ...} plus 'threadId' when replying in a thread
+    """
+    message = MIMEMultipart()
+    message['from'] = from_addr
+    message['to'] = to_addr
+    message['subject'] = subject
+    if cc:
+        message['cc'] = cc
+    if bcc:
+        message['bcc'] = bcc
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+    if references:
+        message['References'] = references
+    if message_id:
+        message['Message-ID'] = message_id
+    message.attach(MIMEText(body, 'plain'))
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    if thread_id:
+        return {'raw': raw, 'threadId': thread_id}
+    return {'raw': raw}
+
+def write_mime(fp: BinaryIO, from_addr: str, to_addr: str, cc: str, bcc: str, subject: str, body: str, attachments: list, in_reply_to: str=None, references: str=None, message_id: str=None) -> int:
+    """
+    Write an RFC 822 message with file attachments to a binary file.
+
+    Attachments are read and base64-encoded _ENCODE_BLOCK bytes at a time, so
+    memory use does not grow with their size.
+
+    Args:
+        fp: Binary file to write to
+        from_addr: From address
+        to_addr: Recipient email address
+        cc: CC recipients (comma-separated)
+        bcc: BCC recipients (comma-separated)
+        subject: Email subject
+        body: Email body text
+        attachments: Paths of the files to attach
+        in_reply_to: Optional Message-ID being replied to
+        references: Optional References header for threading
+        message_id: Optional Message-ID header
+
+    Returns:
+        int: Number of bytes written
+
+    Raises:
+        OSError: If an attachment cannot be read
+    """
+    boundary = f'=============={uuid.uuid4().hex}=='
+    message = MIMEMultipart(boundary=boundary)
+    message['from'] = from_addr
+    message['to'] = to_addr
+    message['subject'] = subject
+    if cc:
+        message['cc'] = cc
+    if bcc:
+        message['bcc'] = bcc
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+    if references:
+        message['References'] = references
+    if message_id:
+        message['Message-ID'] = message_id
+    message.attach(MIMEText(body, 'plain'))
+    # Serialize headers and the text part, then stream each attachment in
+    # before the closing delimiter.
+    closing = f'--{boundary}--\n'.encode()
+    head = message.as_bytes()
+    written = fp.write(head[:head.rindex(closing)])
+    for path in attachments:
+        path = os.fspath(path)
+        mime_type, encoding = mimetypes.guess_type(path)
+        if mime_type is None or encoding is not None:
+            mime_type = 'application/octet-stream'
+        part = MIMEBase(*mime_type.split('/', 1))
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+        part.set_payload('')
+        written += fp.write(f'--{boundary}\n'.encode() + part.as_bytes())
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(_ENCODE_BLOCK), b''):
+                written += fp.write(base64.encodebytes(block))
+        written += fp.write(b'\n')
+    written += fp.write(closing)
+    return written
+
+def upload_message(service: Resource, fp: BinaryIO, thread_id: str=None, http=None) -> dict:
+    """
+    Send an RFC 822 message from a file through the resumable media upload endpoint.
+
+    The message goes up in UPLOAD_CHUNK_SIZE pieces as message/rfc822, with no
+    base64 or JSON wrapping. After a dropped connection or a retryable error
+    the upload asks Gmail how much it received and continues from there.
+
+    Args:
+        service: Authenticated Gmail API service object
+        fp: Binary file holding the message, positioned at its start
+        thread_id: Optional Gmail thread ID to send in
+        http: Optional HTTP transport to send on instead of the service's own
+
+    Returns:
+        dict: The sent message resource (id, threadId, labelIds)
+
+    Raises:
+        HttpError: If Gmail rejects the message or retries run out
+    """
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseUpload
+    media = MediaIoBaseUpload(fp, mimetype='message/rfc822', chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    request = service.users().messages().send(userId='me', body={'threadId': thread_id} if thread_id else None, media_body=media)
+    scheduler = ratelimit.get_scheduler()
+    units = ratelimit.QUOTA_UNITS['messages.send']
+    size = metrics.measure_response(request)
+    start = time.perf_counter()
+    retries = attempt = 0
+    # One send is charged once, however many chunks and resumptions it takes.
+    scheduler.throttle(service, units)
+    limiter = scheduler.limiter(service)
+    limiter.acquire()
+    throttled = False
+    try:
+        response = None
+        while response is None:
+            try:
+                progress, response = request.next_chunk(http=http)
+                if progress is not None:
+                    attempt = 0
+            except Exception as e:
+                throttled = throttled or (isinstance(e, HttpError) and ratelimit.is_retryable(e))
+                if not ratelimit.is_transient(e) or attempt >= scheduler.max_retries:
+                    status = e.resp.status if isinstance(e, HttpError) else None
+                    metrics.emit(metrics.CallRecord('messages.send', metrics.current_operation(), time.perf_counter() - start, 0, retries, type(e).__name__, status, units))
+                    raise
+                time.sleep(scheduler.backoff(attempt, e if isinstance(e, HttpError) else None))
+                attempt += 1
+                retries += 1
+    finally:
+        limiter.release(throttled)
+    metrics.emit(metrics.CallRecord('messages.send', metrics.current_operation(), time.perf_counter() - start, size[0], retries, None, None, units))
+    return response
+
+def send_message(service: Resource, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, from_addr: str=None, http=None, message_id: str=None, attachments: list=None) -> dict:
+    """
+    Send an email and return the sent message resource.
+
+    Without attachments the message is sent as a base64 'raw' field. With
+    attachments it is written to a temporary file and sent with upload_message,
+    so neither the files nor the encoded message are held in memory.
+
+    Args:
+        Same as send_gmail.
+
+    Returns:
+        dict: The sent message resource (id, threadId, labelIds)
+
+    Raises:
+        ValueError: If the message with its attachments is larger than MAX_UPLOAD_BYTES
+        OSError: If an attachment cannot be read
+        HttpError: If the send fails
+    """
+    if not from_addr:
+        from_addr = get_sender_address(service)
+    if not attachments:
+        send_body = build_send_body(from_addr, to_addr, cc, bcc, subject, body, thread_id, in_reply_to, references, message_id)
+        return ratelimit.execute(service, service.users().messages().send(userId='me', body=send_body), http=http)
+    with tempfile.TemporaryFile(prefix='bmail-', suffix='.eml') as fp:
+        size = write_mime(fp, from_addr, to_addr, cc, bcc, subject, body, attachments, in_reply_to, references, message_id)
+        if size > MAX_UPLOAD_BYTES:
+            raise ValueError(f'message is {size} bytes with attachments; Gmail accepts at most {MAX_UPLOAD_BYTES}')
+        fp.seek(0)
+        return upload_message(service, fp, thread_id, http=http)
+
+def send_gmail(service: Resource, to_addr: str, cc: str, bcc: str, subject: str, body: str, thread_id: str=None, in_reply_to: str=None, references: str=None, from_addr: str=None, http=None, message_id: str=None, attachments: list=None) -> str:
     """
     Send an email using Gmail API.
 
@@ -20,72 +281,428 @@ def send_gmail(service: Resource, to_addr: str, cc: str, bcc: str, subject: str,
         thread_id: Optional Gmail thread ID to reply to
         in_reply_to: Optional Message-ID being replied to
         references: Optional References header for threading
+        from_addr: Optional From address; defaults to the mailbox address, which is
+            looked up once per service and then memoized
+        http: Optional HTTP transport to send on instead of the service's own
+            (httplib2 transports must not be shared between threads)
+        message_id: Optional Message-ID header to send with
+        attachments: Optional paths of files to attach; the message is then
+            streamed through the resumable upload endpoint
 
     Returns:
         str: Success message or error description
     """
     try:
-        profile = service.users().getProfile(userId='me').execute()
-        from_addr = profile['emailAddress']
-        message = MIMEMultipart()
-        message['from'] = from_addr
-        message['to'] = to_addr
-        message['subject'] = subject
-        if cc:
-            message['cc'] = cc
-        if bcc:
-            message['bcc'] = bcc
-        if in_reply_to:
-            message['In-Reply-To'] = in_reply_to
-        if references:
-            message['References'] = references
-        message.attach(MIMEText(body, 'plain'))
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        params = {'userId': 'me'}
-        if thread_id:
-            params['body'] = {'raw': raw, 'threadId': thread_id}
-        else:
-            params['body'] = {'raw': raw}
-        result = service.users().messages().send(**params).execute()
+        result = send_message(service, to_addr, cc, bcc, subject, body, thread_id, in_reply_to, references, from_addr, http, message_id, attachments)
         return f"Email sent successfully. Message ID: {result.get('id')}"
     except Exception as e:
         return f'Failed to send email: {str(e)}'
 
-def get_email(service: Resource, email_id: str) -> Union[tuple[bytes, dict], str]:
+def find_by_message_id(service: Resource, message_id: str, http=None) -> Optional[str]:
+    """
+    Look a message up by its Message-ID header with an rfc822msgid: search.
+
+    Args:
+        service: Authenticated Gmail API service object
+        message_id: Message-ID header value, with or without angle brackets
+        http: Optional transport to use instead of the service's own (for worker threads)
+
+    Returns:
+        Optional[str]: Gmail ID of the message, or None if the mailbox has none with that Message-ID
+
+    Raises:
+        Exception: If the messages.list call fails
+    """
+    query = f"rfc822msgid:{message_id.strip().strip('<>')}"
+    results = ratelimit.execute(service, service.users().messages().list(userId='me', q=query, maxResults=1, includeSpamTrash=True), http=http)
+    messages = results.get('messages', [])
+    return messages[0]['id'] if messages else None
+
+def get_email(service: Resource, email_id: str, cache: Union[MessageCache, bool, None]=None, format: str='full') -> Union[Message, str]:
     """
-    Retrieve email content and metadata.
+    Retrieve an email as a lazily decoded Message.
+
+    The local message cache is consulted first; on a miss the message is
+    downloaded and stored for next time. With format='full' Gmail returns the
+    parsed part tree (large attachments are left out); with format='raw' it
+    returns the RFC 822 source, of which only the headers are decoded until
+    the body is read. Either way, Message.text(max_chars) decodes just enough
+    for the requested number of characters.
 
     Args:
         service: Authenticated Gmail API service object
         email_id: ID of the email to retrieve
+        cache: MessageCache to use; None for the default cache, False to bypass caching
+        format: 'full' or 'raw'
+
+    Returns:
+        Union[Message, str]: The message or error message
+    """
+    try:
+        cache = resolve_cache(cache)
+        mailbox = get_sender_address(service) if cache else None
+        message = cache.get(mailbox, email_id, format) if cache else None
+        if message is None:
+            message = ratelimit.execute(service, service.users().messages().get(userId='me', id=email_id, format=format))
+            if cache:
+                cache.put(mailbox, message)
+        return parse_message(message)
+    except Exception as e:
+        return f'Failed to retrieve email: {str(e)}'
+
+def thread_messages(thread: dict, mailbox: Optional[str], cache: Union[MessageCache, bool, None]=None) -> list:
+    """
+    Turn a threads.get resource into its messages, oldest first.
+
+    Args:
+        thread: Thread resource fetched with format='full'
+        mailbox: Mailbox the thread belongs to (the cache key; unused without a cache)
+        cache: MessageCache to store the messages in; None for the default cache, False to skip it
+
+    Returns:
+        list: Message for each message in the thread
+    """
+    resources = sorted(thread.get('messages', []), key=lambda m: int(m.get('internalDate') or 0))
+    cache = resolve_cache(cache)
+    if cache:
+        for resource in resources:
+            cache.put(mailbox, resource)
+    return [parse_message(resource) for resource in resources]
+
+def get_thread(service: Resource, thread_id: str, cache: Union[MessageCache, bool, None]=None) -> Union[list, str]:
+    """
+    Retrieve every message of a thread in one threads.get call.
+
+    Threads gain messages, so the cache is not consulted; the fetched
+    messages are stored in it so later get_email calls need no request.
+
+    Args:
+        service: Authenticated Gmail API service object
+        thread_id: ID of the thread to retrieve
+        cache: MessageCache to store the messages in; None for the default cache, False to skip it
+
+    Returns:
+        Union[list, str]: Messages oldest first, or error message
+    """
+    try:
+        thread = ratelimit.execute(service, service.users().threads().get(userId='me', id=thread_id, format='full'))
+        cache = resolve_cache(cache)
+        return thread_messages(thread, get_sender_address(service) if cache else None, cache or False)
+    except Exception as e:
+        return f'Failed to retrieve thread: {str(e)}'
+
+def list_attachments(service: Resource, email_id: str, cache: Union[MessageCache, bool, None]=None) -> Union[list, str]:
+    """
+    List the attachments of an email without downloading them.
+
+    The part tree comes from get_email (so from the message cache when
+    possible); attachment data is never fetched.
+
+    Args:
+        service: Authenticated Gmail API service object
+        email_id: ID of the email
+        cache: MessageCache to use; None for the default cache, False to bypass caching
+
+    Returns:
+        Union[list, str]: Attachment tuples (part_id, filename, mime_type, size, attachment_id), or error message
+    """
+    message = get_email(service, email_id, cache)
+    if isinstance(message, str):
+        return message
+    return message.attachments
+
+def _decoded_chunks(data: str) -> Iterator[bytes]:
+    """Decode URL-safe base64 in _DECODE_BLOCK pieces so the decoded bytes are never all in memory."""
+    for start in range(0, len(data), _DECODE_BLOCK):
+        piece = data[start:start + _DECODE_BLOCK]
+        yield base64.urlsafe_b64decode(piece + '=' * (-len(piece) % 4))
+
+def download_attachment(service: Resource, email_id: str, part_id: str, store: Optional[AttachmentStore]=None, cache: Union[MessageCache, bool, None]=None) -> Union[StoredAttachment, str]:
+    """
+    Save one attachment of an email into the content-addressed attachment store.
+
+    An attachment already saved for this mailbox, message and part is returned
+    without any API call. Otherwise its data is fetched with
+    messages.attachments.get and decoded to disk in pieces while being hashed;
+    identical attachments in other messages share one file. Data that came
+    inline with the message (small parts, or any part of a 'raw' message) is
+    taken from the message itself.
+
+    Args:
+        service: Authenticated Gmail API service object
+        email_id: ID of the email
+        part_id: Gmail partId of the attachment (see list_attachments)
+        store: AttachmentStore to use; None for the default store
+        cache: MessageCache to use for the part tree; None for the default cache, False to bypass caching
 
     Returns:
-        Union[tuple[bytes, dict], str]: Tuple of (email content, metadata dict) or error message
+        Union[StoredAttachment, str]: The saved attachment, or error message
     """
     try:
-        message = service.users().messages().get(userId='me', id=email_id, format='full').execute()
-        payload = message.get('payload', {})
-        headers = payload.get('headers', [])
-        email_msg = MIMEMultipart()
-        for header in headers:
-            name = header.get('name', '').lower()
-            value = header.get('value', '')
-            if name in ['from', 'to', 'subject', 'message-id', 'references']:
-                email_msg[header['name']] = value
-        if 'body' in payload and 'data' in payload['body']:
-            body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+        store = resolve_store(store)
+        mailbox = get_sender_address(service)
+        stored = store.lookup(mailbox, email_id, part_id)
+        if stored is not None:
+            return stored
+        cache = resolve_cache(cache) or False
+        # A cached raw source holds every attachment, so nothing needs fetching.
+        raw = cache.get(mailbox, email_id, 'raw') if cache else None
+        message = parse_message(raw) if raw is not None else get_email(service, email_id, cache)
+        if isinstance(message, str):
+            return message
+        attachment = next((a for a in message.attachments if a.part_id == part_id), None)
+        if attachment is None:
+            return f'Email {email_id} has no attachment with part ID {part_id}'
+        if attachment.attachment_id:
+            data = ratelimit.execute(service, service.users().messages().attachments().get(userId='me', messageId=email_id, id=attachment.attachment_id)).get('data', '')
+            chunks = _decoded_chunks(data)
         else:
-            parts = payload.get('parts', [])
-            body = ''
-            for part in parts:
-                if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-                    body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-        email_msg.attach(MIMEText(body, 'plain'))
-        metadata = {'thread_id': message.get('threadId'), 'message_id': next((h['value'] for h in headers if h['name'].lower() == 'message-id'), None), 'references': next((h['value'] for h in headers if h['name'].lower() == 'references'), '')}
-        return (email_msg.as_bytes(), metadata)
+            # Small parts carry their data inline in the message we already have.
+            chunks = [message.attachment_data(part_id) or b'']
+        return store.add(mailbox, email_id, part_id, attachment.filename, attachment.mime_type, chunks)
+    except Exception as e:
+        return f'Failed to download attachment: {str(e)}'
+
+def reply_headers(message: dict) -> dict:
+    """
+    Extract the headers a reply needs from a message resource.
+
+    Args:
+        message: Message resource in 'metadata', 'full' or 'raw' format
+
+    Returns:
+        dict: from, reply_to, subject, message_id, references and thread_id
+    """
+    parsed = parse_message(message)
+    return {'from': parsed.header('from', ''), 'reply_to': parsed.header('reply-to', ''), 'subject': parsed.header('subject', ''), 'message_id': parsed.message_id, 'references': parsed.references, 'thread_id': parsed.thread_id}
+
+def get_reply_headers(service: Resource, email_id: str, cache: Union[MessageCache, bool, None]=None) -> Union[dict, str]:
+    """
+    Fetch only the headers needed to reply to an email.
+
+    A cached full message is used if present; otherwise one messages.get call
+    with format='metadata' transfers just REPLY_HEADERS, however large the
+    message and its attachments are.
+
+    Args:
+        service: Authenticated Gmail API service object
+        email_id: ID of the email being replied to
+        cache: MessageCache to check; None for the default cache, False to skip it
+
+    Returns:
+        Union[dict, str]: Headers as returned by reply_headers, or error message
+    """
+    try:
+        cache = resolve_cache(cache)
+        message = cache.get(get_sender_address(service), email_id) if cache else None
+        if message is None:
+            message = ratelimit.execute(service, service.users().messages().get(userId='me', id=email_id, format='metadata', metadataHeaders=REPLY_HEADERS))
+        return reply_headers(message)
     except Exception as e:
         return f'Failed to retrieve email: {str(e)}'
 
+def build_reply(headers: Union[dict, str]) -> Union[dict, str]:
+    """
+    Turn the original's headers into send_gmail arguments for a reply.
+
+    The reply goes to Reply-To (or From), gets a single "Re:" prefix, stays on
+    the original thread, and carries In-Reply-To plus a References chain made
+    of the original's References followed by its Message-ID (RFC 5322 3.6.4).
+
+    Args:
+        headers: Result of get_reply_headers
+
+    Returns:
+        Union[dict, str]: to_addr, subject, thread_id, in_reply_to and references, or error message
+    """
+    if isinstance(headers, str):
+        return headers
+    if not headers['from']:
+        return 'Error: Could not parse original email headers'
+    subject = headers['subject'].strip()
+    references = headers['references'].split()
+    message_id = headers['message_id']
+    if message_id and message_id not in references:
+        references.append(message_id)
+    return {'to_addr': headers['reply_to'] or headers['from'], 'subject': subject if subject.lower().startswith('re:') else f'Re: {subject}', 'thread_id': headers['thread_id'], 'in_reply_to': message_id, 'references': ' '.join(references) or None}
+
+def _execute_batch(service: Resource, requests: list) -> dict:
+    """
+    Execute (key, request) pairs as Gmail batch HTTP requests.
+
+    Requests are sent in chunks of at most BATCH_LIMIT calls, so N calls cost
+    ceil(N / BATCH_LIMIT) round trips instead of N. Each batch is charged its
+    total quota cost by the rate limiter, and calls that fail with a throttling
+    or transient error are retried in a fresh batch after a backoff (and make
+    the user's concurrency limit back off).
+
+    Args:
+        service: Authenticated Gmail API service object
+        requests: List of (key, HttpRequest) pairs
+
+    Returns:
+        dict: Maps each key to a (response, exception) pair; exactly one is None
+    """
+    from googleapiclient.errors import HttpError
+    scheduler = ratelimit.get_scheduler()
+    operation = metrics.current_operation()
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    def retryable(key):
+        error = results.get(key, (None, None))[1]
+        return isinstance(error, HttpError) and ratelimit.is_retryable(error)
+    pending = requests
+    attempt = 0
+    started = time.perf_counter()
+    while True:
+        for start in range(0, len(pending), BATCH_LIMIT):
+            chunk = pending[start:start + BATCH_LIMIT]
+            batch = service.new_batch_http_request(callback=callback)
+            sizes = {}
+            for key, request in chunk:
+                sizes[key] = metrics.measure_response(request)
+                batch.add(request, request_id=key)
+            units = sum((ratelimit.QUOTA_UNITS.get(ratelimit.method_name(request), ratelimit.DEFAULT_UNITS) for _, request in chunk))
+            sent = time.perf_counter()
+            scheduler.execute_batch(service, batch, units, throttled=lambda: any((retryable(key) for key, _ in chunk)))
+            now = time.perf_counter()
+            metrics.emit(metrics.CallRecord(metrics.BATCH, operation, now - sent, sum((size[0] for size in sizes.values())), attempt, None, None, units, len(chunk)))
+            for key, request in chunk:
+                error = results[key][1]
+                if retryable(key) and attempt < scheduler.max_retries:
+                    continue
+                method = ratelimit.method_name(request)
+                status = error.resp.status if isinstance(error, HttpError) else None
+                metrics.emit(metrics.CallRecord(method, operation, now - started, sizes[key][0], attempt, type(error).__name__ if error else None, status, ratelimit.QUOTA_UNITS.get(method, ratelimit.DEFAULT_UNITS), len(chunk)))
+        pending = [(key, request) for key, request in pending if retryable(key)]
+        if not pending or attempt >= scheduler.max_retries:
+            return results
+        time.sleep(scheduler.backoff(attempt))
+        attempt += 1
+
+def list_summaries(service: Resource, query: str=None, max_results: int=20, page_token: str=None) -> tuple[list[MessageSummary], Optional[str]]:
+    """
+    Fetch one page of inbox summaries.
+
+    Metadata for all listed messages is fetched with batch requests rather than
+    one messages.get call per message. A message whose metadata cannot be fetched
+    is returned with its error set.
+
+    Args:
+        service: Authenticated Gmail API service object
+        query: Optional Gmail search query (e.g. 'subject:TEST')
+        max_results: Maximum number of emails on the page (Gmail caps this at 500)
+        page_token: Optional nextPageToken returned for the previous page
+
+    Returns:
+        tuple[list[MessageSummary], Optional[str]]: Summaries and the token for the next page, if any
+
+    Raises:
+        Exception: If the messages.list call itself fails
+    """
+    search_query = 'in:inbox'
+    if query:
+        search_query = f'{search_query} {query}'
+    params = {'userId': 'me', 'maxResults': max_results, 'q': search_query}
+    if page_token:
+        params['pageToken'] = page_token
+    results = ratelimit.execute(service, service.users().messages().list(**params))
+    messages = results.get('messages', [])
+    if not messages:
+        # Gmail can return an empty page that still has a nextPageToken.
+        return ([], results.get('nextPageToken'))
+    return (get_summaries(service, [msg['id'] for msg in messages]), results.get('nextPageToken'))
+
+def get_summaries(service: Resource, email_ids: list) -> list[MessageSummary]:
+    """
+    Fetch summaries for known message IDs using batch requests.
+
+    Args:
+        service: Authenticated Gmail API service object
+        email_ids: IDs of the messages to summarize
+
+    Returns:
+        list[MessageSummary]: One per ID, in input order; a failed fetch has its error set
+    """
+    requests = [(email_id, service.users().messages().get(userId='me', id=email_id, format='metadata', metadataHeaders=['subject', 'date'])) for email_id in email_ids]
+    responses = _execute_batch(service, requests)
+    summaries = []
+    for email_id in email_ids:
+        message, error = responses.get(email_id, (None, 'no response in batch'))
+        if error is not None:
+            summaries.append(MessageSummary(email_id, '', '', error=str(error)))
+        else:
+            summaries.append(parse_summary(email_id, message))
+    return summaries
+
+def iter_summaries(service: Resource, query: str=None, page_size: int=100, limit: int=None, page_token: str=None) -> Iterator[MessageSummary]:
+    """
+    Yield a summary for every matching inbox message.
+
+    Pages are fetched lazily as the generator is consumed, so memory stays
+    bounded by page_size no matter how large the mailbox is.
+
+    Args:
+        service: Authenticated Gmail API service object
+        query: Optional Gmail search query (e.g. 'subject:TEST')
+        page_size: Number of messages fetched per messages.list call
+        limit: Optional maximum number of summaries to yield
+        page_token: Optional nextPageToken to resume from
+
+    Yields:
+        MessageSummary: One per message
+
+    Raises:
+        Exception: If a messages.list call fails
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        summaries, page_token = list_summaries(service, query, size, page_token)
+        yield from summaries
+        if remaining is not None:
+            remaining -= len(summaries)
+        if not page_token:
+            return
+
+def list_email_page(service: Resource, query: str=None, max_results: int=20, page_token: str=None) -> tuple[list[str], Optional[str]]:
+    """
+    Fetch one page of inbox summaries in format "id:timestamp:subject".
+
+    String form of list_summaries; a message whose metadata cannot be fetched
+    is reported on its own line as "id:Failed to fetch metadata: <reason>".
+
+    Returns:
+        tuple[list[str], Optional[str]]: Summary lines and the token for the next page, if any
+
+    Raises:
+        Exception: If the messages.list call itself fails
+    """
+    summaries, next_token = list_summaries(service, query, max_results, page_token)
+    return ([str(summary) for summary in summaries], next_token)
+
+def summarize_emails(service: Resource, email_ids: list) -> list[str]:
+    """
+    Fetch "id:timestamp:subject" summaries for known message IDs. String form of get_summaries.
+
+    Returns:
+        list[str]: One summary line per ID, in input order
+    """
+    return [str(summary) for summary in get_summaries(service, email_ids)]
+
+def iter_emails(service: Resource, query: str=None, page_size: int=100, limit: int=None, page_token: str=None) -> Iterator[str]:
+    """
+    Yield "id:timestamp:subject" summaries for every matching inbox message. String form of iter_summaries.
+
+    Yields:
+        str: One summary line per message
+    """
+    for summary in iter_summaries(service, query, page_size, limit, page_token):
+        yield str(summary)
+
 def list_emails(service: Resource, query: str=None, max_results: int=20) -> str:
     """
     List available emails in inbox in format "id:timestamp:subject".
@@ -100,45 +717,9 @@ def list_emails(service: Resource, query: str=None, max_results: int=20) -> str:
         Example: "abc123:2024-01-20 14:30:Test Subject"
     """
     try:
-        search_query = 'in:inbox'
-        if query:
-            search_query = f'{search_query} {query}'
-        params = {'userId': 'me', 'maxResults': max_results, 'q': search_query}
-        results = service.users().messages().list(**params).execute()
-        messages = results.get('messages', [])
-        if not messages:
-            return 'No emails found'
-        email_list = []
-        for msg in messages:
-            message = service.users().messages().get(userId='me', id=msg['id'], format='metadata', metadataHeaders=['subject', 'date']).execute()
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-            if not date and 'internalDate' in message:
-                from datetime import datetime
-                date = datetime.fromtimestamp(int(message['internalDate']) / 1000).strftime('%Y-%m-%d %H:%M')
-            email_list.append(f"{msg['id']}:{date}:{subject}")
-        return '\n'.join(email_list)
-    except Exception as e:
-        return f'Failed to list emails: {str(e)}'
-        return '\n'.join(email_list)
-    except Exception as e:
-        return f'Failed to list emails: {str(e)}'
-        messages = results.get('messages', [])
-        if not messages:
+        email_list, _ = list_email_page(service, query, max_results)
+        if not email_list:
             return 'No emails found'
-        email_list = []
-        for msg in messages:
-            message = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-            headers = message['payload']['headers']
-            subject = 'No Subject'
-            sender = 'Unknown Sender'
-            for header in headers:
-                if header['name'].lower() == 'subject':
-                    subject = header['value']
-                elif header['name'].lower() == 'from':
-                    sender = header['value']
-            email_list.append(f"{msg['id']}: {subject}")
         return '\n'.join(email_list)
     except Exception as e:
         return f'Failed to list emails: {str(e)}'
@@ -155,14 +736,65 @@ def archive_email(service: Resource, email_id: str) -> str:
         str: Success message or error description
     """
     try:
-        message = service.users().messages().get(userId='me', id=email_id).execute()
+        message = ratelimit.execute(service, service.users().messages().get(userId='me', id=email_id))
         current_labels = message.get('labelIds', [])
         if 'INBOX' not in current_labels:
             return f'Email {email_id} is not in inbox'
-        result = service.users().messages().modify(userId='me', id=email_id, body={'removeLabelIds': ['INBOX']}).execute()
+        result = ratelimit.execute(service, service.users().messages().modify(userId='me', id=email_id, body={'removeLabelIds': ['INBOX']}))
         updated_labels = result.get('labelIds', [])
+        cache = resolve_cache(None)
+        if cache:
+            cache.set_labels(get_sender_address(service), email_id, updated_labels)
         if 'INBOX' in updated_labels:
             return f'Failed to remove INBOX label from email {email_id}'
         return f'Email {email_id} archived successfully'
     except Exception as e:
-        return f'Failed to archive email {email_id}: {str(e)}'
\ No newline at end of file
+        return f'Failed to archive email {email_id}: {str(e)}'
+
+def archive_emails(service: Resource, email_ids: list, verify: bool=False) -> list:
+    """
+    Archive many emails with messages.batchModify.
+
+    IDs are sent in chunks of BATCH_MODIFY_LIMIT, so thousands of messages take a
+    handful of calls. batchModify does not report per-message outcomes, so every
+    ID in a successful chunk is reported as archived; with verify=True the IDs are
+    first checked with batched messages.get calls and missing or already archived
+    messages are reported individually and skipped.
+
+    Args:
+        service: Authenticated Gmail API service object
+        email_ids: IDs of the emails to archive (duplicates are ignored)
+        verify: If True, check each message exists and is in the inbox first
+
+    Returns:
+        list: One ArchiveResult per ID, in input order
+    """
+    email_ids = list(dict.fromkeys(email_ids))
+    cache = resolve_cache(None)
+    outcomes = {}
+    pending = email_ids
+    if verify:
+        try:
+            requests = [(email_id, service.users().messages().get(userId='me', id=email_id, format='minimal')) for email_id in email_ids]
+            responses = _execute_batch(service, requests)
+        except Exception as e:
+            return [ArchiveResult(email_id, False, f'Failed to archive email {email_id}: {str(e)}') for email_id in email_ids]
+        pending = []
+        for email_id in email_ids:
+            message, error = responses.get(email_id, (None, 'no response in batch'))
+            if error is not None:
+                outcomes[email_id] = ArchiveResult(email_id, False, f'Failed to archive email {email_id}: {str(error)}')
+            elif 'INBOX' not in message.get('labelIds', []):
+                outcomes[email_id] = ArchiveResult(email_id, False, f'Email {email_id} is not in inbox')
+            else:
+                pending.append(email_id)
+    for start in range(0, len(pending), BATCH_MODIFY_LIMIT):
+        chunk = pending[start:start + BATCH_MODIFY_LIMIT]
+        try:
+            ratelimit.execute(service, service.users().messages().batchModify(userId='me', body={'ids': chunk, 'removeLabelIds': ['INBOX']}))
+            if cache:
+                cache.remove_labels(get_sender_address(service), chunk, ['INBOX'])
+            outcomes.update(((email_id, ArchiveResult(email_id, True, f'Email {email_id} archived successfully')) for email_id in chunk))
+        except Exception as e:
+            outcomes.update(((email_id, ArchiveResult(email_id, False, f'Failed to archive email {email_id}: {str(e)}')) for email_id in chunk))
+    return [outcomes[email_id] for email_id in email_ids]
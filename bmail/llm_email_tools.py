@@ -1,8 +1,18 @@
 import os
-from typing import Optional
-from bmail import email_handler
+from typing import List, Optional, Union
+from bmail import email_handler, metrics
 
-def send_email(to: str, cc: str, bcc: str, subject: str, body: str, cred_filepath: Optional[str]=None) -> str:
+# Body characters read_email returns by default; enough for nearly all human-written mail.
+DEFAULT_MAX_CHARS = 20000
+
+# Body characters read_thread returns per message by default, after quoted history is removed.
+DEFAULT_THREAD_MAX_CHARS = 4000
+
+# Characters of extracted text get_attachment returns by default.
+DEFAULT_ATTACHMENT_MAX_CHARS = 20000
+
+@metrics.operation('send_email')
+def send_email(to: str, cc: str, bcc: str, subject: str, body: str, cred_filepath: Optional[str]=None, queue: bool=False, attachments: Optional[List[str]]=None) -> str:
     """Send an email using Gmail API.
     
     Args:
@@ -12,6 +22,10 @@ def send_email(to: str, cc: str, bcc: str, subject: str, body: str, cred_filepat
         subject: Email subject line
         body: Email body text
         cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+        queue: If True, queue the email in the persistent outbox and return at once;
+            it is sent in the background and retried until Gmail accepts it
+        attachments: Paths of local files to attach (up to 35 MB in total); they are
+            streamed from disk through Gmail's resumable upload endpoint
         
     Returns:
         str: Success/error message
@@ -21,8 +35,11 @@ def send_email(to: str, cc: str, bcc: str, subject: str, body: str, cred_filepat
         "Email sent successfully"
     """
     creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
-    return email_handler.send_email(creds, to, cc, bcc, subject, body)
+    if queue:
+        return email_handler.queue_email(creds, to, cc, bcc, subject, body, attachments=attachments)
+    return email_handler.send_email(creds, to, cc, bcc, subject, body, attachments=attachments)
 
+@metrics.operation('reply_to_email')
 def reply_to_email(email_id: str, body: str, sender: str, cred_filepath: Optional[str]=None) -> str:
     """Reply to a specific email using Gmail API.
 
@@ -40,49 +57,54 @@ def reply_to_email(email_id: str, body: str, sender: str, cred_filepath: Optiona
         "Reply sent successfully"
     """
     creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
-    original = email_handler.receive_email(creds, email_id)
-    if original.startswith('Error'):
-        return original
-    lines = original.split('\n')
-    from_line = next((l for l in lines if l.startswith('From: ')), '')
-    subject_line = next((l for l in lines if l.startswith('Subject: ')), '')
-    message_id_line = next((l for l in lines if l.startswith('Message-ID: ')), '')
-    thread_id_line = next((l for l in lines if l.startswith('Thread-ID: ')), '')
-    if not from_line or not subject_line:
-        return 'Error: Could not parse original email headers'
-    original_sender = from_line.replace('From: ', '').strip()
-    original_subject = subject_line.replace('Subject: ', '').strip()
-    reply_subject = original_subject if original_subject.startswith('Re:') else f'Re: {original_subject}'
-    message_id = message_id_line.replace('Message-ID: ', '').strip() if message_id_line else None
-    thread_id = thread_id_line.replace('Thread-ID: ', '').strip() if thread_id_line else None
-    return email_handler.send_email(creds, original_sender, '', '', reply_subject, body, thread_id=thread_id, in_reply_to=message_id, references=message_id)
-
-def check_inbox(query: str=None, cred_filepath: Optional[str]=None) -> str:
+    return email_handler.reply_to_email(creds, email_id, body)
+
+@metrics.operation('check_inbox')
+def check_inbox(query: str=None, cred_filepath: Optional[str]=None, cursor: Optional[str]=None, max_results: int=20, new_only: bool=False) -> str:
     """List inbox contents using Gmail API.
 
+    Results are paged. When more emails match, the last line reads
+    "Next cursor: <cursor>"; call again with that cursor to get the next page.
+
+    With new_only=True only emails that arrived since the previous new_only
+    check are listed ("No new emails" if none); query, cursor and max_results
+    are ignored. The very first such check lists the current inbox.
+
     Args:
         query: Optional Gmail search query (e.g. 'subject:"TEST EMAIL"')
         cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+        cursor: Cursor from a previous check_inbox call (optional - continues that listing)
+        max_results: Number of emails per page (default 20)
+        new_only: If True, list only emails that are new since the last new_only check
 
     Returns:
-        str: Newline-separated list of "sender: subject"
+        str: Newline-separated list of "id:timestamp:subject", plus a "Next cursor:" line if more remain
 
     Example:
-        >>> check_inbox("credentials.json")
-        "user1@example.com: Hello
-user2@example.com: Meeting"
-        >>> check_inbox("credentials.json", query='subject:"TEST EMAIL"')
-        "test@example.com: TEST EMAIL"
+        >>> check_inbox(query='subject:"TEST EMAIL"', max_results=2)
+        "18c1f2:Mon, 1 Jan 2024 10:00:00 +0000:TEST EMAIL
+18c1f1:Sun, 31 Dec 2023 09:00:00 +0000:TEST EMAIL
+Next cursor: eyJxIjoic3ViamVjdDpcIlRFU1QgRU1BSUxcIiIsInAiOiIxMjM0In0"
+        >>> check_inbox(cursor="eyJxIjoic3ViamVjdDpcIlRFU1QgRU1BSUxcIiIsInAiOiIxMjM0In0")
+        "18c1e9:Sat, 30 Dec 2023 08:00:00 +0000:TEST EMAIL"
     """
     creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
-    return email_handler.list_emails(creds, query=query)
+    if new_only:
+        return email_handler.list_new_emails(creds)
+    return email_handler.list_emails(creds, query=query, cursor=cursor, max_results=max_results)
 
-def read_email(email_id: str, cred_filepath: Optional[str]=None) -> str:
+@metrics.operation('read_email')
+def read_email(email_id: str, cred_filepath: Optional[str]=None, max_chars: Optional[int]=DEFAULT_MAX_CHARS) -> str:
     """Retrieve content of a specific email using Gmail API.
-    
+
+    Long bodies are cut at max_chars characters and end with a
+    "[Body truncated after N characters]" line; only the part of the message
+    that is returned gets decoded.
+
     Args:
         email_id: Unique identifier of the email to read
         cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+        max_chars: Maximum body characters to return (None for the whole body)
 
     Returns:
         str: Formatted email content
@@ -94,21 +116,89 @@ def read_email(email_id: str, cred_filepath: Optional[str]=None) -> str:
         Body: Test message"
     """
     creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
-    return email_handler.receive_email(creds, email_id)
+    return email_handler.receive_email(creds, email_id, max_chars)
+
+@metrics.operation('read_thread')
+def read_thread(thread_id: str, max_chars_per_message: Optional[int]=DEFAULT_THREAD_MAX_CHARS, cred_filepath: Optional[str]=None) -> str:
+    """Retrieve a whole conversation in one API call.
+
+    Messages are listed oldest first with quoted history removed, so each
+    message shows only what its author added. read_email output includes the
+    Thread-ID to pass here.
+
+    Args:
+        thread_id: Unique identifier of the thread to read
+        max_chars_per_message: Maximum body characters per message (None for whole bodies)
+        cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+
+    Returns:
+        str: Formatted thread
+
+    Example:
+        >>> read_thread("18c1f0")
+        "Thread-ID: 18c1f0
+Subject: Lunch
+Messages: 2
+
+[1/2] ID: 18c1f0 | From: user@example.com | Date: Mon, 1 Jan 2024 10:00:00 +0000
+Lunch on Friday?
+
+[2/2] ID: 18c1f2 | From: bot@example.com | Date: Mon, 1 Jan 2024 10:05:00 +0000
+Friday works."
+    """
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    return email_handler.read_thread(creds, thread_id, max_chars_per_message)
 
-def archive_emails(email_id: str, cred_filepath: Optional[str]=None) -> str:
-    """Archive a specific email using Gmail API.
+@metrics.operation('get_attachment')
+def get_attachment(email_id: str, attachment: Optional[str]=None, max_chars: Optional[int]=DEFAULT_ATTACHMENT_MAX_CHARS, cred_filepath: Optional[str]=None) -> str:
+    """List an email's attachments, or download one and return its local path.
+
+    Attachment bytes are never returned inline. The file is saved to a local
+    content-addressed store (so the same attachment in many emails is
+    downloaded and stored once) and its path is returned, followed by a text
+    extract for text, HTML and (with pypdf installed) PDF files.
+
+    Args:
+        email_id: Unique identifier of the email
+        attachment: Part ID or file name from the listing; omit to list the attachments
+        max_chars: Maximum characters of extracted text (0 for none, None for all)
+        cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+
+    Returns:
+        str: "part_id:filename:mime_type:size" lines, or the saved file's details and text
+
+    Example:
+        >>> get_attachment("18c1f0")
+        "1:report.pdf:application/pdf:48213"
+        >>> get_attachment("18c1f0", "report.pdf")
+        "Saved: /home/bot/.cache/bmail/attachments/objects/3f/3f9a...
+Filename: report.pdf
+Type: application/pdf
+Size: 48213 bytes
+SHA-256: 3f9a..."
+    """
+    creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
+    return email_handler.get_attachment(creds, email_id, attachment, max_chars)
+
+@metrics.operation('archive_emails')
+def archive_emails(email_ids: Union[str, List[str]], cred_filepath: Optional[str]=None, verify: bool=False) -> str:
+    """Archive one or more emails using Gmail API.
     
     Args:
-        email_id: Unique identifier of the email to archive
+        email_ids: ID of the email to archive, several IDs separated by commas or
+            whitespace, or a list of IDs
         cred_filepath: Path to credentials.json file (optional - uses env vars by default)
+        verify: If True, check each email exists and is in the inbox before archiving
 
     Returns:
-        str: Success/error message
+        str: One success/error line per email ID
     
     Example:
-        >>> archive_emails("credentials.json", "12345")
-        "Email archived successfully"
+        >>> archive_emails("12345, 67890")
+        "Email 12345 archived successfully
+Email 67890 archived successfully"
     """
     creds = cred_filepath or os.environ['BMAIL_CREDENTIALS_PATH']
-    return email_handler.archive_email(creds, email_id)
\ No newline at end of file
+    if isinstance(email_ids, str):
+        email_ids = email_ids.replace(',', ' ').split()
+    return email_handler.archive_emails(creds, email_ids, verify=verify)
@@ -0,0 +1,166 @@
+"""
+Offline load test: drive bmail.llm_email_tools against a FakeGmail backend.
+
+Reports, per tool operation, how many Gmail API calls and HTTP round trips it
+made and its p50/p99 latency, so a change in call pattern (an extra round
+trip, a lost batch, a cache that stopped hitting) shows up without a real
+account. Run with:
+
+    python -m bmail.loadtest --messages 500 --iterations 100 --latency 0.02
+"""
+import os
+import math
+import random
+import argparse
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional
+from bmail import auth, llm_email_tools
+from bmail.fake_gmail import FakeGmail
+from bmail.message_cache import reset_default_cache
+from bmail.sync import reset_default_sync
+
+MAILBOX = 'bot@example.com'
+CORRESPONDENT = 'user@example.com'
+CREDENTIALS_PATH = 'fake-credentials.json'
+OPERATIONS = ('check_inbox', 'check_inbox_new', 'read_email', 'read_thread', 'reply_to_email', 'send_email', 'archive_emails')
+
+class OperationStats(NamedTuple):
+    """Measurements for one tool operation.
+
+    Attributes:
+        name: Operation name
+        count: Times it ran
+        errors: Runs whose result was an error message
+        api_calls: Gmail API calls made, by method
+        round_trips: HTTP round trips made (a batch counts once)
+        p50: Median latency in seconds
+        p99: 99th percentile latency in seconds
+    """
+    name: str
+    count: int
+    errors: int
+    api_calls: Counter
+    round_trips: int
+    p50: float
+    p99: float
+
+    def __str__(self):
+        per_call = sum(self.api_calls.values()) / max(self.count, 1)
+        methods = ', '.join((f'{m}={n}' for m, n in sorted(self.api_calls.items())))
+        return f'{self.name:<16} n={self.count:<5} err={self.errors:<4} calls/op={per_call:<6.2f} trips/op={self.round_trips / max(self.count, 1):<6.2f} p50={self.p50 * 1000:8.2f}ms p99={self.p99 * 1000:8.2f}ms  {methods}'
+
+def percentile(samples: list, fraction: float) -> float:
+    """Nearest-rank percentile of samples (0.0 for no samples)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+@contextmanager
+def fake_environment(backend: FakeGmail, mailbox: str=MAILBOX):
+    """
+    Point bmail's environment-driven entry points at a fake backend.
+
+    Sets BMAIL_SENDER, BMAIL_CREDENTIALS_PATH and a throwaway BMAIL_CACHE_DIR,
+    installs a fake-backed service in the auth cache, and restores everything
+    on exit.
+    """
+    saved = {name: os.environ.get(name) for name in ('BMAIL_SENDER', 'BMAIL_CREDENTIALS_PATH', 'BMAIL_CACHE_DIR')}
+    with tempfile.TemporaryDirectory() as cache:
+        os.environ.update(BMAIL_SENDER=mailbox, BMAIL_CREDENTIALS_PATH=CREDENTIALS_PATH, BMAIL_CACHE_DIR=cache)
+        reset_default_cache()
+        reset_default_sync()
+        auth.install_service(CREDENTIALS_PATH, mailbox, backend.build_service(mailbox))
+        try:
+            yield
+        finally:
+            auth.invalidate_service(CREDENTIALS_PATH, mailbox)
+            reset_default_cache()
+            reset_default_sync()
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+def seed_mailbox(backend: FakeGmail, messages: int, mailbox: str=MAILBOX) -> None:
+    """Fill a mailbox with messages from a correspondent."""
+    backend.add_mailbox(mailbox)
+    backend.add_mailbox(CORRESPONDENT)
+    for i in range(messages):
+        backend.add_message(mailbox, sender=CORRESPONDENT, subject=f'Load test message {i}', body=f'Message body {i}\n' * 20)
+
+def _operations(backend: FakeGmail, rng: random.Random, mailbox: str) -> dict:
+
+    def inbox_ids():
+        box = backend.mailboxes[mailbox.lower()]
+        return [m.id for m in box.messages.values() if 'INBOX' in m.label_ids] or list(box.messages)
+
+    def thread_id():
+        return backend.mailboxes[mailbox.lower()].messages[rng.choice(inbox_ids())].thread_id
+    return {'check_inbox': lambda: llm_email_tools.check_inbox(), 'check_inbox_new': lambda: llm_email_tools.check_inbox(new_only=True), 'read_email': lambda: llm_email_tools.read_email(rng.choice(inbox_ids())), 'read_thread': lambda: llm_email_tools.read_thread(thread_id()), 'reply_to_email': lambda: llm_email_tools.reply_to_email(rng.choice(inbox_ids()), 'Thanks, received.', mailbox), 'send_email': lambda: llm_email_tools.send_email(CORRESPONDENT, '', '', 'Load test', 'Hello from the load test'), 'archive_emails': lambda: llm_email_tools.archive_emails(rng.sample(inbox_ids(), min(5, len(inbox_ids()))))}
+
+def _is_error(result: str) -> bool:
+    return any((marker in result for marker in ('Error', 'Failed', 'error')))
+
+def run_load_test(backend: Optional[FakeGmail]=None, iterations: int=50, messages: int=200, operations=OPERATIONS, seed: int=0, on_result: Callable[[str, str], None]=None) -> list:
+    """
+    Run each operation iterations times against a fake backend.
+
+    Operations run one at a time so every API call is attributed to the
+    operation that made it.
+
+    Args:
+        backend: Backend to use (default: a new zero-latency FakeGmail)
+        iterations: Runs per operation
+        messages: Messages to seed the mailbox with
+        operations: Names from OPERATIONS to run
+        seed: Seed for choosing message IDs
+        on_result: Optional callback(operation, result) for every run
+
+    Returns:
+        list[OperationStats]: One entry per operation, in the order given
+    """
+    backend = backend or FakeGmail()
+    rng = random.Random(seed)
+    seed_mailbox(backend, messages)
+    stats = []
+    with fake_environment(backend):
+        table = _operations(backend, rng, MAILBOX)
+        for name in operations:
+            latencies = []
+            calls = Counter()
+            round_trips = 0
+            errors = 0
+            for _ in range(iterations):
+                before_calls = Counter(backend.calls)
+                before_trips = backend.round_trips
+                start = time.perf_counter()
+                result = table[name]()
+                latencies.append(time.perf_counter() - start)
+                calls.update(Counter(backend.calls) - before_calls)
+                round_trips += backend.round_trips - before_trips
+                errors += _is_error(result)
+                if on_result:
+                    on_result(name, result)
+            stats.append(OperationStats(name, iterations, errors, calls, round_trips, percentile(latencies, 0.5), percentile(latencies, 0.99)))
+    return stats
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Load test bmail.llm_email_tools against an in-process fake Gmail.')
+    parser.add_argument('--messages', type=int, default=200, help='messages to seed the inbox with')
+    parser.add_argument('--iterations', type=int, default=50, help='runs per operation')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of simulated latency per round trip')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a 503 per API call')
+    parser.add_argument('--quota', type=float, default=None, help='per-user quota units per second (default unlimited)')
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    backend = FakeGmail(latency=args.latency, error_rate=args.error_rate, user_units_per_second=args.quota, seed=args.seed)
+    for stat in run_load_test(backend, args.iterations, args.messages, args.operations, args.seed):
+        print(stat)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+import re
+import base64
+import html
+from email import policy
+from email.feedparser import BytesFeedParser
+from email.parser import BytesHeaderParser
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+class Attachment(NamedTuple):
+    """An attachment part of a message; its data is not downloaded.
+
+    Attributes:
+        part_id: Gmail partId of the part
+        filename: Attachment file name
+        mime_type: MIME type of the part
+        size: Size in bytes as reported by Gmail
+        attachment_id: ID for messages.attachments.get (None if the data is inline)
+    """
+    part_id: str
+    filename: str
+    mime_type: str
+    size: int
+    attachment_id: Optional[str]
+
+def _b64decode(data: str, max_bytes: int=None) -> bytes:
+    """Decode base64url data, or only enough of it to yield max_bytes bytes."""
+    if max_bytes is not None:
+        data = data[:-(-max_bytes // 3) * 4]
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _to_text(raw: bytes, charset: str) -> str:
+    try:
+        return raw.decode(charset, 'replace')
+    except LookupError:
+        return raw.decode('utf-8', 'replace')
+
+class _EncodedPart:
+    """Text part of a format='full' payload, kept base64url-encoded until read."""
+    __slots__ = ('data', 'charset')
+
+    def __init__(self, data: str, charset: str):
+        self.data = data
+        self.charset = charset
+
+    def decode(self, max_chars: int=None) -> str:
+        # A character is at most 4 bytes in any charset Gmail serves.
+        text = _to_text(_b64decode(self.data, max_chars * 4 if max_chars is not None else None), self.charset)
+        return text if max_chars is None else text[:max_chars]
+
+class _MimePart:
+    """Text part of a parsed RFC 822 message (format='raw')."""
+    __slots__ = ('part',)
+
+    def __init__(self, part):
+        self.part = part
+
+    def decode(self, max_chars: int=None) -> str:
+        part = self.part
+        if str(part.get('Content-Transfer-Encoding', '')).strip().lower() == 'base64':
+            # Decoded by hand so a payload cut off by prefix parsing still decodes.
+            data = ''.join(part.get_payload().split())
+            if max_chars is not None:
+                data = data[:-(-max_chars * 4 // 3) * 4]
+            try:
+                raw = base64.b64decode(data[:len(data) // 4 * 4])
+            except ValueError:
+                raw = part.get_payload(decode=True) or b''
+        else:
+            raw = part.get_payload(decode=True) or b''
+        text = _to_text(raw, part.get_content_charset() or 'utf-8')
+        return text if max_chars is None else text[:max_chars]
+
+class MessageSummary(NamedTuple):
+    """One inbox listing entry, built from a 'metadata' resource or the local index.
+
+    str() gives the "id:timestamp:subject" line the string API returns, or
+    "id:Failed to fetch metadata: <reason>" when error is set.
+
+    Attributes:
+        id: Gmail message ID
+        date: Date header (or internal date as "YYYY-MM-DD HH:MM" when the header is missing)
+        subject: Subject header, "No Subject" when missing
+        thread_id: Gmail thread ID, if known
+        error: Why the metadata could not be fetched, or None
+    """
+    id: str
+    date: str
+    subject: str
+    thread_id: Optional[str] = None
+    error: Optional[str] = None
+
+    def __str__(self):
+        if self.error is not None:
+            return f'{self.id}:Failed to fetch metadata: {self.error}'
+        return f'{self.id}:{self.date}:{self.subject}'
+
+class ArchiveResult(NamedTuple):
+    """Outcome of archiving one message.
+
+    str() gives the result line the string API returns.
+
+    Attributes:
+        id: Gmail message ID
+        ok: True if the message was archived
+        result: Success message or error description
+    """
+    id: str
+    ok: bool
+    result: str
+
+    def __str__(self):
+        return self.result
+
+def _summary_date(date: Optional[str], internal_date: Optional[str]) -> str:
+    if not date and internal_date:
+        return datetime.fromtimestamp(int(internal_date) / 1000).strftime('%Y-%m-%d %H:%M')
+    return date or ''
+
+def parse_summary(message_id: str, resource: dict) -> MessageSummary:
+    """
+    Build a MessageSummary from a messages.get resource in 'metadata' (or any) format.
+
+    Args:
+        message_id: ID the resource was requested by
+        resource: Gmail message resource
+
+    Returns:
+        MessageSummary: The summary
+    """
+    subject = date = None
+    for header in resource.get('payload', {}).get('headers', []):
+        name = header['name'].lower()
+        if name == 'subject' and subject is None:
+            subject = header['value']
+        elif name == 'date' and date is None:
+            date = header['value']
+    return MessageSummary(message_id, _summary_date(date, resource.get('internalDate')), 'No Subject' if subject is None else subject, resource.get('threadId'))
+
+class Message:
+    """A Gmail message whose body is decoded on demand.
+
+    Headers are available as soon as the message is built. Text parts stay
+    encoded until body or text() is read, and text(max_chars) decodes only
+    as much of them as the budget needs.
+    """
+    __slots__ = ('id', 'thread_id', 'label_ids', 'headers', 'snippet', 'internal_date', 'size', '_text_parts', '_html_parts', '_attachments', '_inline', '_body', '_raw')
+
+    def __init__(self, id: str, thread_id: str=None, label_ids: list=None, headers: dict=None, text_parts: list=None, html_parts: list=None, attachments: list=None, inline: dict=None, snippet: str='', internal_date: str=None, size: int=0, raw: '_RawSource'=None):
+        self.id = id
+        self.thread_id = thread_id
+        self.label_ids = label_ids or []
+        self.headers = headers or {}
+        self.snippet = snippet
+        self.internal_date = internal_date
+        self.size = size
+        self._text_parts = text_parts
+        self._html_parts = html_parts
+        self._attachments = attachments
+        self._inline = inline if inline is not None else {}
+        self._body = None
+        self._raw = raw
+
+    def header(self, name: str, default: str=None) -> Optional[str]:
+        """Return a header value by case-insensitive name."""
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def sender(self) -> Optional[str]:
+        return self.header('from')
+
+    @property
+    def to(self) -> Optional[str]:
+        return self.header('to')
+
+    @property
+    def subject(self) -> Optional[str]:
+        return self.header('subject')
+
+    @property
+    def message_id(self) -> Optional[str]:
+        return self.header('message-id')
+
+    @property
+    def references(self) -> str:
+        return self.header('references', '')
+
+    def summary(self) -> MessageSummary:
+        """Return the inbox listing entry for this message."""
+        return MessageSummary(self.id, _summary_date(self.header('date'), self.internal_date), self.header('subject', 'No Subject'), self.thread_id)
+
+    @property
+    def attachments(self) -> list:
+        self._load()
+        return self._attachments
+
+    def attachment_data(self, part_id: str) -> Optional[bytes]:
+        """
+        Return the decoded data of an attachment carried inline in the message.
+
+        Small attachments come with their data in the part tree (and every
+        attachment of a 'raw' message is in its source), so they need no
+        messages.attachments.get call.
+
+        Returns:
+            Optional[bytes]: The data, or None if it must be fetched by attachment ID
+        """
+        self._load()
+        data = self._inline.get(part_id)
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return _b64decode(data)
+        return data.get_payload(decode=True) or b''
+
+    @property
+    def body(self) -> str:
+        """The full body text (decoded on first access)."""
+        if self._body is None:
+            self._load()
+            self._body = self._join(self._text_parts, self._html_parts, None)
+        return self._body
+
+    def text(self, max_chars: int=None) -> str:
+        """
+        Return at most max_chars characters of body text.
+
+        Only the encoded data needed for the budget is decoded; for a raw
+        message that has not been fully parsed, only a prefix of the raw
+        message is decoded and parsed.
+        """
+        if max_chars is None or self._body is not None:
+            return self.body[:max_chars] if max_chars is not None else self.body
+        if self._text_parts is None:
+            parts = self._raw.prefix_parts(max_chars)
+            if parts is not None:
+                return self._join(parts[0], parts[1], max_chars)
+            self._load()
+        return self._join(self._text_parts, self._html_parts, max_chars)
+
+    def unquoted_text(self, max_chars: int=None) -> str:
+        """
+        Return at most max_chars characters of body text with quoted history removed.
+
+        Quoted history usually follows the new text, so the body is decoded
+        in growing prefixes and decoding stops once the budget is filled or
+        the start of the quoted history is found.
+        """
+        if max_chars is None:
+            return strip_quoted(self.body)
+        budget = max_chars * 2 + 256
+        while True:
+            text = self.text(budget)
+            kept, found = _split_quoted(text)
+            if found or len(kept) >= max_chars or len(text) < budget:
+                return kept[:max_chars]
+            budget *= 4
+
+    @staticmethod
+    def _join(text_parts: list, html_parts: list, max_chars: Optional[int]) -> str:
+        if text_parts:
+            chunks = []
+            remaining = max_chars
+            for part in text_parts:
+                chunk = part.decode(remaining)
+                chunks.append(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+                    if remaining <= 0:
+                        break
+            return ''.join(chunks)
+        # Markup is stripped after decoding, so an HTML budget covers the markup too.
+        text = '\n'.join((html_to_text(part.decode(max_chars * 4 if max_chars is not None else None)) for part in html_parts or []))
+        return text if max_chars is None else text[:max_chars]
+
+    def _load(self) -> None:
+        if self._text_parts is None:
+            self._text_parts, self._html_parts, self._attachments, self._inline = self._raw.parts()
+
+    def __repr__(self):
+        return f'Message(id={self.id!r}, subject={self.subject!r})'
+
+def _charset(part: dict) -> str:
+    for header in part.get('headers', []):
+        if header.get('name', '').lower() == 'content-type':
+            match = re.search('charset="?([^";\\s]+)', header.get('value', ''), re.I)
+            if match:
+                return match.group(1)
+    return 'utf-8'
+
+def _walk(part: dict, plain: list, html_parts: list, attachments: list, inline: dict) -> None:
+    mime_type = part.get('mimeType', '')
+    body = part.get('body', {})
+    if part.get('filename') or body.get('attachmentId'):
+        attachments.append(Attachment(part.get('partId', ''), part.get('filename', ''), mime_type, body.get('size', 0), body.get('attachmentId')))
+        if not body.get('attachmentId'):
+            inline[part.get('partId', '')] = body.get('data', '')
+    elif mime_type.startswith('multipart/'):
+        for child in part.get('parts', []):
+            _walk(child, plain, html_parts, attachments, inline)
+    elif mime_type == 'text/plain' or (not mime_type and 'data' in body):
+        plain.append(_EncodedPart(body.get('data', ''), _charset(part)))
+    elif mime_type == 'text/html':
+        html_parts.append(_EncodedPart(body.get('data', ''), _charset(part)))
+
+def _decoded_size(part) -> int:
+    """Return the decoded size of a MIME part, as Gmail reports it, without decoding base64 data."""
+    payload = part.get_payload() or ''
+    if part.get('content-transfer-encoding', '').strip().lower() == 'base64':
+        data = ''.join(payload.split())
+        return len(data) * 3 // 4 - (len(data) - len(data.rstrip('=')))
+    return len(part.get_payload(decode=True) or b'')
+
+def _walk_mime(part, part_id: str, plain: list, html_parts: list, attachments: list, inline: dict) -> None:
+    if part.is_multipart():
+        prefix = f'{part_id}.' if part_id else ''
+        for i, child in enumerate(part.get_payload()):
+            _walk_mime(child, f'{prefix}{i}', plain, html_parts, attachments, inline)
+        return
+    mime_type = part.get_content_type()
+    if part.get_filename() or part.get_content_disposition() == 'attachment':
+        attachments.append(Attachment(part_id, part.get_filename() or '', mime_type, _decoded_size(part), None))
+        inline[part_id] = part
+    elif mime_type == 'text/plain':
+        plain.append(_MimePart(part))
+    elif mime_type == 'text/html':
+        html_parts.append(_MimePart(part))
+
+def html_to_text(markup: str) -> str:
+    """Crude HTML to text conversion for messages without a text/plain part."""
+    markup = re.sub('(?is)<(script|style).*?</\\1>', '', markup)
+    markup = re.sub('(?i)<br\\s*/?>|</p>|</div>|</tr>', '\n', markup)
+    return html.unescape(re.sub('<[^>]+>', '', markup)).strip()
+
+# Attribution lines that introduce quoted history: Gmail/Apple ("On <date>, <name>
+# wrote:", possibly wrapped onto a second line), Outlook ("-----Original
+# Message-----", or a From:/Sent: header block) and forwarded messages.
+_QUOTE_START = re.compile('^[ \\t]*(?:On\\b[^\\n]{0,300}(?:\\n[^\\n]{0,300})?\\bwrote:[ \\t]*$|-{2,}[ \\t]*(?:Original Message|Forwarded message)[ \\t]*-{2,}|From:[^\\n]*\\n(?:[^\\n]*\\n){0,2}?(?:Sent|Date):)', re.M | re.I)
+
+def _split_quoted(text: str) -> tuple:
+    match = _QUOTE_START.search(text)
+    if match:
+        text = text[:match.start()]
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('>')]
+    return ('\n'.join(lines).strip(), match is not None)
+
+def strip_quoted(text: str) -> str:
+    """Remove quoted history ("> " lines and everything after a reply attribution) from body text."""
+    return _split_quoted(text)[0]
+
+class _RawSource:
+    """The base64url 'raw' field of a message, decoded piecemeal."""
+    __slots__ = ('data', 'header_bytes')
+
+    def __init__(self, data: str):
+        self.data = data
+        self.header_bytes = None
+
+    def headers(self) -> dict:
+        """Parse the header block, decoding only as much of the message as it spans."""
+        size = 8192
+        while True:
+            chunk = _b64decode(self.data, size)
+            match = re.search(b'\\r?\\n\\r?\\n', chunk)
+            if match or len(chunk) < size:
+                break
+            size *= 4
+        self.header_bytes = match.end() if match else len(chunk)
+        parsed = BytesHeaderParser(policy=policy.compat32).parsebytes(chunk[:self.header_bytes])
+        headers = {}
+        for name, value in parsed.items():
+            headers.setdefault(name.lower(), str(value))
+        return headers
+
+    def parts(self) -> tuple:
+        """Decode and parse the whole message into (text parts, HTML parts, attachments, attachment parts by part ID)."""
+        plain, html_parts, attachments, inline = ([], [], [], {})
+        parser = BytesFeedParser(policy=policy.compat32)
+        parser.feed(_b64decode(self.data))
+        _walk_mime(parser.close(), '', plain, html_parts, attachments, inline)
+        return (plain, html_parts, attachments, inline)
+
+    def prefix_parts(self, max_chars: int) -> Optional[tuple]:
+        """
+        Parse only a prefix of the message large enough for max_chars of text.
+
+        Returns:
+            Optional[tuple]: (text parts, HTML parts), or None if the prefix holds
+            no text (e.g. the text follows a large attachment) or would be the
+            whole message anyway
+        """
+        # Up to 4 bytes per character, inflated up to 3x by quoted-printable.
+        size = (self.header_bytes or 0) + max_chars * 12 + 4096
+        if size >= len(self.data) * 3 // 4:
+            return None
+        parser = BytesFeedParser(policy=policy.compat32)
+        parser.feed(_b64decode(self.data, size))
+        plain, html_parts, attachments = ([], [], [])
+        _walk_mime(parser.close(), '', plain, html_parts, attachments, {})
+        return (plain, html_parts) if plain or html_parts else None
+
+def parse_message(resource: dict) -> Message:
+    """
+    Build a Message from a messages.get resource in 'full' or 'raw' format.
+
+    For 'full', the payload tree is walked recursively so text nested in
+    multipart/alternative or multipart/mixed is found; no part data is decoded
+    until the body is read. The body is the concatenated text/plain parts,
+    falling back to HTML stripped of markup when there are none. Attachments
+    are listed but never decoded.
+
+    For 'raw', only the header block is decoded up front; the rest of the
+    message is parsed when the body or attachments are first read.
+
+    Args:
+        resource: Gmail message resource
+
+    Returns:
+        Message: The lazily decoded message
+    """
+    common = {'id': resource.get('id'), 'thread_id': resource.get('threadId'), 'label_ids': resource.get('labelIds'), 'snippet': resource.get('snippet', ''), 'internal_date': resource.get('internalDate'), 'size': resource.get('sizeEstimate', 0)}
+    if 'raw' in resource:
+        raw = _RawSource(resource['raw'])
+        return Message(headers=raw.headers(), raw=raw, **common)
+    payload = resource.get('payload', {})
+    headers = {}
+    for header in payload.get('headers', []):
+        headers.setdefault(header.get('name', '').lower(), header.get('value', ''))
+    plain, html_parts, attachments, inline = ([], [], [], {})
+    _walk(payload, plain, html_parts, attachments, inline)
+    return Message(headers=headers, text_parts=plain, html_parts=html_parts, attachments=attachments, inline=inline, **common)
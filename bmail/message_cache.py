@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Iterable, Optional, Union
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Bumped when the table layout changes; older cache files are emptied on open.
+SCHEMA_VERSION = 3
+
+class MessageCache:
+    """On-disk cache of Gmail message resources keyed by mailbox and message ID.
+
+    Message content never changes once written, so a fetched message can be
+    served from disk forever. 'full' and 'raw' resources are stored separately
+    and a lookup only returns the format asked for. Labels are the only mutable
+    part and live in a separate table so they can be updated without touching
+    the cached content. When the stored content exceeds max_bytes the least
+    recently read messages are evicted.
+
+    Every read and write is scoped to a mailbox address, so one mailbox can
+    never be answered with a message cached for another.
+
+    The cache is best effort: database errors are swallowed and reported as
+    misses, so a broken cache file never breaks reading mail.
+    """
+
+    def __init__(self, path: str, max_bytes: int=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            path: Path of the SQLite database file (created if missing)
+            max_bytes: Upper bound on the size of cached message content
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            # Version 1 keyed rows by message ID alone and version 2 did not record the
+            # format; neither can be migrated, so their rows are dropped.
+            self._conn.execute('DROP TABLE IF EXISTS messages')
+            self._conn.execute('DROP TABLE IF EXISTS labels')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS messages (mailbox TEXT NOT NULL, id TEXT NOT NULL, format TEXT NOT NULL, data TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (mailbox, id, format))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_accessed ON messages (accessed)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS labels (mailbox TEXT NOT NULL, id TEXT NOT NULL, label_ids TEXT NOT NULL, PRIMARY KEY (mailbox, id))')
+
+    def get(self, mailbox: str, message_id: str, format: str='full') -> Optional[dict]:
+        """Return a mailbox's cached message resource in format ('full' or 'raw') with its current labels, or None on a miss."""
+        mailbox = mailbox.lower()
+        try:
+            with self._lock:
+                row = self._conn.execute('SELECT data FROM messages WHERE mailbox = ? AND id = ? AND format = ?', (mailbox, message_id, format)).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute('UPDATE messages SET accessed = ? WHERE mailbox = ? AND id = ? AND format = ?', (time.time(), mailbox, message_id, format))
+                labels = self._conn.execute('SELECT label_ids FROM labels WHERE mailbox = ? AND id = ?', (mailbox, message_id)).fetchone()
+        except sqlite3.Error:
+            return None
+        message = json.loads(row[0])
+        if labels is not None:
+            message['labelIds'] = json.loads(labels[0])
+        return message
+
+    def put(self, mailbox: str, message: dict) -> None:
+        """Store a mailbox's message resource as returned by messages.get(format='full' or 'raw')."""
+        mailbox = mailbox.lower()
+        format = 'raw' if 'raw' in message else 'full'
+        content = {key: value for key, value in message.items() if key != 'labelIds'}
+        data = json.dumps(content, separators=(',', ':'))
+        try:
+            with self._lock:
+                self._conn.execute('INSERT OR REPLACE INTO messages (mailbox, id, format, data, size, accessed) VALUES (?, ?, ?, ?, ?, ?)', (mailbox, message['id'], format, data, len(data), time.time()))
+                if 'labelIds' in message:
+                    self._conn.execute('INSERT OR REPLACE INTO labels (mailbox, id, label_ids) VALUES (?, ?, ?)', (mailbox, message['id'], json.dumps(message['labelIds'])))
+                self._evict_over_limit()
+        except sqlite3.Error:
+            pass
+
+    def set_labels(self, mailbox: str, message_id: str, label_ids: Iterable[str]) -> None:
+        """Record the current labels of a mailbox's message."""
+        try:
+            with self._lock:
+                self._conn.execute('INSERT OR REPLACE INTO labels (mailbox, id, label_ids) VALUES (?, ?, ?)', (mailbox.lower(), message_id, json.dumps(list(label_ids))))
+        except sqlite3.Error:
+            pass
+
+    def remove_labels(self, mailbox: str, message_ids: Iterable[str], label_ids: Iterable[str]) -> None:
+        """Drop labels from a mailbox's cached label sets, e.g. INBOX after archiving."""
+        mailbox = mailbox.lower()
+        removed = set(label_ids)
+        try:
+            with self._lock:
+                for message_id in message_ids:
+                    row = self._conn.execute('SELECT label_ids FROM labels WHERE mailbox = ? AND id = ?', (mailbox, message_id)).fetchone()
+                    if row is not None:
+                        kept = [label for label in json.loads(row[0]) if label not in removed]
+                        self._conn.execute('UPDATE labels SET label_ids = ? WHERE mailbox = ? AND id = ?', (json.dumps(kept), mailbox, message_id))
+        except sqlite3.Error:
+            pass
+
+    def evict(self, mailbox: str, message_id: str) -> None:
+        """Forget a mailbox's message, e.g. after it was deleted."""
+        mailbox = mailbox.lower()
+        try:
+            with self._lock:
+                self._conn.execute('DELETE FROM messages WHERE mailbox = ? AND id = ?', (mailbox, message_id))
+                self._conn.execute('DELETE FROM labels WHERE mailbox = ? AND id = ?', (mailbox, message_id))
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        """Remove every cached message and label set."""
+        with self._lock:
+            self._conn.execute('DELETE FROM messages')
+            self._conn.execute('DELETE FROM labels')
+
+    def size(self) -> int:
+        """Return the number of bytes of cached message content."""
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM messages').fetchone()[0]
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _evict_over_limit(self) -> None:
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM messages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so a full cache does not evict on every single put.
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for mailbox, message_id, format, size in self._conn.execute('SELECT mailbox, id, format, size FROM messages ORDER BY accessed'):
+            if freed >= target:
+                break
+            stale.append((mailbox, message_id, format))
+            freed += size
+        self._conn.executemany('DELETE FROM messages WHERE mailbox = ? AND id = ? AND format = ?', stale)
+        # Labels stay while another format of the message is still cached.
+        self._conn.executemany('DELETE FROM labels WHERE mailbox = ? AND id = ? AND NOT EXISTS (SELECT 1 FROM messages WHERE messages.mailbox = labels.mailbox AND messages.id = labels.id)', [(mailbox, message_id) for mailbox, message_id, _ in stale])
+
+_DEFAULT_CACHE = None
+_DEFAULT_LOCK = threading.Lock()
+
+def cache_dir() -> str:
+    """Return the bmail cache directory (BMAIL_CACHE_DIR, default ~/.cache/bmail)."""
+    return os.environ.get('BMAIL_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'bmail')
+
+def get_default_cache() -> Optional[MessageCache]:
+    """Return the process-wide message cache, or None if caching is disabled.
+
+    The cache lives at BMAIL_CACHE_DIR/messages.sqlite3 and holds at most
+    BMAIL_CACHE_MAX_BYTES of message content (default 256 MB). Setting
+    BMAIL_CACHE_MAX_BYTES=0 disables it.
+    """
+    global _DEFAULT_CACHE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is None:
+            max_bytes = int(os.environ.get('BMAIL_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+            if max_bytes <= 0:
+                return None
+            try:
+                _DEFAULT_CACHE = MessageCache(os.path.join(cache_dir(), 'messages.sqlite3'), max_bytes)
+            except (OSError, sqlite3.Error):
+                return None
+        return _DEFAULT_CACHE
+
+def reset_default_cache() -> None:
+    """Close the process-wide cache so the next use re-reads the environment."""
+    global _DEFAULT_CACHE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is not None:
+            _DEFAULT_CACHE.close()
+        _DEFAULT_CACHE = None
+
+def resolve_cache(cache: Union[MessageCache, bool, None]) -> Optional[MessageCache]:
+    """Map a cache argument to a cache: None means the default cache, False means no cache."""
+    if cache is None or cache is True:
+        return get_default_cache()
+    if cache is False:
+        return None
+    return cache
@@ -0,0 +1,230 @@
+"""
+Instrumentation for Gmail API calls.
+
+Every call made through bmail.ratelimit (and every call riding in a batch
+from gmail_client) produces a CallRecord that is passed to the registered
+hooks. The built-in Registry is always registered and keeps counters and
+latency histograms that can be read with snapshot() or dumped in the
+Prometheus text format with dump():
+
+    from bmail import metrics
+    metrics.add_hook(lambda record: print(record))
+    print(metrics.get_registry().dump())
+
+Calls are tagged with the email_handler / llm_email_tools operation that
+issued them, so quota and latency can be attributed per tool.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, NamedTuple, Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH = 'batch'
+
+class CallRecord(NamedTuple):
+    """One Gmail API call.
+
+    Attributes:
+        method: Short Gmail method name ('messages.get'), or 'batch' for the
+            round trip carrying a batch of calls
+        operation: bmail operation that issued the call ('list_emails'), or None
+        latency: Seconds from first attempt to final outcome, including retries
+        response_bytes: Size of the response body in bytes
+        retries: Attempts made after the first one
+        error: Exception class name of the final failure, or None on success
+        status: HTTP status of the final failure, or None
+        units: Quota units charged for the call
+        batch_size: Calls in the batch the call rode in (0 if sent on its own)
+    """
+    method: str
+    operation: Optional[str]
+    latency: float
+    response_bytes: int
+    retries: int
+    error: Optional[str]
+    status: Optional[int]
+    units: float
+    batch_size: int = 0
+
+_OPERATION = ContextVar('bmail_operation', default=None)
+
+@contextmanager
+def operation(name: str):
+    """
+    Tag the Gmail calls made inside the block (or decorated function) with an operation name.
+
+    The outermost tag wins, so calls made by email_handler on behalf of an
+    llm_email_tools function are attributed to the tool.
+    """
+    if _OPERATION.get() is not None:
+        yield
+        return
+    token = _OPERATION.set(name)
+    try:
+        yield
+    finally:
+        _OPERATION.reset(token)
+
+def current_operation() -> Optional[str]:
+    """Return the operation the current call is tagged with, or None."""
+    return _OPERATION.get()
+
+def _labels(**labels) -> str:
+    return '{' + ','.join((f'{k}="{v}"' for k, v in sorted(labels.items()) if v is not None)) + '}'
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets: tuple=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else repr(bound)] = cumulative
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+class Registry:
+    """In-process counters and histograms fed by CallRecords.
+
+    Metrics:
+        bmail_api_calls_total{method,operation}: API calls (excluding batch envelopes)
+        bmail_api_round_trips_total{operation}: HTTP round trips (a batch counts once)
+        bmail_api_errors_total{method,error,status}: Calls that failed in the end
+        bmail_api_retries_total{method}: Retry attempts
+        bmail_api_quota_units_total{method,operation}: Quota units charged
+        bmail_api_response_bytes_total{method}: Response bytes received
+        bmail_api_latency_seconds{method}: Latency histogram per method
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name: str, value: float, **labels) -> None:
+        key = name + _labels(**labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def __call__(self, record: CallRecord) -> None:
+        with self._lock:
+            if record.method == BATCH or not record.batch_size:
+                self._inc('bmail_api_round_trips_total', 1, operation=record.operation)
+            if record.method == BATCH:
+                return
+            self._inc('bmail_api_calls_total', 1, method=record.method, operation=record.operation)
+            self._inc('bmail_api_quota_units_total', record.units, method=record.method, operation=record.operation)
+            self._inc('bmail_api_response_bytes_total', record.response_bytes, method=record.method)
+            if record.retries:
+                self._inc('bmail_api_retries_total', record.retries, method=record.method)
+            if record.error:
+                self._inc('bmail_api_errors_total', 1, method=record.method, error=record.error, status=record.status)
+            key = 'bmail_api_latency_seconds' + _labels(method=record.method)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(record.latency)
+
+    def value(self, name: str, **labels) -> float:
+        """Return a counter value, summed over any labels not given."""
+        wanted = [f'{k}="{v}"' for k, v in labels.items()]
+        with self._lock:
+            return sum((v for k, v in self.counters.items() if k.split('{', 1)[0] == name and all((w in k for w in wanted))))
+
+    def snapshot(self) -> dict:
+        """Return {'counters': {series: value}, 'histograms': {series: {...}}}."""
+        with self._lock:
+            return {'counters': dict(self.counters), 'histograms': {key: h.snapshot() for key, h in self.histograms.items()}}
+
+    def dump(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted({key.split('{', 1)[0] for key in snapshot['counters']}):
+            lines.append(f'# TYPE {name} counter')
+            lines.extend((f'{key} {value:g}' for key, value in sorted(snapshot['counters'].items()) if key.split('{', 1)[0] == name))
+        if snapshot['histograms']:
+            lines.append('# TYPE bmail_api_latency_seconds histogram')
+        for key, histogram in sorted(snapshot['histograms'].items()):
+            name, labels = key.split('{', 1)
+            prefix = labels[:-1] + ',' if labels != '}' else ''
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels} {histogram['sum']:g}")
+            lines.append(f"{name}_count{{{labels} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        """Zero every metric."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+_REGISTRY = Registry()
+_HOOKS = [_REGISTRY]
+_HOOKS_LOCK = threading.Lock()
+
+def get_registry() -> Registry:
+    """Return the process-wide metrics registry."""
+    return _REGISTRY
+
+def add_hook(hook: Callable[[CallRecord], None]) -> None:
+    """Call hook(record) for every Gmail API call. Exceptions raised by hooks are ignored."""
+    global _HOOKS
+    with _HOOKS_LOCK:
+        _HOOKS = _HOOKS + [hook]
+
+def remove_hook(hook: Callable[[CallRecord], None]) -> None:
+    """Stop calling a hook added with add_hook."""
+    global _HOOKS
+    with _HOOKS_LOCK:
+        _HOOKS = [h for h in _HOOKS if h != hook]
+
+def emit(record: CallRecord) -> None:
+    """Pass a record to every hook."""
+    for hook in _HOOKS:
+        try:
+            hook(record)
+        except Exception:
+            pass
+
+def measure_response(request) -> list:
+    """
+    Wrap an HttpRequest's response handling to capture the body size.
+
+    Returns:
+        list: One-element list that holds the byte count once the response arrives
+    """
+    size = [0]
+    postproc = getattr(request, 'postproc', None)
+    if callable(postproc):
+
+        def measured(resp, content):
+            size[0] = len(content or b'')
+            return postproc(resp, content)
+        request.postproc = measured
+    return size
@@ -0,0 +1,360 @@
+"""
+Durable outbound mail queue.
+
+send_email(..., queue=True) writes the message to an SQLite spool
+(BMAIL_CACHE_DIR/outbox.sqlite3) and returns at once; an OutboxWorker thread
+drains the spool through the Gmail API. A message stays in the spool until
+Gmail has accepted it or it has failed permanently, so neither a crash nor an
+outage loses mail:
+
+    from bmail.outbox import get_default_outbox, OutboxWorker
+    message_id = get_default_outbox().enqueue('credentials.json', 'bot@example.com', {'to_addr': ..., 'subject': ..., 'body': ...})
+    OutboxWorker().drain()          # or python -m bmail.outbox
+
+Every message is given its Message-ID when it is queued and is sent with it.
+Before a message is sent again (after a transient error, or because the
+process died mid-send), the mailbox is searched with rfc822msgid: for that
+Message-ID, so a send that reached Gmail is recorded, not repeated.
+
+Transient failures (throttling, 5xx, network errors, authentication errors)
+are retried with exponential backoff for up to MAX_ATTEMPTS attempts; other
+API errors (an invalid recipient, for example) fail the message at once.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import atexit
+import sqlite3
+import argparse
+import threading
+from email.utils import make_msgid
+from typing import NamedTuple, Optional
+from bmail import bulk, gmail_client, metrics, ratelimit
+from bmail.auth import get_gmail_service
+from bmail.message_cache import cache_dir
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 8
+BASE_DELAY = 5.0
+MAX_DELAY = 900.0
+
+# A message claimed longer ago than this is assumed orphaned by a dead process.
+LEASE_SECONDS = 300.0
+
+# Keyword arguments of gmail_client.send_message that a queued message may carry.
+FIELDS = ('to_addr', 'cc', 'bcc', 'subject', 'body', 'thread_id', 'in_reply_to', 'references', 'from_addr', 'attachments')
+
+class OutboxEntry(NamedTuple):
+    """A message in the spool.
+
+    Attributes:
+        message_id: Message-ID header the message is sent with (the idempotency key)
+        sender: Delegated address the message is sent as
+        status: 'pending', 'sending', 'sent' or 'failed'
+        attempts: Send attempts made so far
+        result: Gmail message ID once sent, last error otherwise
+        created: Time the message was queued (epoch seconds)
+    """
+    message_id: str
+    sender: str
+    status: str
+    attempts: int
+    result: Optional[str]
+    created: float
+
+class Outbox:
+    """SQLite spool of messages waiting to be sent."""
+
+    def __init__(self, path: str=None):
+        """
+        Args:
+            path: SQLite file of the spool (default BMAIL_CACHE_DIR/outbox.sqlite3)
+        """
+        self.path = path or os.path.join(cache_dir(), 'outbox.sqlite3')
+        self._lock = threading.Lock()
+        self.wakeup = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # synchronous=FULL: a message acknowledged as queued must survive a power cut.
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY, message_id TEXT NOT NULL UNIQUE, creds_path TEXT NOT NULL, sender TEXT NOT NULL, fields TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, result TEXT, created REAL NOT NULL, updated REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)')
+
+    def close(self) -> None:
+        """Close the spool database."""
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, creds_path: str, sender: str, fields: dict, message_id: str=None) -> str:
+        """
+        Durably queue a message.
+
+        Args:
+            creds_path: Path to the service account key file to send with
+            sender: Delegated address to send as
+            fields: gmail_client.send_message keyword arguments (to_addr, cc, bcc, subject, body, ...);
+                attachments are stored as absolute paths and read when the message is sent
+            message_id: Message-ID to send with (default: a new unique one)
+
+        Returns:
+            str: The message's Message-ID; queuing the same Message-ID twice keeps the first
+        """
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown message fields: {', '.join(sorted(unknown))}")
+        message_id = message_id or make_msgid(domain=sender.rpartition('@')[2] or None)
+        if fields.get('attachments'):
+            fields = dict(fields, attachments=[os.path.abspath(path) for path in fields['attachments']])
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO outbox (message_id, creds_path, sender, fields, status, next_attempt, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (message_id, os.path.abspath(creds_path), sender, json.dumps(fields), PENDING, now, now, now))
+        self.wakeup.set()
+        return message_id
+
+    def claim(self) -> Optional[tuple]:
+        """
+        Take the oldest message that is due, marking it as being sent.
+
+        Messages left in 'sending' by a process that died are reclaimed after LEASE_SECONDS.
+
+        Returns:
+            Optional[tuple]: (message_id, creds_path, sender, fields dict, attempts), or None if nothing is due
+        """
+        now = time.time()
+        with self._lock:
+            while True:
+                row = self._conn.execute('SELECT seq, message_id, creds_path, sender, fields, attempts, status FROM outbox WHERE (status = ? AND next_attempt <= ?) OR (status = ? AND updated <= ?) ORDER BY seq LIMIT 1', (PENDING, now, SENDING, now - LEASE_SECONDS)).fetchone()
+                if row is None:
+                    return None
+                seq, message_id, creds_path, sender, fields, attempts, status = row
+                # Claiming is a compare-and-set, so several processes can drain one spool.
+                claimed = self._conn.execute('UPDATE outbox SET status = ?, updated = ? WHERE seq = ? AND status = ?', (SENDING, now, seq, status)).rowcount
+                if claimed:
+                    # A reclaimed message may have been sent by the process that died.
+                    return (message_id, creds_path, sender, json.loads(fields), attempts + (status == SENDING))
+
+    def _finish(self, message_id: str, status: str, attempts: int, result: str, next_attempt: float=None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE outbox SET status = ?, attempts = ?, result = ?, next_attempt = ?, updated = ? WHERE message_id = ?', (status, attempts, result, next_attempt or now, now, message_id))
+
+    def mark_sent(self, message_id: str, attempts: int, gmail_id: str) -> None:
+        self._finish(message_id, SENT, attempts, gmail_id)
+
+    def mark_failed(self, message_id: str, attempts: int, error: str) -> None:
+        self._finish(message_id, FAILED, attempts, error)
+
+    def retry_later(self, message_id: str, attempts: int, error: str) -> None:
+        """Put a message back in the queue with exponential backoff, or fail it after MAX_ATTEMPTS."""
+        if attempts >= MAX_ATTEMPTS:
+            return self.mark_failed(message_id, attempts, error)
+        self._finish(message_id, PENDING, attempts, error, time.time() + min(BASE_DELAY * 2 ** (attempts - 1), MAX_DELAY))
+
+    def get(self, message_id: str) -> Optional[OutboxEntry]:
+        """Return the spool entry for a Message-ID, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT message_id, sender, status, attempts, result, created FROM outbox WHERE message_id = ?', (message_id,)).fetchone()
+        return OutboxEntry(*row) if row else None
+
+    def entries(self, status: str=None) -> list:
+        """Return spool entries, oldest first, optionally only those with a given status."""
+        sql = 'SELECT message_id, sender, status, attempts, result, created FROM outbox'
+        args = ()
+        if status:
+            sql += ' WHERE status = ?'
+            args = (status,)
+        with self._lock:
+            return [OutboxEntry(*row) for row in self._conn.execute(sql + ' ORDER BY seq', args)]
+
+    def unsent(self) -> int:
+        """Return the number of messages not yet sent or failed."""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)', (PENDING, SENDING)).fetchone()[0]
+
+    def next_due(self) -> Optional[float]:
+        """Return the time the next pending message is due, or None if none are pending."""
+        with self._lock:
+            return self._conn.execute('SELECT MIN(next_attempt) FROM outbox WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def purge(self, older_than: float=7 * 86400) -> int:
+        """Delete sent and failed entries older than older_than seconds; returns the number removed."""
+        with self._lock:
+            return self._conn.execute('DELETE FROM outbox WHERE status IN (?, ?) AND updated < ?', (SENT, FAILED, time.time() - older_than)).rowcount
+
+def _transient(error: Exception) -> bool:
+    """True for the errors ratelimit.is_transient retries, plus token refresh failures; anything else fails the message."""
+    from google.auth.exceptions import RefreshError
+    return ratelimit.is_transient(error) or isinstance(error, RefreshError)
+
+@metrics.operation('outbox_send')
+def deliver(outbox: Outbox, claimed: tuple) -> str:
+    """
+    Send one claimed message and record the outcome.
+
+    Args:
+        outbox: Spool the message was claimed from
+        claimed: Tuple returned by Outbox.claim
+
+    Returns:
+        str: The status the message ended in
+    """
+    message_id, creds_path, sender, fields, attempts = claimed
+    service = get_gmail_service(creds_path, sender)
+    if isinstance(service, str):
+        outbox.retry_later(message_id, attempts + 1, service)
+        return PENDING
+    try:
+        # The cached service's transport is shared with foreground calls, and httplib2 is not thread safe.
+        http = bulk.worker_http(service)
+        if attempts:
+            # An earlier attempt may have reached Gmail before failing or dying.
+            existing = gmail_client.find_by_message_id(service, message_id, http=http)
+            if existing:
+                outbox.mark_sent(message_id, attempts, existing)
+                return SENT
+        # The delegated sender is the From address, so no getProfile call is needed.
+        kwargs = {'cc': '', 'bcc': '', 'from_addr': sender}
+        kwargs.update(fields)
+        result = gmail_client.send_message(service, message_id=message_id, http=http, **kwargs)
+    except Exception as e:
+        if _transient(e):
+            outbox.retry_later(message_id, attempts + 1, f'{type(e).__name__}: {e}')
+            return PENDING
+        outbox.mark_failed(message_id, attempts + 1, f'{type(e).__name__}: {e}')
+        return FAILED
+    outbox.mark_sent(message_id, attempts + 1, result.get('id'))
+    return SENT
+
+class OutboxWorker:
+    """Background thread that drains an Outbox."""
+
+    def __init__(self, outbox: Outbox=None, poll_interval: float=30.0):
+        """
+        Args:
+            outbox: Spool to drain (default get_default_outbox())
+            poll_interval: Longest sleep between checks; enqueue() in this process wakes the worker at once
+        """
+        self.outbox = outbox or get_default_outbox()
+        self.poll_interval = poll_interval
+        self._stopping = False
+        self._thread = None
+
+    def drain(self, timeout: float=None) -> int:
+        """
+        Send every message that is due now, in the calling thread.
+
+        Args:
+            timeout: Stop claiming new messages after this many seconds
+
+        Returns:
+            int: Number of messages attempted
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        attempted = 0
+        while not self._stopping and (deadline is None or time.monotonic() < deadline):
+            claimed = self.outbox.claim()
+            if claimed is None:
+                break
+            deliver(self.outbox, claimed)
+            attempted += 1
+        return attempted
+
+    def run(self) -> None:
+        """Drain the spool until stop() is called. Blocks the calling thread."""
+        while not self._stopping:
+            self.outbox.wakeup.clear()
+            self.drain()
+            next_due = self.outbox.next_due()
+            wait = self.poll_interval if next_due is None else min(max(next_due - time.time(), 0.0), self.poll_interval)
+            self.outbox.wakeup.wait(wait)
+
+    def start(self) -> None:
+        """Run the worker on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name='bmail-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=None) -> None:
+        """Stop the worker thread after the message being sent, if any."""
+        self._stopping = True
+        self.outbox.wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+_DEFAULT_OUTBOX = None
+_DEFAULT_WORKER = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_default_outbox() -> Outbox:
+    """Return the process-wide spool at BMAIL_CACHE_DIR/outbox.sqlite3."""
+    global _DEFAULT_OUTBOX
+    with _DEFAULT_LOCK:
+        if _DEFAULT_OUTBOX is None:
+            _DEFAULT_OUTBOX = Outbox()
+        return _DEFAULT_OUTBOX
+
+def ensure_worker() -> OutboxWorker:
+    """
+    Start the process-wide worker if it is not running.
+
+    At interpreter exit the worker is given BMAIL_OUTBOX_EXIT_TIMEOUT seconds
+    (default 10) to send what is due; anything left stays in the spool for
+    the next process or python -m bmail.outbox.
+    """
+    global _DEFAULT_WORKER
+    outbox = get_default_outbox()
+    with _DEFAULT_LOCK:
+        if _DEFAULT_WORKER is None:
+            _DEFAULT_WORKER = OutboxWorker(outbox)
+            atexit.register(_drain_at_exit, _DEFAULT_WORKER)
+        _DEFAULT_WORKER.start()
+        return _DEFAULT_WORKER
+
+def _drain_at_exit(worker: OutboxWorker) -> None:
+    worker.stop(0)
+    worker._stopping = False
+    worker.drain(float(os.environ.get('BMAIL_OUTBOX_EXIT_TIMEOUT', 10)))
+
+def reset_default_outbox() -> None:
+    """Stop the process-wide worker and close the spool so the next use re-reads the environment."""
+    global _DEFAULT_OUTBOX, _DEFAULT_WORKER
+    with _DEFAULT_LOCK:
+        if _DEFAULT_WORKER is not None:
+            _DEFAULT_WORKER.stop()
+            atexit.unregister(_drain_at_exit)
+        if _DEFAULT_OUTBOX is not None:
+            _DEFAULT_OUTBOX.close()
+        _DEFAULT_OUTBOX = None
+        _DEFAULT_WORKER = None
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Send the messages waiting in the bmail outbox.')
+    parser.add_argument('--watch', action='store_true', help='keep running and send messages as they fall due')
+    parser.add_argument('--purge-days', type=float, default=None, help='first delete sent/failed entries older than this many days')
+    args = parser.parse_args(argv)
+    outbox = get_default_outbox()
+    if args.purge_days is not None:
+        outbox.purge(args.purge_days * 86400)
+    worker = OutboxWorker(outbox)
+    try:
+        if args.watch:
+            worker.run()
+        else:
+            worker.drain()
+    except KeyboardInterrupt:
+        pass
+    for entry in outbox.entries():
+        if entry.status != SENT:
+            print(f'{entry.message_id}:{entry.status}:{entry.attempts}:{entry.result}')
+    print(f'{outbox.unsent()} unsent')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+from __future__ import annotations
+import time
+import random
+import threading
+from typing import TYPE_CHECKING, Callable, Optional
+from bmail import metrics
+if TYPE_CHECKING:
+    from googleapiclient.errors import HttpError
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota).
+QUOTA_UNITS = {'getProfile': 1, 'messages.send': 100, 'messages.get': 5, 'messages.list': 5, 'messages.modify': 5, 'messages.batchModify': 50, 'messages.trash': 5, 'messages.delete': 10, 'messages.attachments.get': 5, 'history.list': 2, 'threads.get': 10, 'threads.list': 10, 'threads.modify': 10, 'labels.list': 1, 'drafts.create': 10, 'drafts.send': 100}
+DEFAULT_UNITS = 5
+
+# Gmail's documented ceilings: 250 units per user per second and
+# 1,200,000 units per project per minute.
+USER_UNITS_PER_SECOND = 250
+PROJECT_UNITS_PER_SECOND = 20000
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Calls that may have taken effect when the connection drops; execute() only
+# retries them after an HTTP error status (the outbox re-checks by Message-ID).
+NOT_IDEMPOTENT = frozenset(('messages.send', 'messages.insert', 'messages.import', 'drafts.send'))
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until enough units have accrued.
+
+    A charge larger than the capacity (e.g. a 100-call batch) is taken in full
+    once the bucket is full, leaving it in debt; later callers wait until the
+    debt has been repaid at rate, so the long-run rate is never exceeded.
+    """
+
+    def __init__(self, rate: float, capacity: float=None):
+        """
+        Args:
+            rate: Units added per second
+            capacity: Maximum burst size in units (default: one second's worth)
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float) -> float:
+        """Take units from the bucket, sleeping until they are available. Returns seconds waited."""
+        needed = min(units, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= units
+                    return waited
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class AIMDLimiter:
+    """Concurrency limit adjusted by additive increase / multiplicative decrease.
+
+    Every success raises the limit by 1/limit (about +1 per limit's worth of
+    calls); every throttling response halves it. Callers block in acquire()
+    while the number of calls in flight is at the limit.
+    """
+
+    def __init__(self, initial: float=4, minimum: float=1, maximum: float=64):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= max(int(self.limit), 1):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool=False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+def identity(service) -> tuple:
+    """
+    Return the (project, user) a service's calls are charged to.
+
+    Both are None when the service has no google-auth credentials (e.g. test
+    doubles), in which case quota is not metered.
+    """
+    from google.auth.credentials import Credentials
+    credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+    if not isinstance(credentials, Credentials):
+        return (None, None)
+    user = getattr(credentials, '_subject', None) or getattr(credentials, 'service_account_email', None) or id(credentials)
+    project = getattr(credentials, 'project_id', None) or 'default'
+    return (project, user)
+
+def method_name(request) -> str:
+    """Return the short Gmail method name ('messages.get') of an HttpRequest."""
+    method_id = getattr(request, 'methodId', None)
+    if isinstance(method_id, str):
+        return method_id.replace('gmail.users.', '', 1)
+    return ''
+
+def is_retryable(error: HttpError) -> bool:
+    """True if a Gmail error is a throttling or transient server error worth retrying."""
+    status = error.resp.status
+    if status in RETRY_STATUSES:
+        return True
+    return status == 403 and any((reason in str(error.content) for reason in RATE_LIMIT_REASONS))
+
+def is_transient(error: Exception) -> bool:
+    """
+    True if a failed call is worth retrying: a retryable HttpError, or a
+    network error (socket errors, timeouts, refused or reset connections,
+    httplib2 and google-auth transport errors). A missing or unreadable local
+    file is not transient.
+    """
+    import httplib2
+    from google.auth.exceptions import TransportError
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        return is_retryable(error)
+    if isinstance(error, (FileNotFoundError, IsADirectoryError, NotADirectoryError, PermissionError)):
+        return False
+    return isinstance(error, (OSError, httplib2.HttpLib2Error, TransportError))
+
+class Scheduler:
+    """Shared gatekeeper in front of every Gmail API call.
+
+    Each call first takes its quota cost from a per-user and a per-project token
+    bucket, then waits for a slot under the user's AIMD concurrency limit.
+    Throttling (429, 403 rate limit) and 5xx responses are retried with
+    exponential backoff and full jitter, honouring Retry-After, and halve that
+    user's concurrency limit only. Network errors (see is_transient) are
+    retried the same way without touching the limit, except for sends, which
+    may already have reached Gmail. Services without google-auth credentials
+    (test doubles) share one limit.
+    """
+
+    def __init__(self, user_units_per_second: Optional[float]=USER_UNITS_PER_SECOND, project_units_per_second: Optional[float]=PROJECT_UNITS_PER_SECOND, max_retries: int=5, base_delay: float=0.5, max_delay: float=32.0, initial_concurrency: float=4, max_concurrency: float=64):
+        """
+        Args:
+            user_units_per_second: Quota units per second per user, or None for unmetered
+            project_units_per_second: Quota units per second per project, or None for unmetered
+            max_retries: Retries after the first attempt for retryable errors
+            base_delay: Backoff delay before the first retry, in seconds
+            max_delay: Upper bound on any single backoff delay
+            initial_concurrency: Starting AIMD concurrency limit of each user
+            max_concurrency: Ceiling for each user's AIMD concurrency limit
+        """
+        self.user_units_per_second = user_units_per_second
+        self.project_units_per_second = project_units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self._buckets = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, service) -> AIMDLimiter:
+        """Return the concurrency limiter of the user a service's calls are made as."""
+        user = identity(service)[1]
+        with self._lock:
+            limiter = self._limiters.get(user)
+            if limiter is None:
+                limiter = self._limiters[user] = AIMDLimiter(self.initial_concurrency, maximum=self.max_concurrency)
+            return limiter
+
+    def _bucket(self, key: tuple, rate: Optional[float]) -> Optional[TokenBucket]:
+        if rate is None or key[1] is None:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate)
+            return bucket
+
+    def throttle(self, service, units: float) -> None:
+        """Block until both the user's and the project's buckets can pay for units."""
+        project, user = identity(service)
+        for bucket in (self._bucket(('user', user), self.user_units_per_second), self._bucket(('project', project), self.project_units_per_second)):
+            if bucket is not None:
+                bucket.acquire(units)
+
+    def backoff(self, attempt: int, error: HttpError=None) -> float:
+        """Return the delay before retry number attempt (0-based)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = error.resp.get('retry-after') if error is not None else None
+        if retry_after and str(retry_after).isdigit():
+            delay = max(delay, min(self.max_delay, float(retry_after)))
+        return delay
+
+    def execute(self, service, request, http=None):
+        """
+        Execute one googleapiclient HttpRequest under quota, concurrency and retry control.
+
+        Args:
+            service: Service the request was built from (identifies user and project)
+            request: HttpRequest to execute
+            http: Optional transport to execute on
+
+        Returns:
+            The decoded response
+
+        Raises:
+            HttpError: If the call fails with a non-retryable error or retries run out
+        """
+        from googleapiclient.errors import HttpError
+        method = method_name(request)
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        size = metrics.measure_response(request)
+        limiter = self.limiter(service)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            self.throttle(service, units)
+            limiter.acquire()
+            throttled = False
+            try:
+                response = request.execute(http=http)
+            except Exception as e:
+                throttled = isinstance(e, HttpError) and is_retryable(e)
+                retry = throttled or (is_transient(e) and method not in NOT_IDEMPOTENT)
+                if not retry or attempt >= self.max_retries:
+                    status = e.resp.status if isinstance(e, HttpError) else None
+                    metrics.emit(metrics.CallRecord(method, metrics.current_operation(), time.perf_counter() - start, len(getattr(e, 'content', b'') or b''), attempt, type(e).__name__, status, units))
+                    raise
+                delay = self.backoff(attempt, e if isinstance(e, HttpError) else None)
+            else:
+                metrics.emit(metrics.CallRecord(method, metrics.current_operation(), time.perf_counter() - start, size[0], attempt, None, None, units))
+                return response
+            finally:
+                limiter.release(throttled)
+            time.sleep(delay)
+            attempt += 1
+
+    def execute_batch(self, service, batch, units: float, http=None, throttled: Optional[Callable[[], bool]]=None) -> None:
+        """
+        Execute a BatchHttpRequest whose calls cost units in total.
+
+        A throttling or transient error on the batch request itself is retried
+        with backoff, as in execute(). The calls inside report their own errors
+        through the batch callback, so the caller passes throttled to say
+        whether any of them was throttled; the user's concurrency limit then
+        backs off for batched traffic too.
+
+        Args:
+            service: Service the batch was built from (identifies user and project)
+            batch: BatchHttpRequest to execute
+            units: Quota cost of all calls in the batch
+            http: Optional transport to execute on
+            throttled: Called after the batch has run; True if any call in it was throttled
+
+        Raises:
+            HttpError: If the batch request fails with a non-retryable error or retries run out
+        """
+        from googleapiclient.errors import HttpError
+        limiter = self.limiter(service)
+        attempt = 0
+        while True:
+            self.throttle(service, units)
+            limiter.acquire()
+            backed_off = False
+            try:
+                batch.execute(http=http)
+            except HttpError as e:
+                backed_off = is_retryable(e)
+                if not backed_off or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+            else:
+                backed_off = throttled is not None and throttled()
+                return
+            finally:
+                limiter.release(backed_off)
+            time.sleep(delay)
+            attempt += 1
+
+_SCHEDULER = Scheduler()
+
+def get_scheduler() -> Scheduler:
+    """Return the process-wide scheduler used by gmail_client."""
+    return _SCHEDULER
+
+def set_scheduler(scheduler: Scheduler) -> None:
+    """Replace the process-wide scheduler, e.g. to match a raised quota."""
+    global _SCHEDULER
+    _SCHEDULER = scheduler
+
+def execute(service, request, http=None):
+    """Execute a Gmail request through the process-wide scheduler."""
+    return _SCHEDULER.execute(service, request, http=http)
@@ -0,0 +1,408 @@
+"""
+Local full-text index of inbox messages.
+
+A SearchIndex mirrors the inbox of each mailbox it is asked about into an
+SQLite FTS5 table (sender, recipients, subject and the first MAX_BODY_CHARS
+of body text) and answers check_inbox searches from it:
+
+    index = SearchIndex()
+    summaries, next_offset = index.search(service, 'from:alice subject:"q3 plan" after:2024/01/01 budget')
+
+The first search of a mailbox starts downloading its whole inbox on a
+background thread (in batches, storing the messages in the message cache as
+well) and returns None, so the caller asks Gmail until the index is ready.
+After that the index is kept current with the history API: a refresh is a
+single history.list call plus a batched get for each message that arrived,
+and runs at most once every max_age seconds, so a burst of searches costs no
+API calls at all. A message whose download fails is recorded as missing and
+fetched again by the next refresh; until then searches of that mailbox
+return None rather than silently leave it out.
+
+Only the common query forms are answered locally: from:, to:, subject:,
+after:/before: (YYYY/MM/DD, YYYY-MM-DD or epoch seconds, dates in local
+time), in:/label:/is: with system labels, and free words or "quoted phrases".
+Anything else (OR, negation, user labels, has:, newer_than:, ...) makes
+search() return None so the caller can ask Gmail instead. Matching is by
+whole words, which is also how Gmail matches.
+
+email_handler.list_emails (and so check_inbox) uses the index when
+BMAIL_SEARCH_INDEX=1 is set.
+"""
+from __future__ import annotations
+import os
+import re
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterable, Optional
+from bmail import bulk, discovery, gmail_client, ratelimit
+from bmail.message import MessageSummary, parse_message
+from bmail.message_cache import MessageCache, cache_dir, resolve_cache
+from bmail.sync import MailboxSync
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+# Body characters indexed per message; enough for any search an agent makes.
+MAX_BODY_CHARS = 20000
+
+# Seconds a refreshed index is trusted before the next search refreshes it again.
+DEFAULT_MAX_AGE = 5.0
+
+# Gmail label IDs that in:/label:/is: may name; user labels are only known by ID locally.
+SYSTEM_LABELS = {'inbox', 'unread', 'starred', 'important', 'sent', 'draft', 'spam', 'trash', 'chat', 'category_personal', 'category_social', 'category_promotions', 'category_updates', 'category_forums'}
+
+_TERM = re.compile('(-?)(?:(\\w+):)?("[^"]*"|\\S+)')
+_COLUMNS = {'from': 'sender', 'to': 'recipients', 'subject': 'subject'}
+_DATE_FORMATS = ('%Y/%m/%d', '%Y-%m-%d')
+
+def fts5_available() -> bool:
+    """Return True if the sqlite3 module was built with FTS5."""
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(a)')
+        return True
+    except sqlite3.Error:
+        return False
+
+def _phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+def _timestamp_ms(value: str) -> Optional[int]:
+    if value.isdigit():
+        return int(value) * 1000
+    for fmt in _DATE_FORMATS:
+        try:
+            return int(datetime.strptime(value, fmt).timestamp() * 1000)
+        except ValueError:
+            pass
+    return None
+
+def parse_query(query: Optional[str], me: Optional[str]=None) -> Optional[tuple]:
+    """
+    Translate a Gmail search query into an FTS5 match expression and SQL filters.
+
+    Args:
+        query: Gmail search query, or None for everything
+        me: Address of the searched mailbox, which from:me and to:me stand for;
+            without it such queries cannot be answered
+
+    Returns:
+        Optional[tuple]: (match expression or None, list of SQL conditions, list of parameters),
+        or None if the query uses syntax the index cannot answer
+    """
+    matches = []
+    conditions = []
+    params = []
+    for negate, key, value in _TERM.findall(query or ''):
+        key = key.lower()
+        value = value[1:-1] if len(value) > 1 and value.startswith('"') and value.endswith('"') else value
+        if negate or not value.strip() or '"' in value or '*' in value:
+            return None
+        if not key and value in ('OR', 'AND', 'AROUND') or value[0] in '({' or value[-1] in ')}':
+            return None
+        if not key:
+            matches.append(_phrase(value))
+        elif key in _COLUMNS:
+            if key != 'subject' and value.lower() == 'me':
+                if not me:
+                    return None
+                value = me
+            matches.append(f'{_COLUMNS[key]} : {_phrase(value)}')
+        elif key in ('after', 'before'):
+            stamp = _timestamp_ms(value)
+            if stamp is None:
+                return None
+            conditions.append('internal_date >= ?' if key == 'after' else 'internal_date < ?')
+            params.append(stamp)
+        elif key in ('in', 'label', 'is') and value.lower() in SYSTEM_LABELS:
+            conditions.append('labels LIKE ?')
+            params.append(f'% {value.upper()} %')
+        else:
+            return None
+    return (' AND '.join(matches) or None, conditions, params)
+
+class SearchIndex:
+    """SQLite FTS5 mirror of mailbox inboxes, kept current with the history API."""
+
+    def __init__(self, path: str=None, max_age: float=DEFAULT_MAX_AGE, cache: MessageCache=None):
+        """
+        Args:
+            path: SQLite file for the index and its history state (default BMAIL_CACHE_DIR/search.sqlite3)
+            max_age: Seconds after a refresh during which searches skip refreshing
+            cache: Message cache fetched messages are stored in; None for the default cache, False for none
+
+        Raises:
+            sqlite3.Error: If the database cannot be opened or SQLite lacks FTS5
+        """
+        self.path = path or os.path.join(cache_dir(), 'search.sqlite3')
+        self.max_age = max_age
+        self.cache = cache
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS messages (rowid INTEGER PRIMARY KEY, mailbox TEXT NOT NULL, id TEXT NOT NULL, internal_date INTEGER NOT NULL, date TEXT NOT NULL, subject TEXT NOT NULL, labels TEXT NOT NULL, UNIQUE (mailbox, id))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_date ON messages (mailbox, internal_date)')
+        self._conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(sender, recipients, subject, body)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS mailboxes (mailbox TEXT PRIMARY KEY, refreshed REAL NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS missing (mailbox TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (mailbox, id))')
+        self.sync = MailboxSync(self.path, cache=False)
+        self._builds = {}
+
+    def close(self) -> None:
+        """Close the index database."""
+        with self._lock:
+            self.sync.close()
+            self._conn.close()
+
+    def add(self, mailbox: str, resource: dict) -> None:
+        """
+        Index a message resource fetched with format='full' (or replace it if already indexed).
+
+        Args:
+            mailbox: Mailbox the message belongs to
+            resource: Gmail message resource
+        """
+        message = parse_message(resource)
+        date = message.header('date') or datetime.fromtimestamp(int(message.internal_date or 0) / 1000).strftime('%Y-%m-%d %H:%M')
+        recipients = ', '.join(filter(None, (message.to, message.header('cc'))))
+        labels = ' ' + ' '.join(message.label_ids) + ' '
+        body = message.text(MAX_BODY_CHARS)
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._delete(mailbox.lower(), [message.id])
+                cursor = self._conn.execute('INSERT INTO messages (mailbox, id, internal_date, date, subject, labels) VALUES (?, ?, ?, ?, ?, ?)', (mailbox.lower(), message.id, int(message.internal_date or 0), date, message.subject or 'No Subject', labels))
+                self._conn.execute('INSERT INTO message_text (rowid, sender, recipients, subject, body) VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, message.sender or '', recipients, message.subject or '', body))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def remove(self, mailbox: str, message_ids: Iterable[str]) -> None:
+        """Drop messages from a mailbox's index (e.g. after archiving them)."""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._delete(mailbox.lower(), list(message_ids))
+            self._conn.execute('COMMIT')
+
+    def _delete(self, mailbox: str, message_ids: list) -> None:
+        for message_id in message_ids:
+            row = self._conn.execute('SELECT rowid FROM messages WHERE mailbox = ? AND id = ?', (mailbox, message_id)).fetchone()
+            if row:
+                self._conn.execute('DELETE FROM message_text WHERE rowid = ?', row)
+                self._conn.execute('DELETE FROM messages WHERE rowid = ?', row)
+
+    def indexed_ids(self, mailbox: str) -> set:
+        """Return the IDs of the messages indexed for a mailbox."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT id FROM messages WHERE mailbox = ?', (mailbox.lower(),))}
+
+    def missing_ids(self, mailbox: str) -> set:
+        """Return the IDs of inbox messages whose download failed and is still to be retried."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT id FROM missing WHERE mailbox = ?', (mailbox.lower(),))}
+
+    def _fetch(self, service: Resource, mailbox: str, message_ids: list) -> None:
+        """Download and index messages; failed downloads are recorded as missing, deleted ones forgotten."""
+        requests = [(message_id, service.users().messages().get(userId='me', id=message_id, format='full')) for message_id in message_ids]
+        cache = resolve_cache(self.cache)
+        failed = []
+        for message_id, (resource, error) in gmail_client._execute_batch(service, requests).items():
+            if error is not None:
+                if getattr(getattr(error, 'resp', None), 'status', None) != 404:
+                    failed.append(message_id)
+            elif 'INBOX' in resource.get('labelIds', []):
+                self.add(mailbox, resource)
+                if cache:
+                    cache.put(mailbox, resource)
+        with self._lock:
+            self._conn.executemany('DELETE FROM missing WHERE mailbox = ? AND id = ?', [(mailbox, message_id) for message_id in message_ids if message_id not in failed])
+            self._conn.executemany('INSERT OR IGNORE INTO missing (mailbox, id) VALUES (?, ?)', [(mailbox, message_id) for message_id in failed])
+
+    def rebuild(self, service: Resource, mailbox: str=None) -> None:
+        """
+        Re-index a mailbox's whole inbox.
+
+        The history baseline is taken first, so mail arriving during the
+        download is picked up by the next refresh.
+
+        Args:
+            service: Authenticated Gmail API service object
+            mailbox: Mailbox key (defaults to the service's mailbox address)
+        """
+        mailbox = (mailbox or gmail_client.get_sender_address(service)).lower()
+        self.sync.reset(mailbox)
+        self.sync.sync(service, mailbox)
+        with self._lock:
+            self._conn.execute('DELETE FROM mailboxes WHERE mailbox = ?', (mailbox,))
+            self._conn.execute('DELETE FROM missing WHERE mailbox = ?', (mailbox,))
+            self._conn.execute('BEGIN')
+            self._delete(mailbox, list(self.indexed_ids(mailbox)))
+            self._conn.execute('COMMIT')
+        page_token = None
+        while True:
+            params = {'userId': 'me', 'labelIds': ['INBOX'], 'maxResults': 500}
+            if page_token:
+                params['pageToken'] = page_token
+            page = ratelimit.execute(service, service.users().messages().list(**params))
+            self._fetch(service, mailbox, [m['id'] for m in page.get('messages', [])])
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO mailboxes (mailbox, refreshed) VALUES (?, ?)', (mailbox, time.time()))
+
+    def _build_in_background(self, service: Resource, mailbox: str) -> None:
+        """Start rebuilding a mailbox on a daemon thread unless a build is already running."""
+
+        def build():
+            # httplib2 transports are not thread safe, so the build gets its own.
+            http = bulk.worker_http(service)
+            local = service
+            if http is not None:
+                local = discovery.build_gmail(http=http)
+                gmail_client.remember_sender_address(local, mailbox)
+            try:
+                self.rebuild(local, mailbox)
+            except Exception:
+                # The mailbox stays unbuilt; the next search starts another build.
+                pass
+        with self._lock:
+            thread = self._builds.get(mailbox)
+            if thread is not None and thread.is_alive():
+                return
+            thread = self._builds[mailbox] = threading.Thread(target=build, name=f'bmail-index-{mailbox}', daemon=True)
+        thread.start()
+
+    def wait(self, timeout: Optional[float]=None) -> bool:
+        """Wait for background builds to finish. Returns False if one is still running at the timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            threads = list(self._builds.values())
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any((thread.is_alive() for thread in threads))
+
+    def refresh(self, service: Resource, mailbox: str=None, force: bool=False, background: bool=False) -> bool:
+        """
+        Bring a mailbox's index up to date, building it on first use.
+
+        Args:
+            service: Authenticated Gmail API service object
+            mailbox: Mailbox key (defaults to the service's mailbox address)
+            force: Refresh even if the last refresh is less than max_age seconds old
+            background: Run a needed full build on a background thread instead of waiting for it
+
+        Returns:
+            bool: True if the index is current, False if a background build was started (or is running)
+
+        Raises:
+            Exception: If a Gmail API call fails
+        """
+        mailbox = (mailbox or gmail_client.get_sender_address(service)).lower()
+        with self._lock:
+            row = self._conn.execute('SELECT refreshed FROM mailboxes WHERE mailbox = ?', (mailbox,)).fetchone()
+        if row is None:
+            if background:
+                self._build_in_background(service, mailbox)
+                return False
+            self.rebuild(service, mailbox)
+            return True
+        if not force and time.time() - row[0] < self.max_age:
+            return True
+        result = self.sync.sync(service, mailbox)
+        if result.full:
+            with self._lock:
+                self._conn.execute('DELETE FROM mailboxes WHERE mailbox = ?', (mailbox,))
+            return self.refresh(service, mailbox, background=background)
+        if result.deleted:
+            self.remove(mailbox, result.deleted)
+        indexed = self.indexed_ids(mailbox)
+        fetch = [message_id for message_id in result.added if message_id not in indexed]
+        fetch.extend((message_id for message_id in self.missing_ids(mailbox) if message_id not in fetch))
+        changed = [message_id for message_id in result.relabeled if message_id not in result.added]
+        if changed:
+            requests = [(message_id, service.users().messages().get(userId='me', id=message_id, format='minimal')) for message_id in changed]
+            gone = []
+            for message_id, (resource, error) in gmail_client._execute_batch(service, requests).items():
+                if error is not None or 'INBOX' not in resource.get('labelIds', []):
+                    gone.append(message_id)
+                elif message_id in indexed:
+                    with self._lock:
+                        self._conn.execute('UPDATE messages SET labels = ? WHERE mailbox = ? AND id = ?', (' ' + ' '.join(resource['labelIds']) + ' ', mailbox, message_id))
+                else:
+                    fetch.append(message_id)
+            self.remove(mailbox, gone)
+        self._fetch(service, mailbox, fetch)
+        with self._lock:
+            self._conn.execute('UPDATE mailboxes SET refreshed = ? WHERE mailbox = ?', (time.time(), mailbox))
+        return True
+
+    def search(self, service: Resource, query: Optional[str]=None, max_results: int=20, offset: int=0, mailbox: str=None) -> Optional[tuple]:
+        """
+        Answer an inbox search locally.
+
+        Args:
+            service: Authenticated Gmail API service object (used only to refresh)
+            query: Gmail search query (implicitly restricted to the inbox)
+            max_results: Maximum number of summaries to return
+            offset: Number of matches to skip (for paging)
+            mailbox: Mailbox key (defaults to the service's mailbox address)
+
+        Returns:
+            Optional[tuple]: (MessageSummary list newest first, offset of the next page or None),
+            or None if the query cannot be answered locally, the mailbox's index is still
+            being built, or some of its messages failed to download
+
+        Raises:
+            Exception: If refreshing the index fails
+        """
+        mailbox = (mailbox or gmail_client.get_sender_address(service)).lower()
+        parsed = parse_query(query, mailbox)
+        if parsed is None:
+            return None
+        match, conditions, params = parsed
+        if not self.refresh(service, mailbox, background=True) or self.missing_ids(mailbox):
+            return None
+        sql = 'SELECT m.id, m.date, m.subject FROM messages m'
+        where = ['m.mailbox = ?', "m.labels LIKE '% INBOX %'"] + [f'm.{condition}' for condition in conditions]
+        args = [mailbox] + params
+        if match:
+            sql += ' JOIN message_text ON message_text.rowid = m.rowid'
+            where.append('message_text MATCH ?')
+            args.append(match)
+        sql += ' WHERE ' + ' AND '.join(where) + ' ORDER BY m.internal_date DESC, m.rowid DESC LIMIT ? OFFSET ?'
+        args += [max_results + 1, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        summaries = [MessageSummary(*row) for row in rows[:max_results]]
+        return (summaries, offset + max_results if len(rows) > max_results else None)
+
+_DEFAULT_INDEX = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_default_index() -> Optional[SearchIndex]:
+    """Return the process-wide index, or None unless BMAIL_SEARCH_INDEX=1 and SQLite has FTS5.
+
+    The index lives at BMAIL_CACHE_DIR/search.sqlite3; BMAIL_SEARCH_MAX_AGE
+    overrides how many seconds a refresh is trusted (default 5).
+    """
+    global _DEFAULT_INDEX
+    with _DEFAULT_LOCK:
+        if _DEFAULT_INDEX is None:
+            if os.environ.get('BMAIL_SEARCH_INDEX', '') not in ('1', 'true', 'yes') or not fts5_available():
+                return None
+            try:
+                _DEFAULT_INDEX = SearchIndex(max_age=float(os.environ.get('BMAIL_SEARCH_MAX_AGE', DEFAULT_MAX_AGE)))
+            except (OSError, sqlite3.Error):
+                return None
+        return _DEFAULT_INDEX
+
+def reset_default_index() -> None:
+    """Close the process-wide index so the next use re-reads the environment."""
+    global _DEFAULT_INDEX
+    with _DEFAULT_LOCK:
+        if _DEFAULT_INDEX is not None:
+            _DEFAULT_INDEX.close()
+        _DEFAULT_INDEX = None
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, NamedTuple, Optional
+from bmail import gmail_client, ratelimit
+from bmail.message_cache import MessageCache, cache_dir, resolve_cache
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+class SyncResult(NamedTuple):
+    """Changes to a mailbox since the previous sync.
+
+    Attributes:
+        history_id: Mailbox historyId the next sync starts from
+        added: IDs of messages that arrived with the watched label, oldest first
+        deleted: IDs of messages that were deleted
+        relabeled: IDs of messages whose labels changed
+        full: True if there was no usable starting point (first sync or an
+            expired historyId); the caller should re-list instead of trusting
+            added/deleted/relabeled
+    """
+    history_id: str
+    added: list
+    deleted: list
+    relabeled: list
+    full: bool
+
+class MailboxSync:
+    """Incremental mailbox sync built on users.history.list.
+
+    The last seen historyId of each mailbox is stored in a small SQLite file, so
+    a sync costs one history.list call (per page of changes) no matter how large
+    the mailbox is. If the stored historyId has expired, Gmail answers 404 and the
+    sync falls back to re-establishing a baseline with getProfile.
+    """
+
+    def __init__(self, state_path: str=None, label_id: str='INBOX', cache: MessageCache=None):
+        """
+        Args:
+            state_path: SQLite file holding historyIds (default BMAIL_CACHE_DIR/sync.sqlite3)
+            label_id: Label whose new messages are reported as added
+            cache: Message cache to keep labels current in; None for the default cache
+        """
+        self.state_path = state_path or os.path.join(cache_dir(), 'sync.sqlite3')
+        self.label_id = label_id
+        self.cache = resolve_cache(cache)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.state_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS history (mailbox TEXT NOT NULL, label TEXT NOT NULL, history_id TEXT NOT NULL, PRIMARY KEY (mailbox, label))')
+
+    def get_history_id(self, mailbox: str) -> Optional[str]:
+        """Return the stored historyId for a mailbox, or None if it was never synced."""
+        with self._lock:
+            row = self._conn.execute('SELECT history_id FROM history WHERE mailbox = ? AND label = ?', (mailbox.lower(), self.label_id)).fetchone()
+        return row[0] if row else None
+
+    def set_history_id(self, mailbox: str, history_id: str) -> None:
+        """Store the historyId the next sync of a mailbox starts from."""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO history (mailbox, label, history_id) VALUES (?, ?, ?)', (mailbox.lower(), self.label_id, str(history_id)))
+
+    def reset(self, mailbox: str) -> None:
+        """Forget a mailbox so the next sync is a full resync."""
+        with self._lock:
+            self._conn.execute('DELETE FROM history WHERE mailbox = ? AND label = ?', (mailbox.lower(), self.label_id))
+
+    def close(self) -> None:
+        """Close the state database."""
+        with self._lock:
+            self._conn.close()
+
+    def sync(self, service: Resource, mailbox: str=None) -> SyncResult:
+        """
+        Fetch the changes to a mailbox since its last sync and advance the stored historyId.
+
+        Args:
+            service: Authenticated Gmail API service object
+            mailbox: Key the state is stored under (defaults to the service's mailbox address)
+
+        Returns:
+            SyncResult: The changes; full=True when a new baseline had to be taken
+
+        Raises:
+            Exception: If a Gmail API call fails for any reason other than an expired historyId
+        """
+        from googleapiclient.errors import HttpError
+        mailbox = mailbox or gmail_client.get_sender_address(service)
+        start = self.get_history_id(mailbox)
+        if start is None:
+            return self._resync(service, mailbox)
+        try:
+            result = self._history_since(service, mailbox, start)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            return self._resync(service, mailbox)
+        self.set_history_id(mailbox, result.history_id)
+        return result
+
+    def _resync(self, service: Resource, mailbox: str) -> SyncResult:
+        profile = ratelimit.execute(service, service.users().getProfile(userId='me'))
+        self.set_history_id(mailbox, profile['historyId'])
+        return SyncResult(str(profile['historyId']), [], [], [], True)
+
+    def _history_since(self, service: Resource, mailbox: str, start: str) -> SyncResult:
+        added = {}
+        deleted = {}
+        relabeled = {}
+        history_id = start
+        page_token = None
+        while True:
+            params = {'userId': 'me', 'startHistoryId': start, 'historyTypes': HISTORY_TYPES}
+            if page_token:
+                params['pageToken'] = page_token
+            response = ratelimit.execute(service, service.users().history().list(**params))
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    message = item['message']
+                    if self.label_id in message.get('labelIds', []):
+                        added[message['id']] = None
+                for item in record.get('messagesDeleted', []):
+                    message_id = item['message']['id']
+                    added.pop(message_id, None)
+                    relabeled.pop(message_id, None)
+                    deleted[message_id] = None
+                    if self.cache:
+                        self.cache.evict(mailbox, message_id)
+                for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    message = item['message']
+                    if message['id'] not in deleted:
+                        relabeled[message['id']] = None
+                    if self.cache and 'labelIds' in message:
+                        self.cache.set_labels(mailbox, message['id'], message['labelIds'])
+            history_id = response.get('historyId', history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        return SyncResult(str(history_id), list(added), list(deleted), list(relabeled), False)
+
+_DEFAULT_SYNC = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_default_sync() -> MailboxSync:
+    """Return the process-wide MailboxSync stored in the bmail cache directory."""
+    global _DEFAULT_SYNC
+    with _DEFAULT_LOCK:
+        if _DEFAULT_SYNC is None:
+            _DEFAULT_SYNC = MailboxSync()
+        return _DEFAULT_SYNC
+
+def reset_default_sync() -> None:
+    """Close the process-wide MailboxSync so the next use re-reads the environment."""
+    global _DEFAULT_SYNC
+    with _DEFAULT_LOCK:
+        if _DEFAULT_SYNC is not None:
+            _DEFAULT_SYNC.close()
+        _DEFAULT_SYNC = None
@@ -0,0 +1,239 @@
+"""
+Long-running inbox watcher.
+
+An InboxWatcher polls one or more mailboxes with the history API (a single
+history.list call per poll, however large the mailbox) and hands every newly
+arrived message to a callback and/or a queue:
+
+    watcher = InboxWatcher(callback=lambda event: print(event.mailbox, event.message_id))
+    watcher.watch(service)
+    watcher.start()
+    ...
+    watcher.stop()
+
+Each mailbox has its own polling interval. It drops to min_interval as soon
+as a poll finds new mail and grows by a factor of backoff after every empty
+or failed poll, up to max_interval. Busy mailboxes are therefore checked
+every few seconds while idle ones cost one call a minute.
+
+The last seen historyId is stored in BMAIL_CACHE_DIR/watcher.sqlite3, so a
+restarted watcher reports the mail that arrived while it was down. When the
+stored historyId has expired (about a week) a new baseline is taken and the
+gap is not replayed.
+"""
+import os
+import time
+import argparse
+import threading
+from typing import Any, Callable, NamedTuple, Optional
+from bmail import gmail_client, metrics
+from bmail.message import Message
+from bmail.message_cache import cache_dir
+from bmail.sync import MailboxSync
+
+DEFAULT_MIN_INTERVAL = 2.0
+DEFAULT_MAX_INTERVAL = 60.0
+DEFAULT_BACKOFF = 2.0
+
+class NewMessage(NamedTuple):
+    """A message that arrived in a watched mailbox.
+
+    Attributes:
+        mailbox: Address of the mailbox it arrived in
+        message_id: Gmail message ID
+        message: The decoded message when the watcher was created with fetch=True, else None
+    """
+    mailbox: str
+    message_id: str
+    message: Optional[Message] = None
+
+class _Watched:
+    __slots__ = ('service', 'mailbox', 'interval', 'due')
+
+    def __init__(self, service, mailbox: str, interval: float):
+        self.service = service
+        self.mailbox = mailbox
+        self.interval = interval
+        self.due = 0.0
+
+class InboxWatcher:
+    """Poll mailboxes for new messages with an interval that adapts to traffic.
+
+    A service object is only used from the thread that polls it (the watcher
+    thread once start() is called), so do not share it with other threads.
+    """
+
+    def __init__(self, callback: Callable[[NewMessage], Any]=None, queue=None, min_interval: float=DEFAULT_MIN_INTERVAL, max_interval: float=DEFAULT_MAX_INTERVAL, backoff: float=DEFAULT_BACKOFF, fetch: bool=False, sync: MailboxSync=None, on_error: Callable[[str, Exception], Any]=None):
+        """
+        Args:
+            callback: Called with a NewMessage for each new message
+            queue: Object with a put() method (e.g. queue.Queue) that receives each NewMessage
+            min_interval: Seconds between polls while mail is arriving
+            max_interval: Longest wait between polls of an idle mailbox
+            backoff: Factor the interval grows by after an empty or failed poll
+            fetch: If True, fetch each new message (format='full', through the sync's message cache) before delivering it
+            sync: History state to use (default BMAIL_CACHE_DIR/watcher.sqlite3, separate from check_inbox(new_only=True))
+            on_error: Called with (mailbox, exception) when a poll or a callback fails; errors are otherwise ignored
+        """
+        self.callback = callback
+        self.queue = queue
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.fetch = fetch
+        self.on_error = on_error
+        self._owns_sync = sync is None
+        self.sync = sync or MailboxSync(os.path.join(cache_dir(), 'watcher.sqlite3'))
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def watch(self, service, mailbox: str=None) -> None:
+        """
+        Start watching a mailbox; it is polled right away.
+
+        Args:
+            service: Authenticated Gmail API service object for the mailbox
+            mailbox: Key the history state is stored under (defaults to the service's mailbox address)
+        """
+        mailbox = (mailbox or gmail_client.get_sender_address(service)).lower()
+        with self._lock:
+            self._watched[mailbox] = _Watched(service, mailbox, self.min_interval)
+        self._wake.set()
+
+    def unwatch(self, mailbox: str) -> None:
+        """Stop watching a mailbox. Its history state is kept."""
+        with self._lock:
+            self._watched.pop(mailbox.lower(), None)
+
+    def interval(self, mailbox: str) -> Optional[float]:
+        """Return the current polling interval of a mailbox, or None if it is not watched."""
+        with self._lock:
+            watched = self._watched.get(mailbox.lower())
+        return watched.interval if watched else None
+
+    def poll(self, mailbox: str=None) -> list:
+        """
+        Poll now and deliver what arrived, without waiting for the schedule.
+
+        Args:
+            mailbox: Mailbox to poll (default every watched mailbox)
+
+        Returns:
+            list: The NewMessages delivered
+        """
+        with self._lock:
+            targets = [w for w in self._watched.values() if mailbox is None or w.mailbox == mailbox.lower()]
+        events = []
+        for watched in targets:
+            events.extend(self._poll(watched))
+        return events
+
+    @metrics.operation('watch')
+    def _poll(self, watched: _Watched) -> list:
+        events = []
+        try:
+            result = self.sync.sync(watched.service, watched.mailbox)
+            for message_id in [] if result.full else result.added:
+                message = None
+                if self.fetch:
+                    message = gmail_client.get_email(watched.service, message_id, cache=self.sync.cache or False)
+                    if not isinstance(message, Message):
+                        # Deleted between the history record and the fetch.
+                        continue
+                events.append(NewMessage(watched.mailbox, message_id, message))
+        except Exception as e:
+            self._error(watched.mailbox, e)
+        watched.interval = self.min_interval if events else min(watched.interval * self.backoff, self.max_interval)
+        watched.due = time.monotonic() + watched.interval
+        for event in events:
+            self._deliver(event)
+        return events
+
+    def _deliver(self, event: NewMessage) -> None:
+        try:
+            if self.callback is not None:
+                self.callback(event)
+            if self.queue is not None:
+                self.queue.put(event)
+        except Exception as e:
+            self._error(event.mailbox, e)
+
+    def _error(self, mailbox: str, error: Exception) -> None:
+        if self.on_error is not None:
+            try:
+                self.on_error(mailbox, error)
+            except Exception:
+                pass
+
+    def run(self) -> None:
+        """Poll mailboxes as they fall due until stop() is called. Blocks the calling thread."""
+        while not self._stopping:
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = [w for w in self._watched.values() if w.due <= now]
+            for watched in due:
+                if self._stopping:
+                    return
+                self._poll(watched)
+            with self._lock:
+                next_due = min((w.due for w in self._watched.values()), default=now + self.max_interval)
+            self._wake.wait(max(0.0, next_due - time.monotonic()))
+
+    def start(self) -> None:
+        """Run the watcher on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name='bmail-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=None) -> None:
+        """Stop the watcher thread, waiting for an in-flight poll to finish."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def close(self) -> None:
+        """Stop the watcher and close the history state it created."""
+        self.stop()
+        if self._owns_sync:
+            self.sync.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main(argv=None) -> None:
+    from bmail.auth import get_gmail_service
+    parser = argparse.ArgumentParser(description='Print new inbox messages as they arrive.')
+    parser.add_argument('mailboxes', nargs='*', help='delegated addresses to watch (default BMAIL_SENDER)')
+    parser.add_argument('--credentials', default=os.environ.get('BMAIL_CREDENTIALS_PATH'), help='service account key file')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL)
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL)
+    args = parser.parse_args(argv)
+
+    def show(event: NewMessage) -> None:
+        print(f'{event.mailbox}:{event.message_id}:{event.message.sender}:{event.message.subject}', flush=True)
+    watcher = InboxWatcher(show, min_interval=args.min_interval, max_interval=args.max_interval, fetch=True, on_error=lambda mailbox, e: print(f'{mailbox}: {e}', flush=True))
+    for mailbox in args.mailboxes or [os.environ['BMAIL_SENDER']]:
+        service = get_gmail_service(args.credentials, mailbox)
+        if isinstance(service, str):
+            parser.error(service)
+        watcher.watch(service, mailbox)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+if __name__ == '__main__':
+    main()
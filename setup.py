@@ -15,12 +15,16 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=[
         "google-api-python-client",
         "google-auth-httplib2",
         "google-auth-oauthlib",
         "google-auth",  # Added this as it's required by auth.py
     ],
+    extras_require={
+        "aio": ["aiohttp>=3.8"],  # bmail.aio asyncio API
+        "pdf": ["pypdf>=3.0"],  # text extracts of PDF attachments
+    },
     test_suite="tests",
 )
@@ -0,0 +1,213 @@
+import os
+import base64
+import asyncio
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from google.oauth2.credentials import Credentials
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bmail import message_cache, ratelimit
+from bmail.aio import gmail_client, llm_email_tools
+from bmail.aio.gmail_client import AsyncService
+
+class GmailStandIn:
+    """Minimal local HTTP stand-in for the Gmail endpoints bmail.aio uses."""
+
+    def __init__(self):
+        self.messages = {}
+        self.requests = []
+        self.failures = []
+        self.in_flight = 0
+        self.peak = 0
+        self.app = web.Application()
+        self.app.router.add_get('/gmail/v1/users/me/profile', self.profile)
+        self.app.router.add_get('/gmail/v1/users/me/messages', self.list)
+        self.app.router.add_post('/gmail/v1/users/me/messages/send', self.send)
+        self.app.router.add_post('/gmail/v1/users/me/messages/batchModify', self.batch_modify)
+        self.app.router.add_get('/gmail/v1/users/me/messages/{id}', self.get)
+        self.app.router.add_post('/gmail/v1/users/me/messages/{id}/modify', self.modify)
+
+    def add(self, message_id, subject, body='Body', labels=('INBOX',)):
+        headers = [{'name': 'From', 'value': 'a@example.com'}, {'name': 'To', 'value': 'bot@example.com'}, {'name': 'Subject', 'value': subject}, {'name': 'Date', 'value': 'd'}, {'name': 'Message-ID', 'value': f'<{message_id}@example.com>'}]
+        self.messages[message_id] = {'id': message_id, 'threadId': 't' + message_id, 'labelIds': list(labels), 'payload': {'headers': headers, 'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()}}}
+
+    def log(self, request):
+        self.requests.append((request.method, request.path, request.headers.get('Authorization')))
+
+    async def profile(self, request):
+        self.log(request)
+        return web.json_response({'emailAddress': 'bot@example.com', 'historyId': '1'})
+
+    async def list(self, request):
+        self.log(request)
+        ids = [m for m, msg in self.messages.items() if 'INBOX' in msg['labelIds']]
+        start = int(request.query.get('pageToken', 0))
+        size = int(request.query['maxResults'])
+        page = {'messages': [{'id': m} for m in ids[start:start + size]]}
+        if start + size < len(ids):
+            page['nextPageToken'] = str(start + size)
+        return web.json_response(page)
+
+    async def get(self, request):
+        self.log(request)
+        if self.failures:
+            status, reason = self.failures.pop(0)
+            return web.json_response({'error': {'code': status, 'message': 'Slow down', 'errors': [{'reason': reason}]}}, status=status, headers={'Retry-After': '0'})
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        message = self.messages.get(request.match_info['id'])
+        if message is None:
+            return web.json_response({'error': {'code': 404, 'message': 'Requested entity was not found.'}}, status=404)
+        if request.query.get('format') == 'metadata':
+            wanted = [h.lower() for h in request.query.getall('metadataHeaders')]
+            headers = [h for h in message['payload']['headers'] if h['name'].lower() in wanted]
+            return web.json_response({'id': message['id'], 'labelIds': message['labelIds'], 'payload': {'headers': headers}})
+        return web.json_response(message)
+
+    async def send(self, request):
+        self.log(request)
+        body = await request.json()
+        self.sent = base64.urlsafe_b64decode(body['raw'])
+        return web.json_response({'id': 'sent1'})
+
+    async def modify(self, request):
+        self.log(request)
+        message = self.messages[request.match_info['id']]
+        removed = (await request.json()).get('removeLabelIds', [])
+        message['labelIds'] = [l for l in message['labelIds'] if l not in removed]
+        return web.json_response(message)
+
+    async def batch_modify(self, request):
+        self.log(request)
+        body = await request.json()
+        for message_id in body['ids']:
+            message = self.messages[message_id]
+            message['labelIds'] = [l for l in message['labelIds'] if l not in body['removeLabelIds']]
+        return web.Response(status=204)
+
+class TestAsyncGmailClient(unittest.IsolatedAsyncioTestCase):
+    """Test bmail.aio against a local HTTP stand-in for Gmail."""
+
+    async def asyncSetUp(self):
+        """Start the stand-in server and point a service at it."""
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        message_cache.reset_default_cache()
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=3, base_delay=0.001, max_delay=0.01))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.stand_in = GmailStandIn()
+        self.server = TestServer(self.stand_in.app)
+        await self.server.start_server()
+        self.base_url = str(self.server.make_url('/gmail/v1/users/me/'))
+        self.service = AsyncService(Credentials(token='token'), gmail_client.get_session(), self.base_url)
+
+    async def asyncTearDown(self):
+        await gmail_client.close()
+        await self.server.close()
+        message_cache.reset_default_cache()
+        self.tmp.cleanup()
+
+    async def test_send_gmail(self):
+        """Test sending with one profile lookup and bearer auth."""
+        result = await gmail_client.send_gmail(self.service, 'to@example.com', '', '', 'Hi', 'Body')
+        self.assertEqual(result, 'Email sent successfully. Message ID: sent1')
+        await gmail_client.send_gmail(self.service, 'to@example.com', '', '', 'Hi', 'Body')
+        self.assertEqual([r[1] for r in self.stand_in.requests].count('/gmail/v1/users/me/profile'), 1)
+        self.assertIn(b'from: bot@example.com', self.stand_in.sent)
+        self.assertEqual(self.stand_in.requests[0][2], 'Bearer token')
+
+    async def test_list_emails(self):
+        """Test the listing matches the blocking client's format."""
+        self.stand_in.add('a', 'First')
+        self.stand_in.add('b', 'Second')
+        self.assertEqual(await gmail_client.list_emails(self.service), 'a:d:First\nb:d:Second')
+
+    async def test_get_email(self):
+        """Test retrieving content and metadata, then serving it from cache."""
+        self.stand_in.add('a', 'First', body='Hello there')
+        # As after get_gmail_service, which records the mailbox the cache is keyed by.
+        self.service.sender_address = 'bot@example.com'
+        cache_threads = []
+        real_get = message_cache.MessageCache.get
+
+        def get(cache, *args):
+            cache_threads.append(threading.current_thread())
+            return real_get(cache, *args)
+        with mock.patch.object(message_cache.MessageCache, 'get', get):
+            message = await gmail_client.get_email(self.service, 'a')
+            self.assertEqual(message.body, 'Hello there')
+            self.assertEqual(message.thread_id, 'ta')
+            await gmail_client.get_email(self.service, 'a')
+        self.assertEqual(len(self.stand_in.requests), 1)
+        # SQLite work stays off the event loop's thread.
+        self.assertEqual(len(cache_threads), 2)
+        self.assertNotIn(threading.current_thread(), cache_threads)
+
+    async def test_get_email_error(self):
+        """Test that API errors become the usual error strings."""
+        result = await gmail_client.get_email(self.service, 'missing', cache=False)
+        self.assertTrue(result.startswith('Failed to retrieve email:'))
+        self.assertIn('Requested entity was not found.', result)
+
+    async def test_archive(self):
+        """Test single and bulk archiving."""
+        for message_id in 'abc':
+            self.stand_in.add(message_id, message_id)
+        self.assertEqual(await gmail_client.archive_email(self.service, 'a'), 'Email a archived successfully')
+        self.assertEqual(await gmail_client.archive_email(self.service, 'a'), 'Email a is not in inbox')
+        results = await gmail_client.archive_emails(self.service, ['b', 'c'])
+        self.assertEqual([(r.id, r.ok) for r in results], [('b', True), ('c', True)])
+        self.assertEqual(self.stand_in.messages['c']['labelIds'], [])
+
+    async def test_concurrent_operations(self):
+        """Test that many operations can run at once on the shared pool."""
+        import asyncio
+        for i in range(50):
+            self.stand_in.add(f'm{i}', f'S{i}')
+        results = await asyncio.gather(*(gmail_client.get_email(self.service, f'm{i}', cache=False) for i in range(50)))
+        self.assertTrue(all((r.subject == f'S{i}' for i, r in enumerate(results))))
+
+    async def test_bounded_concurrency(self):
+        """Test that one service never has more than MAX_CONCURRENCY requests in flight."""
+        for i in range(60):
+            self.stand_in.add(f'm{i}', f'Subject {i}')
+        summaries = await gmail_client.get_summaries(self.service, [f'm{i}' for i in range(60)])
+        self.assertTrue(all((s.error is None for s in summaries)))
+        self.assertLessEqual(self.stand_in.peak, gmail_client.MAX_CONCURRENCY)
+        self.assertGreater(self.stand_in.peak, 1)
+
+    async def test_throttling_retried(self):
+        """Test that 429, 403 rate-limit and 503 answers are retried and other errors are not."""
+        self.stand_in.add('a', 'First')
+        self.stand_in.failures = [(429, 'rateLimitExceeded'), (403, 'userRateLimitExceeded'), (503, 'backendError')]
+        message = await gmail_client.get_email(self.service, 'a', cache=False)
+        self.assertEqual(message.subject, 'First')
+        self.assertEqual(len(self.stand_in.requests), 4)
+        self.stand_in.failures = [(403, 'insufficientPermissions')]
+        result = await gmail_client.get_email(self.service, 'a', cache=False)
+        self.assertTrue(result.startswith('Failed to retrieve email:'))
+        self.assertEqual(len(self.stand_in.requests), 5)
+
+    async def test_llm_tools(self):
+        """Test the async LLM wrappers end to end, including cursors."""
+        for message_id in 'abc':
+            self.stand_in.add(message_id, f'Subject {message_id}')
+        with mock.patch.object(llm_email_tools, '_get_service', return_value=self.service):
+            first = (await llm_email_tools.check_inbox(cred_filepath='creds.json', max_results=2)).split('\n')
+            self.assertEqual(first[:2], ['a:d:Subject a', 'b:d:Subject b'])
+            second = await llm_email_tools.check_inbox(cred_filepath='creds.json', cursor=first[2][len('Next cursor: '):])
+            self.assertEqual(second, 'c:d:Subject c')
+            self.assertIn('Subject: Subject a', await llm_email_tools.read_email('a', cred_filepath='creds.json'))
+            reply = await llm_email_tools.reply_to_email('a', 'Thanks', 'bot@example.com', cred_filepath='creds.json')
+            self.assertEqual(reply, 'Email sent successfully. Message ID: sent1')
+            self.assertIn(b'In-Reply-To: <a@example.com>', self.stand_in.sent)
+            self.assertEqual(await llm_email_tools.archive_emails('b.eml, c', cred_filepath='creds.json'), 'Email b archived successfully\nEmail c archived successfully')
+if __name__ == '__main__':
+    unittest.main()
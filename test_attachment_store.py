@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from bmail import attachment_store, email_handler, gmail_client, message_cache
+from bmail.attachment_store import AttachmentStore
+from bmail.fake_gmail import FakeGmail
+from bmail.message import parse_message
+
+PDF = b'%PDF-1.4 ' + bytes(range(256)) * 2000
+
+class TestAttachmentStore(unittest.TestCase):
+    """Test attachment listing and content-addressed downloads against the fake backend."""
+
+    def setUp(self):
+        """Deliver the same PDF in two messages, plus a text attachment."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        message_cache.reset_default_cache()
+        self.addCleanup(message_cache.reset_default_cache)
+        self.backend = FakeGmail(seed=7)
+        self.service = self.backend.build_service('bot@example.com')
+        self.first = self.backend.add_message('bot@example.com', subject='Report', attachments={'report.pdf': PDF, 'notes.txt': b'Totals are final.'})
+        self.forward = self.backend.add_message('bot@example.com', subject='Fwd: Report', attachments={'copy of report.pdf': PDF})
+        self.store = AttachmentStore(os.path.join(self.tmp.name, 'attachments'))
+        self.addCleanup(self.store.close)
+
+    def test_list_attachments(self):
+        """Test that metadata comes from the part tree without attachment downloads."""
+        attachments = gmail_client.list_attachments(self.service, self.first.id)
+        self.assertEqual([(a.part_id, a.filename, a.size) for a in attachments], [('1', 'report.pdf', len(PDF)), ('2', 'notes.txt', 17)])
+        self.assertEqual(self.backend.calls['messages.attachments.get'], 0)
+        self.assertTrue(gmail_client.list_attachments(self.service, 'missing').startswith('Failed to retrieve email'))
+
+    def test_raw_and_full_sizes_agree(self):
+        """Test that attachments of a raw message report decoded sizes, as the part tree does."""
+        full = gmail_client.get_email(self.service, self.first.id, cache=False)
+        raw = gmail_client.get_email(self.service, self.first.id, cache=False, format='raw')
+        self.assertEqual([(a.part_id, a.size) for a in raw.attachments], [(a.part_id, a.size) for a in full.attachments])
+        self.assertEqual([a.size for a in raw.attachments], [len(PDF), 17])
+
+    def test_download_dedupes_and_reuses(self):
+        """Test that identical attachments share one file and repeat requests make no calls."""
+        with mock.patch.object(gmail_client, '_DECODE_BLOCK', 4096):
+            first = gmail_client.download_attachment(self.service, self.first.id, '1', self.store)
+            forwarded = gmail_client.download_attachment(self.service, self.forward.id, '1', self.store)
+        self.assertTrue(first.downloaded and forwarded.downloaded)
+        self.assertEqual(first.path, forwarded.path)
+        with open(first.path, 'rb') as f:
+            self.assertEqual(f.read(), PDF)
+        self.assertEqual((forwarded.filename, forwarded.size), ('copy of report.pdf', len(PDF)))
+        self.assertEqual(self.store.objects(), 1)
+        self.assertEqual(os.listdir(os.path.dirname(first.path)), [first.sha256])
+        round_trips = self.backend.round_trips
+        again = gmail_client.download_attachment(self.service, self.first.id, '1', self.store)
+        self.assertFalse(again.downloaded)
+        self.assertEqual(again.path, first.path)
+        self.assertEqual(self.backend.round_trips, round_trips)
+        self.assertIn('no attachment with part ID 9', gmail_client.download_attachment(self.service, self.first.id, '9', self.store))
+
+    def test_inline_data_needs_no_fetch(self):
+        """Test that parts carried in the message itself are stored without another API call."""
+        gmail_client.get_email(self.service, self.first.id, format='raw')
+        round_trips = self.backend.round_trips
+        notes = gmail_client.download_attachment(self.service, self.first.id, '2', self.store)
+        self.assertEqual(self.backend.round_trips, round_trips)
+        with open(notes.path, 'rb') as f:
+            self.assertEqual(f.read(), b'Totals are final.')
+        small = parse_message({'id': 'm1', 'payload': {'mimeType': 'multipart/mixed', 'parts': [{'partId': '0', 'mimeType': 'text/plain', 'body': {'data': 'SGk'}}, {'partId': '1', 'mimeType': 'text/csv', 'filename': 'a.csv', 'body': {'size': 4, 'data': 'YSxiCg'}}]}})
+        self.assertEqual(small.attachment_data('1'), b'a,b\n')
+        self.assertIsNone(parse_message({'id': 'm2', 'payload': {'partId': '', 'filename': 'big.bin', 'body': {'attachmentId': 'x'}}}).attachment_data(''))
+
+    def test_get_attachment_tool(self):
+        """Test listing, saving by file name and the text extract."""
+        with mock.patch('bmail.email_handler._get_service', return_value=self.service):
+            self.addCleanup(attachment_store.reset_default_store)
+            listing = email_handler.get_attachment('creds.json', self.first.id)
+            saved = email_handler.get_attachment('creds.json', self.first.id, 'notes.txt', max_chars=6)
+            binary = email_handler.get_attachment('creds.json', self.first.id, '1')
+            missing = email_handler.get_attachment('creds.json', self.first.id, 'nope.doc')
+        self.assertEqual(listing, f'1:report.pdf:application/octet-stream:{len(PDF)}\n2:notes.txt:application/octet-stream:17')
+        self.assertTrue(saved.startswith(f'Saved: {os.path.join(self.tmp.name, "attachments", "objects")}'), saved)
+        self.assertTrue(saved.endswith('\nText:\nTotals\n[Text truncated after 6 characters]'), saved)
+        self.assertIn(f'Size: {len(PDF)} bytes', binary)
+        self.assertIn("has no attachment 'nope.doc'", missing)
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import os
-from bmail.auth import get_gmail_service
+from unittest import mock
+from bmail.auth import get_gmail_service, invalidate_service
 from googleapiclient.discovery import Resource
 
 class TestAuth(unittest.TestCase):
@@ -30,3 +31,58 @@ class TestAuth(unittest.TestCase):
         service = get_gmail_service('nonexistent.json', self.test_email)
         self.assertIsInstance(service, str)
         self.assertIn('Error: Credentials file not found', service)
+
+class TestServiceCache(unittest.TestCase):
+    """Test cases for the process-wide Gmail service cache (no network)."""
+
+    def setUp(self):
+        """Build against patched credentials so no key file or network is needed."""
+        invalidate_service()
+        self.addCleanup(invalidate_service)
+        self.key_path = os.path.abspath(__file__)
+        patcher_creds = mock.patch('google.oauth2.service_account.Credentials.from_service_account_file')
+        patcher_build = mock.patch('bmail.auth.discovery.build_gmail', side_effect=lambda *a, **k: mock.MagicMock())
+        self.from_file = patcher_creds.start()
+        self.build = patcher_build.start()
+        self.addCleanup(patcher_creds.stop)
+        self.addCleanup(patcher_build.stop)
+
+    def test_service_reused(self):
+        """Test that repeated calls for the same identity build only once."""
+        first = get_gmail_service(self.key_path, 'bot@example.com')
+        second = get_gmail_service(self.key_path, 'Bot@Example.com')
+        self.assertIs(first, second)
+        self.assertEqual(self.build.call_count, 1)
+        self.assertEqual(self.from_file.call_count, 1)
+        first.users().getProfile(userId='me').execute.assert_called_once()
+
+    def test_distinct_identities(self):
+        """Test that delegated email and scopes are part of the cache key."""
+        a = get_gmail_service(self.key_path, 'a@example.com')
+        b = get_gmail_service(self.key_path, 'b@example.com')
+        c = get_gmail_service(self.key_path, 'a@example.com', scopes=['https://www.googleapis.com/auth/gmail.send'])
+        self.assertIsNot(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(self.build.call_count, 3)
+        # The key file is read once per scope set, not once per delegated user.
+        self.assertEqual(self.from_file.call_count, 2)
+        invalidate_service(self.key_path)
+        get_gmail_service(self.key_path, 'a@example.com')
+        self.assertEqual(self.from_file.call_count, 3)
+
+    def test_invalidate_service(self):
+        """Test evicting a single identity and clearing the cache."""
+        a = get_gmail_service(self.key_path, 'a@example.com')
+        get_gmail_service(self.key_path, 'b@example.com')
+        self.assertEqual(invalidate_service(delegated_email='a@example.com'), 1)
+        self.assertIsNot(get_gmail_service(self.key_path, 'a@example.com'), a)
+        self.assertEqual(invalidate_service(self.key_path), 2)
+        self.assertEqual(invalidate_service(), 0)
+
+    def test_failed_build_not_cached(self):
+        """Test that an error result is returned but never cached."""
+        self.build.side_effect = RuntimeError('boom')
+        result = get_gmail_service(self.key_path, 'a@example.com')
+        self.assertIsInstance(result, str)
+        self.build.side_effect = lambda *a, **k: mock.MagicMock()
+        self.assertNotIsInstance(get_gmail_service(self.key_path, 'a@example.com'), str)
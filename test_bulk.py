@@ -0,0 +1,93 @@
+import time
+import threading
+import unittest
+from unittest import mock
+from google.oauth2.credentials import Credentials
+from bmail import bulk, email_handler, ratelimit
+
+class TestSendMany(unittest.TestCase):
+    """Test parallel sending with per-thread transports (no network)."""
+
+    def setUp(self):
+        """Lift quota metering so the tests measure the worker pool alone."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(user_units_per_second=None, project_units_per_second=None, initial_concurrency=16))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+
+    def make_service(self, fail=(), delay=0.0):
+        service = mock.MagicMock()
+        service._http.credentials = Credentials(token='token')
+        service.users().getProfile().execute.return_value = {'emailAddress': 'bot@example.com'}
+        self.transports = {}
+        self.lock = threading.Lock()
+
+        def send(userId, body):
+            request = mock.MagicMock()
+
+            def execute(http=None):
+                with self.lock:
+                    self.transports.setdefault(threading.get_ident(), set()).add(id(http))
+                time.sleep(delay)
+                import base64
+                raw = base64.urlsafe_b64decode(body['raw'])
+                to = next((l for l in raw.decode().splitlines() if l.startswith('to: ')))[4:]
+                if to in fail:
+                    raise RuntimeError('rejected')
+                return {'id': 'id-' + to}
+            request.execute.side_effect = execute
+            return request
+        service.users().messages().send.side_effect = send
+        return service
+
+    def test_results_in_input_order(self):
+        """Test that results come back in input order with counts."""
+        service = self.make_service(fail={'r3@example.com'})
+        messages = [{'to_addr': f'r{i}@example.com', 'subject': 'Digest', 'body': 'Hi'} for i in range(20)]
+        report = bulk.send_many(service, messages, max_workers=4)
+        self.assertEqual([r.index for r in report.results], list(range(20)))
+        self.assertEqual([r.to_addr for r in report.results], [m['to_addr'] for m in messages])
+        self.assertEqual((report.sent, report.failed), (19, 1))
+        self.assertEqual(report.results[3].result, 'Failed to send email: rejected')
+        self.assertEqual(report.results[0].result, 'Email sent successfully. Message ID: id-r0@example.com')
+        self.assertIn('Sent 19 of 20 emails (1 failed)', str(report))
+
+    def test_sender_lookup_failure_stops_before_sending(self):
+        """Test that a failed getProfile fails the run instead of every worker looking it up again."""
+        service = self.make_service()
+        service.users().getProfile().execute.side_effect = RuntimeError('profile unavailable')
+        with self.assertRaises(RuntimeError):
+            bulk.send_many(service, [{'to_addr': f'r{i}@example.com', 'subject': 's', 'body': 'b'} for i in range(4)])
+        self.assertEqual(self.transports, {})
+        with mock.patch('bmail.email_handler._get_service', return_value=service):
+            self.assertEqual(email_handler.send_many('creds.json', [{'to_addr': 'a@example.com', 'subject': 's', 'body': 'b'}]), 'Failed to send emails: profile unavailable')
+
+    def test_transport_per_thread(self):
+        """Test that each worker thread sends on its own, reused transport."""
+        service = self.make_service(delay=0.01)
+        bulk.send_many(service, [{'to_addr': f'r{i}@example.com', 'subject': 's', 'body': 'b'} for i in range(16)], max_workers=4)
+        per_thread = list(self.transports.values())
+        self.assertTrue(all(len(ids) == 1 for ids in per_thread))
+        self.assertEqual(len(set().union(*per_thread)), len(per_thread))
+
+    def test_parallel_speedup(self):
+        """Test that sends overlap instead of running one by one."""
+        service = self.make_service(delay=0.05)
+        started = time.perf_counter()
+        bulk.send_many(service, [{'to_addr': f'r{i}@example.com', 'subject': 's', 'body': 'b'} for i in range(16)], max_workers=8)
+        self.assertLess(time.perf_counter() - started, 16 * 0.05 / 2)
+
+    def test_lazy_bounded_input(self):
+        """Test that a generator input is consumed only a window ahead of the output."""
+        service = self.make_service()
+        consumed = []
+
+        def messages():
+            for i in range(100):
+                consumed.append(i)
+                yield {'to_addr': f'r{i}@example.com', 'subject': 's', 'body': 'b'}
+        results = bulk.iter_send(service, messages(), max_workers=2)
+        next(results)
+        self.assertLessEqual(len(consumed), 5)
+        results.close()
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+from bmail import discovery
+
+class TestDiscovery(unittest.TestCase):
+    """Test the pruned, cached discovery document and lazy imports."""
+
+    def setUp(self):
+        """Use an empty cache directory and no in-process document."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        discovery._DOCUMENT = None
+        self.addCleanup(setattr, discovery, '_DOCUMENT', None)
+
+    def test_prune_keeps_used_methods(self):
+        """Test that pruning keeps the methods bmail calls and the schemas they need."""
+        document = discovery.load_document()
+        users = document['resources']['users']
+        self.assertEqual(set(users['resources']), set(discovery.USED_RESOURCES))
+        self.assertEqual(set(users['methods']), {'getProfile'})
+        self.assertIn('batchModify', users['resources']['messages']['methods'])
+        self.assertIn('Message', document['schemas'])
+        self.assertIn('MessagePart', document['schemas'])
+        self.assertNotIn('Filter', document['schemas'])
+
+    def test_document_cached_on_disk(self):
+        """Test that a later process reads the cached document instead of pruning again."""
+        discovery.load_document()
+        with open(discovery.cache_path()) as f:
+            self.assertEqual(json.load(f), discovery._DOCUMENT)
+        discovery._DOCUMENT = None
+        with mock.patch('bmail.discovery._source_document') as source:
+            discovery.load_document()
+        source.assert_not_called()
+
+    def test_corrupt_cache_rebuilt(self):
+        """Test that an unreadable cache file is replaced."""
+        os.makedirs(os.path.dirname(discovery.cache_path()), exist_ok=True)
+        with open(discovery.cache_path(), 'w') as f:
+            f.write('{not json')
+        self.assertIn('resources', discovery.load_document())
+        with open(discovery.cache_path()) as f:
+            self.assertIn('resources', json.load(f))
+
+    def test_cache_keyed_by_library_version(self):
+        """Test that the cache file name carries the installed googleapiclient version."""
+        from googleapiclient.version import __version__
+        self.assertEqual(os.path.basename(discovery.cache_path()), f'gmail-v1-discovery-{__version__}.json')
+        self.assertNotIn('unknown', discovery.cache_path())
+
+    def test_import_does_not_load_google_stack(self):
+        """Test that importing bmail and its tools leaves the Google client unloaded and needs no BMAIL_SENDER."""
+        code = "import sys, bmail.llm_email_tools; print(sorted(m for m in sys.modules if m.split('.')[0] in ('googleapiclient', 'google', 'httplib2')))"
+        env = {k: v for k, v in os.environ.items() if k != 'BMAIL_SENDER'}
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_email_attribute_follows_environment(self):
+        """Test that bmail.__email__ reads BMAIL_SENDER and is a missing attribute when it is unset."""
+        import bmail
+        with mock.patch.dict(os.environ, {'BMAIL_SENDER': 'bot@example.com'}):
+            self.assertEqual(bmail.__email__, 'bot@example.com')
+        with mock.patch.dict(os.environ):
+            os.environ.pop('BMAIL_SENDER', None)
+            self.assertFalse(hasattr(bmail, '__email__'))
+            self.assertIsNone(getattr(bmail, '__email__', None))
+            with self.assertRaisesRegex(AttributeError, 'BMAIL_SENDER'):
+                bmail.__email__
+if __name__ == '__main__':
+    unittest.main()
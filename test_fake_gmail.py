@@ -0,0 +1,130 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+from googleapiclient.errors import HttpError
+from google.oauth2.credentials import Credentials
+from bmail import auth, gmail_client, loadtest, message_cache, ratelimit, sync
+from bmail.fake_gmail import FakeGmail, serve
+from bmail.sync import MailboxSync
+
+class TestFakeGmail(unittest.TestCase):
+    """Test the in-process Gmail backend through the real googleapiclient stack."""
+
+    def setUp(self):
+        """Seed a backend with two mailboxes and use a fast-retry scheduler."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=2, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.backend = FakeGmail(seed=1)
+        self.backend.add_mailbox('user@example.com')
+        for i in range(3):
+            self.backend.add_message('bot@example.com', sender='user@example.com', subject=f'Subject {i}', body=f'Body {i}')
+        self.service = self.backend.build_service('bot@example.com')
+
+    def test_list_and_batched_metadata(self):
+        """Test that summaries come back through a single batch round trip."""
+        lines, token = gmail_client.list_email_page(self.service, max_results=2)
+        self.assertEqual([line.split(':')[-1] for line in lines], ['Subject 2', 'Subject 1'])
+        self.assertEqual(token, '2')
+        self.assertEqual(self.backend.calls['messages.get'], 2)
+        self.assertEqual(self.backend.round_trips, 2)
+
+    def test_get_email_with_attachment(self):
+        """Test that multipart messages expose attachment parts."""
+        message = self.backend.add_message('bot@example.com', subject='With file', attachments={'notes.txt': b'hello'})
+        result = gmail_client.get_email(self.service, message.id, cache=False)
+        self.assertEqual((result.subject, result.body), ('With file', 'Test body'))
+        self.assertEqual(result.message_id, message.header('Message-ID'))
+        self.assertEqual([a.filename for a in result.attachments], ['notes.txt'])
+        resource = self.service.users().messages().get(userId='me', id=message.id).execute()
+        part = resource['payload']['parts'][1]
+        self.assertEqual(part['filename'], 'notes.txt')
+        self.assertIn('attachmentId', part['body'])
+
+    def test_send_delivers_and_threads(self):
+        """Test that a reply lands in the recipient's inbox on the original thread."""
+        original = self.backend.add_message('user@example.com', sender='bot@example.com', subject='Hello')
+        result = gmail_client.send_gmail(self.service, 'user@example.com', '', '', 'Re: Hello', 'Hi', in_reply_to=original.header('Message-ID'), references=original.header('Message-ID'))
+        self.assertIn('Email sent successfully', result)
+        inbox = self.backend.mailboxes['user@example.com'].messages
+        reply = [m for m in inbox.values() if m.header('Subject') == 'Re: Hello'][0]
+        self.assertEqual(reply.thread_id, original.thread_id)
+        self.assertEqual(reply.label_ids, ['INBOX', 'UNREAD'])
+
+    def test_history_and_expiry(self):
+        """Test incremental sync against the fake history, including an expired historyId."""
+        state = MailboxSync(os.path.join(self.tmp.name, 'sync.sqlite3'), cache=False)
+        self.addCleanup(state.close)
+        self.assertTrue(state.sync(self.service).full)
+        new = self.backend.add_message('bot@example.com', subject='New')
+        self.assertEqual(state.sync(self.service).added, [new.id])
+        self.backend.history_retention = 1
+        state.set_history_id('bot@example.com', '1')
+        self.assertTrue(state.sync(self.service).full)
+
+    def test_quota_and_errors(self):
+        """Test that quota exhaustion and injected errors surface as HttpErrors."""
+        self.backend.user_units_per_second = 150
+        self.service.users().messages().send(userId='me', body={'raw': ''}).execute()
+        with self.assertRaises(HttpError) as ctx:
+            self.service.users().messages().send(userId='me', body={'raw': ''}).execute()
+        self.assertEqual(ctx.exception.resp.status, 429)
+        self.backend.user_units_per_second = None
+        self.backend.error_rate = 1.0
+        with self.assertRaises(HttpError) as ctx:
+            self.service.users().getProfile(userId='me').execute()
+        self.assertEqual(ctx.exception.resp.status, 503)
+
+    def test_search_syntax(self):
+        """Test the supported subset of Gmail search."""
+        messages = list(self.backend.mailboxes['bot@example.com'].messages.values())
+        self.assertTrue(self.backend.matches(messages[0], 'in:inbox from:user subject:"Subject 0"'))
+        self.assertFalse(self.backend.matches(messages[0], '-in:inbox'))
+        self.assertTrue(self.backend.matches(messages[0], f"rfc822msgid:{messages[0].header('Message-ID')}"))
+
+    def test_serve_for_aio(self):
+        """Test that the HTTP mode answers bmail.aio."""
+        from bmail.aio import gmail_client as aio_client
+        from bmail.aio.gmail_client import AsyncService
+        server = serve(self.backend, 'bot@example.com')
+        self.addCleanup(server.shutdown)
+        base_url = f'http://127.0.0.1:{server.server_port}/gmail/v1/users/me/'
+
+        thread_id = next(iter(self.backend.mailboxes['bot@example.com'].messages.values())).thread_id
+
+        async def run():
+            service = AsyncService(Credentials(token='token'), aio_client.get_session(), base_url)
+            try:
+                return (await aio_client.list_emails(service), await aio_client.get_thread(service, thread_id, cache=False))
+            finally:
+                await aio_client.close()
+        listing, thread = asyncio.run(run())
+        self.assertEqual(len(listing.splitlines()), 3)
+        self.assertEqual([m.subject for m in thread], ['Subject 0'])
+
+class TestLoadTest(unittest.TestCase):
+    """Test the load-test harness."""
+
+    def test_reports_calls_per_operation(self):
+        """Test that each operation is measured and environment is restored."""
+        with mock.patch.dict(os.environ, {'BMAIL_SENDER': 'sender@example.com'}):
+            stats = loadtest.run_load_test(iterations=2, messages=5)
+            self.assertEqual(os.environ['BMAIL_SENDER'], 'sender@example.com')
+        by_name = {s.name: s for s in stats}
+        self.assertEqual(list(by_name), list(loadtest.OPERATIONS))
+        self.assertTrue(all((s.errors == 0 for s in stats)))
+        self.assertEqual(by_name['send_email'].api_calls['messages.send'], 2)
+        self.assertEqual(by_name['check_inbox'].round_trips, 4)
+        self.assertGreaterEqual(by_name['check_inbox'].p99, by_name['check_inbox'].p50)
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        self.assertEqual(loadtest.percentile(list(range(1, 101)), 0.5), 50)
+        self.assertEqual(loadtest.percentile(list(range(1, 101)), 0.99), 99)
+        self.assertEqual(loadtest.percentile([], 0.5), 0.0)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+from bmail import auth, fanout, message_cache, ratelimit
+from bmail.fake_gmail import FakeGmail
+
+USERS = [f'staff{i}@example.com' for i in range(6)]
+
+class TestFanout(unittest.TestCase):
+    """Test multi-mailbox fan-out against the fake backend."""
+
+    def setUp(self):
+        """Give every staff mailbox two messages and install their services."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=1, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        message_cache.reset_default_cache()
+        self.addCleanup(message_cache.reset_default_cache)
+        self.addCleanup(auth.invalidate_service)
+        self.backend = FakeGmail(latency=0.005, seed=5)
+        self.messages = {}
+        for user in USERS:
+            self.messages[user] = [self.backend.add_message(user, subject=f'For {user} #{i}') for i in range(2)]
+            auth.install_service('creds.json', user, self.backend.build_service(user))
+
+    def test_list_streams_every_user(self):
+        """Test that each mailbox is listed once with its own messages."""
+        results = list(fanout.list_emails('creds.json', USERS, max_workers=4))
+        self.assertEqual(sorted((r.user for r in results)), USERS)
+        for result in results:
+            self.assertTrue(result.ok)
+            self.assertIn(f'For {result.user} #1', result.result)
+            self.assertEqual(len(result.result.splitlines()), 2)
+
+    def test_read_and_archive(self):
+        """Test reads keyed by email ID and per-user archive batches."""
+        items = [(user, message.id) for user in USERS[:3] for message in self.messages[user]]
+        reads = {r.key: r for r in fanout.read_emails('creds.json', items, max_chars=100)}
+        self.assertEqual(set(reads), {email_id for _, email_id in items})
+        self.assertTrue(all((r.ok and 'Subject: For' in r.result for r in reads.values())))
+        archived = list(fanout.archive_emails('creds.json', {user: [m.id for m in self.messages[user]] for user in USERS[:3]}))
+        self.assertTrue(all((r.ok for r in archived)))
+        self.assertEqual(self.backend.calls['messages.batchModify'], 3)
+        missing = list(fanout.read_emails('creds.json', [(USERS[0], 'nope')]))
+        self.assertFalse(missing[0].ok)
+
+    def test_read_cache_is_per_mailbox(self):
+        """Test that a message cached for one user is not served to another asking for the same ID."""
+        email_id = self.messages[USERS[0]][0].id
+        own = list(fanout.read_emails('creds.json', [(USERS[0], email_id)]))
+        self.assertTrue(own[0].ok)
+        other = list(fanout.read_emails('creds.json', [(USERS[1], email_id)]))
+        self.assertFalse(other[0].ok)
+        self.assertNotIn(f'For {USERS[0]}', other[0].result)
+
+    def test_concurrency_bounds(self):
+        """Test that no user ever has more than per_user calls, nor the pool more than max_workers."""
+        lock = threading.Lock()
+        running = Counter()
+        peaks = Counter()
+
+        def work(service, key):
+            with lock:
+                running[key] += 1
+                running['total'] += 1
+                peaks[key] = max(peaks[key], running[key])
+                peaks['total'] = max(peaks['total'], running['total'])
+            time.sleep(0.01)
+            with lock:
+                running[key] -= 1
+                running['total'] -= 1
+            return ('done', True)
+        tasks = ((user, 'probe', user, work) for user in USERS for _ in range(5))
+        results = list(fanout.run('creds.json', tasks, max_workers=4, per_user=2))
+        self.assertEqual(len(results), 30)
+        self.assertLessEqual(peaks['total'], 4)
+        self.assertEqual(max((peaks[user] for user in USERS)), 2)
+
+    def test_grouped_input_keeps_pool_busy(self):
+        """Test that input grouped by user still runs max_workers calls at once across users."""
+        lock = threading.Lock()
+        running = Counter()
+        peaks = Counter()
+
+        def work(service, key):
+            with lock:
+                running['total'] += 1
+                peaks['total'] = max(peaks['total'], running['total'])
+            time.sleep(0.02)
+            with lock:
+                running['total'] -= 1
+            return ('done', True)
+        tasks = ((user, 'probe', user, work) for user in USERS[:3] for _ in range(40))
+        started = time.perf_counter()
+        results = list(fanout.run('creds.json', tasks, max_workers=6, per_user=2))
+        self.assertEqual(len(results), 120)
+        self.assertEqual(peaks['total'], 6)
+        # Three users at two calls each: 20 rounds of 0.02s, not 60 as with one user at a time.
+        self.assertLess(time.perf_counter() - started, 0.02 * 40)
+
+    def test_authentication_error_reported(self):
+        """Test that a user without a service yields a failed result instead of raising."""
+        results = list(fanout.list_emails('missing-key.json', ['nobody@example.com']))
+        self.assertFalse(results[0].ok)
+        self.assertTrue(results[0].result.startswith('Authentication error:'))
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import time
 from googleapiclient.discovery import Resource
 from bmail import gmail_client
 from bmail.auth import get_gmail_service
+from bmail.message import Message
 from bmail.config import Config
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.send']
 
@@ -59,8 +60,8 @@ class TestGmailClient(unittest.TestCase):
         email_id = messages[0]['id']
         print(f'Using email ID: {email_id}')
         result = gmail_client.get_email(self.service, email_id)
-        self.assertIsInstance(result, bytes)
-        self.assertTrue(self.test_subject.encode() in result)
+        self.assertIsInstance(result, Message)
+        self.assertEqual(result.subject, self.test_subject)
 
     def test_4_archive_email(self):
         """Test archiving an email."""
@@ -0,0 +1,400 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from bmail import email_handler, gmail_client, message_cache, metrics
+from bmail.message import ArchiveResult
+
+def setUpModule():
+    """Keep the default message cache out of the user's home directory."""
+    global _cache_dir
+    _cache_dir = tempfile.TemporaryDirectory()
+    os.environ['BMAIL_CACHE_DIR'] = _cache_dir.name
+    message_cache.reset_default_cache()
+
+def tearDownModule():
+    message_cache.reset_default_cache()
+    del os.environ['BMAIL_CACHE_DIR']
+    _cache_dir.cleanup()
+
+class FakeBatch:
+    """Stand-in for BatchHttpRequest that answers each added request from a table."""
+
+    def __init__(self, callback, responses, log):
+        self.callback = callback
+        self.responses = responses
+        self.log = log
+        self.added = []
+
+    def add(self, request, request_id=None):
+        self.added.append(request_id)
+
+    def execute(self, http=None):
+        self.log.append(list(self.added))
+        for request_id in self.added:
+            response = self.responses[request_id]
+            if isinstance(response, Exception):
+                self.callback(request_id, None, response)
+            else:
+                self.callback(request_id, response, None)
+
+def metadata(subject, date=None, internal_date='0'):
+    headers = [{'name': 'Subject', 'value': subject}]
+    if date:
+        headers.append({'name': 'Date', 'value': date})
+    return {'payload': {'headers': headers}, 'internalDate': internal_date}
+
+class TestBatchedListEmails(unittest.TestCase):
+    """Test that list_emails fetches metadata in batches (no network)."""
+
+    def make_service(self, ids, responses):
+        service = mock.MagicMock()
+        service.users().messages().list().execute.return_value = {'messages': [{'id': i} for i in ids]}
+        self.batches = []
+        service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, responses, self.batches)
+        return service
+
+    def test_single_batch(self):
+        """Test that one page of results costs one list call and one batch."""
+        responses = {'a': metadata('Hello', 'Mon, 1 Jan 2024 10:00:00 +0000'), 'b': metadata('World', 'Tue, 2 Jan 2024 10:00:00 +0000')}
+        service = self.make_service(['a', 'b'], responses)
+        result = gmail_client.list_emails(service)
+        self.assertEqual(result, 'a:Mon, 1 Jan 2024 10:00:00 +0000:Hello\nb:Tue, 2 Jan 2024 10:00:00 +0000:World')
+        self.assertEqual(self.batches, [['a', 'b']])
+
+    def test_chunked_to_batch_limit(self):
+        """Test that more than BATCH_LIMIT messages are split across batches in order."""
+        ids = [f'm{i}' for i in range(gmail_client.BATCH_LIMIT + 5)]
+        service = self.make_service(ids, {i: metadata(i, 'd') for i in ids})
+        lines = gmail_client.list_emails(service, max_results=len(ids)).split('\n')
+        self.assertEqual([len(b) for b in self.batches], [gmail_client.BATCH_LIMIT, 5])
+        self.assertEqual(lines, [f'{i}:d:{i}' for i in ids])
+
+    def test_per_message_failure(self):
+        """Test that one failed metadata fetch is reported without losing the others."""
+        service = self.make_service(['a', 'b'], {'a': RuntimeError('gone'), 'b': metadata('Kept', 'd')})
+        result = gmail_client.list_emails(service)
+        self.assertEqual(result, 'a:Failed to fetch metadata: gone\nb:d:Kept')
+
+    def test_no_emails(self):
+        """Test the empty inbox message."""
+        service = self.make_service([], {})
+        self.assertEqual(gmail_client.list_emails(service), 'No emails found')
+        self.assertEqual(self.batches, [])
+
+class PagedService:
+    """Builds a mock service whose messages.list pages through a fixed id list."""
+
+    def __init__(self, ids, responses=None):
+        self.ids = ids
+        self.list_calls = []
+        self.batches = []
+        self.service = mock.MagicMock()
+        self.service.users().messages().list.side_effect = self.list
+        responses = responses or {i: metadata(i, 'd') for i in ids}
+        self.service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, responses, self.batches)
+
+    def list(self, userId, maxResults, q, pageToken=None):
+        self.list_calls.append((q, maxResults, pageToken))
+        start = int(pageToken or 0)
+        # None stands for a message Gmail leaves out, so a page can be empty but not the last.
+        page = {'messages': [{'id': i} for i in self.ids[start:start + maxResults] if i is not None]}
+        if start + maxResults < len(self.ids):
+            page['nextPageToken'] = str(start + maxResults)
+        request = mock.MagicMock()
+        request.execute.return_value = page
+        return request
+
+class TestPagination(unittest.TestCase):
+    """Test page-token handling in iter_emails and the check_inbox cursor (no network)."""
+
+    def test_iter_emails_all_pages(self):
+        """Test that the generator follows nextPageToken to the end."""
+        fake = PagedService([f'm{i}' for i in range(7)])
+        lines = list(gmail_client.iter_emails(fake.service, page_size=3))
+        self.assertEqual(lines, [f'm{i}:d:m{i}' for i in range(7)])
+        self.assertEqual([call[2] for call in fake.list_calls], [None, '3', '6'])
+
+    def test_empty_page_keeps_token(self):
+        """Test that an empty page still returns its nextPageToken and paging carries on."""
+        fake = PagedService(['m0', 'm1', None, None, 'm4'])
+        self.assertEqual(gmail_client.list_summaries(fake.service, max_results=2, page_token='2'), ([], '4'))
+        self.assertEqual(list(gmail_client.iter_emails(fake.service, page_size=2)), ['m0:d:m0', 'm1:d:m1', 'm4:d:m4'])
+        self.assertEqual(email_handler.format_summaries([], 'abc'), 'No emails found\nNext cursor: abc')
+
+    def test_iter_emails_is_lazy(self):
+        """Test that pages are only fetched as the generator is consumed."""
+        fake = PagedService([f'm{i}' for i in range(10)])
+        iterator = gmail_client.iter_emails(fake.service, page_size=2)
+        self.assertEqual(fake.list_calls, [])
+        next(iterator)
+        self.assertEqual(len(fake.list_calls), 1)
+
+    def test_iter_emails_limit(self):
+        """Test that limit caps both the output and the last page size."""
+        fake = PagedService([f'm{i}' for i in range(10)])
+        lines = list(gmail_client.iter_emails(fake.service, page_size=4, limit=6))
+        self.assertEqual(len(lines), 6)
+        self.assertEqual([call[1] for call in fake.list_calls], [4, 2])
+
+    def test_check_inbox_cursor(self):
+        """Test paging through the inbox with the opaque cursor."""
+        from bmail import email_handler
+        fake = PagedService([f'm{i}' for i in range(5)])
+        with mock.patch.object(email_handler, '_get_service', return_value=fake.service):
+            first = email_handler.list_emails('creds.json', query='from:a', max_results=3).split('\n')
+            self.assertEqual(first[:3], ['m0:d:m0', 'm1:d:m1', 'm2:d:m2'])
+            self.assertTrue(first[3].startswith('Next cursor: '))
+            second = email_handler.list_emails('creds.json', cursor=first[3][len('Next cursor: '):], max_results=3)
+        self.assertEqual(second, 'm3:d:m3\nm4:d:m4')
+        self.assertEqual(fake.list_calls[1], ('in:inbox from:a', 3, '3'))
+
+    def test_invalid_cursor(self):
+        """Test that a garbled cursor is reported as an error string."""
+        from bmail import email_handler
+        self.assertTrue(email_handler.list_emails('creds.json', cursor='not a cursor').startswith('Error: Invalid cursor'))
+
+class TestSenderAddress(unittest.TestCase):
+    """Test that the From address is resolved once per service (no network)."""
+
+    def make_service(self):
+        service = mock.MagicMock()
+        service.users().getProfile().execute.return_value = {'emailAddress': 'bot@example.com'}
+        service.users().getProfile.reset_mock()
+        service.users().messages().send().execute.return_value = {'id': 'sent1'}
+        service.users().messages().send.reset_mock()
+        return service
+
+    def test_profile_fetched_once(self):
+        """Test that repeated sends on one service call getProfile only once."""
+        service = self.make_service()
+        for _ in range(3):
+            result = gmail_client.send_gmail(service, 'to@example.com', '', '', 'Hi', 'Body')
+            self.assertEqual(result, 'Email sent successfully. Message ID: sent1')
+        self.assertEqual(service.users().getProfile.call_count, 1)
+        self.assertEqual(service.users().messages().send.call_count, 3)
+
+    def test_from_addr_override(self):
+        """Test that an explicit from_addr skips getProfile and sets the header."""
+        import base64
+        service = self.make_service()
+        gmail_client.send_gmail(service, 'to@example.com', '', '', 'Hi', 'Body', from_addr='alias@example.com')
+        self.assertEqual(service.users().getProfile.call_count, 0)
+        raw = service.users().messages().send.call_args.kwargs['body']['raw']
+        self.assertIn(b'from: alias@example.com', base64.urlsafe_b64decode(raw))
+
+    def test_remembered_address(self):
+        """Test that an address recorded up front (as auth does) is used directly."""
+        service = self.make_service()
+        gmail_client.remember_sender_address(service, 'known@example.com')
+        self.assertEqual(gmail_client.get_sender_address(service), 'known@example.com')
+        self.assertEqual(service.users().getProfile.call_count, 0)
+
+class TestBulkArchive(unittest.TestCase):
+    """Test archive_emails batching through batchModify (no network)."""
+
+    def make_service(self, responses=None, fail_chunks=()):
+        service = mock.MagicMock()
+        self.modified = []
+        self.batches = []
+
+        def batch_modify(userId, body):
+            self.modified.append(list(body['ids']))
+            request = mock.MagicMock()
+            if len(self.modified) in fail_chunks:
+                request.execute.side_effect = RuntimeError('quota')
+            return request
+        service.users().messages().batchModify.side_effect = batch_modify
+        service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, responses or {}, self.batches)
+        return service
+
+    def test_chunks_of_batch_modify_limit(self):
+        """Test that thousands of IDs take ceil(n / 1000) calls with per-ID results."""
+        ids = [f'm{i}' for i in range(2500)]
+        service = self.make_service()
+        results = gmail_client.archive_emails(service, ids)
+        self.assertEqual([len(chunk) for chunk in self.modified], [1000, 1000, 500])
+        self.assertEqual([(r.id, r.ok) for r in results], [(i, True) for i in ids])
+        self.assertEqual(str(results[0]), 'Email m0 archived successfully')
+        self.assertEqual(self.batches, [])
+
+    def test_failed_chunk_reported_per_id(self):
+        """Test that a failing batchModify marks only its own chunk as failed."""
+        ids = [f'm{i}' for i in range(1001)]
+        service = self.make_service(fail_chunks=(2,))
+        results = gmail_client.archive_emails(service, ids)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[1000], ArchiveResult('m1000', False, 'Failed to archive email m1000: quota'))
+
+    def test_verify(self):
+        """Test that verify=True skips missing and already archived messages."""
+        responses = {'a': {'labelIds': ['INBOX']}, 'b': {'labelIds': ['SENT']}, 'c': RuntimeError('not found')}
+        service = self.make_service(responses)
+        results = gmail_client.archive_emails(service, ['a', 'b', 'c', 'a'], verify=True)
+        self.assertEqual([(r.id, r.ok) for r in results], [('a', True), ('b', False), ('c', False)])
+        self.assertEqual(email_handler.format_archive_results(results), 'Email a archived successfully\nEmail b is not in inbox\nFailed to archive email c: not found')
+        self.assertEqual(self.modified, [['a']])
+
+    def test_llm_tool_splits_ids(self):
+        """Test that the LLM tool accepts comma or whitespace separated IDs."""
+        from bmail import llm_email_tools
+        with mock.patch('bmail.email_handler.archive_emails', return_value='ok') as archive:
+            llm_email_tools.archive_emails('a, b\nc', cred_filepath='creds.json')
+        self.assertEqual(archive.call_args.args[1], ['a', 'b', 'c'])
+class TestReplyHeaders(unittest.TestCase):
+    """Test the header-only reply path against the fake backend."""
+
+    def setUp(self):
+        """Seed a message with a large attachment that is part of an existing thread."""
+        from bmail.fake_gmail import FakeGmail
+        self.backend = FakeGmail()
+        self.backend.add_mailbox('alice@example.com')
+        self.original = self.backend.add_message('bot@example.com', sender='Alice <alice@example.com>', subject='Re: Plans', attachments={'big.bin': b'x' * 500000}, headers={'Reply-To': 'team@example.com', 'References': '<a@example.com> <b@example.com>'})
+        self.service = self.backend.build_service('bot@example.com')
+
+    def test_fetches_metadata_only(self):
+        """Test that the reply headers come from one small metadata call."""
+        records = []
+        metrics.add_hook(records.append)
+        self.addCleanup(metrics.remove_hook, records.append)
+        headers = gmail_client.get_reply_headers(self.service, self.original.id, cache=False)
+        self.assertEqual(headers['reply_to'], 'team@example.com')
+        self.assertEqual(self.backend.calls['messages.get'], 1)
+        self.assertLess(records[-1].response_bytes, 2000)
+
+    def test_build_reply(self):
+        """Test addressing, subject and the References chain."""
+        reply = gmail_client.build_reply(gmail_client.get_reply_headers(self.service, self.original.id, cache=False))
+        message_id = self.original.header('Message-ID')
+        self.assertEqual(reply, {'to_addr': 'team@example.com', 'subject': 'Re: Plans', 'thread_id': self.original.thread_id, 'in_reply_to': message_id, 'references': f'<a@example.com> <b@example.com> {message_id}'})
+        self.assertEqual(gmail_client.build_reply({'from': 'a@example.com', 'reply_to': '', 'subject': 'Hi', 'message_id': '<c@example.com>', 'references': '', 'thread_id': 't'})['references'], '<c@example.com>')
+        self.assertEqual(gmail_client.build_reply({'from': '', 'reply_to': '', 'subject': 'Hi', 'message_id': None, 'references': '', 'thread_id': None}), 'Error: Could not parse original email headers')
+        self.assertEqual(gmail_client.build_reply('Failed to retrieve email: gone'), 'Failed to retrieve email: gone')
+
+    def test_reply_to_email(self):
+        """Test that the tool replies on the thread without downloading the message."""
+        from bmail import email_handler
+        with mock.patch('bmail.email_handler._get_service', return_value=self.service):
+            result = email_handler.reply_to_email('creds.json', self.original.id, 'Sounds good')
+        self.assertIn('Email sent successfully', result)
+        sent = [m for m in self.backend.mailboxes['bot@example.com'].messages.values() if 'SENT' in m.label_ids][0]
+        self.assertEqual(sent.thread_id, self.original.thread_id)
+        self.assertEqual(sent.header('In-Reply-To'), self.original.header('Message-ID'))
+        self.assertEqual(sent.header('To'), 'team@example.com')
+        self.assertEqual(self.backend.calls['messages.get'], 1)
+class TestThread(unittest.TestCase):
+    """Test whole-thread reads against the fake backend."""
+
+    def setUp(self):
+        """Seed a 15-message thread where every reply quotes the previous message."""
+        from datetime import datetime, timedelta, timezone
+        from bmail.fake_gmail import FakeGmail
+        self.backend = FakeGmail()
+        self.service = self.backend.build_service('bot@example.com')
+        gmail_client.remember_sender_address(self.service, 'bot@example.com')
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.messages = []
+        previous = None
+        for i in range(15):
+            body = f'Message {i}'
+            headers = {}
+            if previous is not None:
+                body += f'\n\nOn Mon, Jan 1, 2024 at 10:00 AM Someone <s@example.com> wrote:\n> Message {i - 1}\n> ' + 'old ' * 200
+                headers = {'In-Reply-To': previous.header('Message-ID')}
+            previous = self.backend.add_message('bot@example.com', sender=f'user{i % 2}@example.com', subject='Plans' if i == 0 else 'Re: Plans', body=body, date=start + timedelta(minutes=30 if i == 7 else i), headers=headers)
+            self.messages.append(previous)
+
+    def test_one_round_trip_in_order(self):
+        """Test that the whole thread comes back oldest first from a single call."""
+        thread_id = self.messages[0].thread_id
+        messages = gmail_client.get_thread(self.service, thread_id, cache=False)
+        self.assertEqual(self.backend.round_trips, 1)
+        self.assertEqual(self.backend.calls['threads.get'], 1)
+        self.assertEqual(len(messages), 15)
+        self.assertEqual(messages[-1].id, self.messages[7].id)
+        self.assertEqual(gmail_client.get_thread(self.service, 'missing', cache=False)[:25], 'Failed to retrieve thread')
+
+    def test_read_thread_strips_quotes(self):
+        """Test the compact tool output with quoted history removed and per-message limits."""
+        from bmail import email_handler
+        with mock.patch('bmail.email_handler._get_service', return_value=self.service):
+            result = email_handler.read_thread('creds.json', self.messages[0].thread_id, max_chars_per_message=9)
+        lines = result.splitlines()
+        self.assertEqual(lines[:3], [f'Thread-ID: {self.messages[0].thread_id}', 'Subject: Plans', 'Messages: 15'])
+        self.assertNotIn('old', result)
+        self.assertNotIn('wrote:', result)
+        self.assertIn(f'[1/15] ID: {self.messages[0].id} | From: user0@example.com', result)
+        self.assertEqual(result.count('[Body truncated after 9 characters]'), 5)
+        self.assertIn('Message 1\n', result)
+        self.assertEqual(self.backend.round_trips, 1)
+class TestAttachmentUpload(unittest.TestCase):
+    """Test sending attachments through the resumable upload endpoint of the fake backend."""
+
+    def setUp(self):
+        """Create two attachment files and a fake sender and recipient."""
+        from bmail import ratelimit
+        from bmail.fake_gmail import FakeGmail
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=10, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.report = os.path.join(self.tmp.name, 'report.pdf')
+        with open(self.report, 'wb') as f:
+            f.write(os.urandom(600 * 1024 + 7))
+        self.notes = os.path.join(self.tmp.name, 'notes.txt')
+        with open(self.notes, 'w') as f:
+            f.write('hello')
+        self.backend = FakeGmail(seed=3)
+        self.service = self.backend.build_service('bot@example.com')
+        gmail_client.remember_sender_address(self.service, 'bot@example.com')
+        self.inbox = self.backend.build_service('alice@example.com')
+
+    def received(self):
+        from bmail.message import parse_message
+        email_id = self.inbox.users().messages().list(userId='me').execute()['messages'][0]['id']
+        return parse_message(self.inbox.users().messages().get(userId='me', id=email_id).execute())
+
+    def test_streams_in_chunks_and_resumes(self):
+        """Test a chunked upload that survives injected errors and arrives intact."""
+        import base64
+        self.backend.error_rate = 0.3
+        with mock.patch.object(gmail_client, 'UPLOAD_CHUNK_SIZE', 256 * 1024):
+            result = gmail_client.send_gmail(self.service, 'alice@example.com', '', '', 'Report', 'See attached', attachments=[self.report, self.notes])
+        self.backend.error_rate = 0.0
+        self.assertTrue(result.startswith('Email sent successfully'), result)
+        self.assertEqual(len(self.service.users().messages().list(userId='me', q='in:sent').execute()['messages']), 1)
+        self.assertGreater(self.backend.calls['upload.chunk'], 3)
+        message = self.received()
+        self.assertEqual((message.subject, message.body), ('Report', 'See attached'))
+        self.assertEqual([(a.filename, a.mime_type) for a in message.attachments], [('report.pdf', 'application/pdf'), ('notes.txt', 'text/plain')])
+        data = self.inbox.users().messages().attachments().get(userId='me', messageId=message.id, id=message.attachments[0].attachment_id).execute()['data']
+        with open(self.report, 'rb') as f:
+            self.assertEqual(base64.urlsafe_b64decode(data), f.read())
+
+    def test_write_mime_streams_blocks(self):
+        """Test that attachments are read in bounded blocks, never whole."""
+        import io
+        reads = []
+        real_open = open
+
+        def tracking_open(path, mode='r', *args, **kwargs):
+            f = real_open(path, mode, *args, **kwargs)
+            read = f.read
+            f.read = lambda size=-1: reads.append(size) or read(size)
+            return f
+        with mock.patch('builtins.open', tracking_open):
+            size = gmail_client.write_mime(io.BytesIO(), 'bot@example.com', 'a@example.com', '', '', 'S', 'B', [self.report])
+        self.assertGreater(size, 600 * 1024 * 4 // 3)
+        self.assertTrue(reads and all((0 < n <= gmail_client._ENCODE_BLOCK for n in reads)))
+
+    def test_errors_reported(self):
+        """Test missing files and oversized messages are reported without an API call."""
+        missing = gmail_client.send_gmail(self.service, 'alice@example.com', '', '', 'S', 'B', attachments=[os.path.join(self.tmp.name, 'nope.pdf')])
+        self.assertTrue(missing.startswith('Failed to send email:'), missing)
+        with mock.patch.object(gmail_client, 'MAX_UPLOAD_BYTES', 1024):
+            too_big = gmail_client.send_gmail(self.service, 'alice@example.com', '', '', 'S', 'B', attachments=[self.report])
+        self.assertIn('Gmail accepts at most 1024', too_big)
+        self.assertEqual(self.backend.round_trips, 0)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import unittest
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from unittest import mock
+from bmail import auth, email_handler, mailmerge, ratelimit
+from bmail.fake_gmail import FakeGmail
+from bmail.mailmerge import MergeTemplate
+
+SENDER = 'bot@example.com'
+
+class TestMergeTemplate(unittest.TestCase):
+    """Test template compilation and per-recipient rendering (no network)."""
+
+    def render(self, template, values):
+        template.bind(SENDER)
+        return message_from_bytes(template.render(values))
+
+    def test_render_ascii_and_unicode(self):
+        """Test that fields are substituted and non-ASCII text is encoded."""
+        template = MergeTemplate('Hello {name}', 'Dear {name},\nYour code is {code}.', to='{name} <{email}>', headers={'Reply-To': 'help@example.com'})
+        self.assertEqual(template.fields, {'name', 'email', 'code'})
+        plain = self.render(template, {'name': 'Ann', 'email': 'ann@example.com', 'code': 7})
+        self.assertEqual((plain['From'], plain['To'], plain['Subject'], plain['Reply-To']), (SENDER, 'Ann <ann@example.com>', 'Hello Ann', 'help@example.com'))
+        self.assertEqual(plain.get_payload(), 'Dear Ann,\nYour code is 7.')
+        accented = self.render(template, {'name': 'Zoë', 'email': 'zoe@example.com', 'code': 8})
+        self.assertEqual(str(make_header(decode_header(accented['Subject']))), 'Hello Zoë')
+        self.assertIn('zoe@example.com', accented['To'])
+        self.assertEqual(str(make_header(decode_header(accented['To']))), 'Zoë <zoe@example.com>')
+        self.assertEqual(accented.get_payload(decode=True).decode('utf-8'), 'Dear Zoë,\nYour code is 8.')
+
+    def test_rejects_bad_templates_and_header_injection(self):
+        """Test that format specs fail at compile time and line breaks fail per recipient."""
+        with self.assertRaises(ValueError):
+            MergeTemplate('{amount:.2f}', '')
+        with self.assertRaises(ValueError):
+            MergeTemplate('{}', '')
+        template = MergeTemplate('Hi {name}', 'Body')
+        template.bind(SENDER)
+        with self.assertRaises(ValueError):
+            template.render({'email': 'a@example.com', 'name': 'x\nBcc: victim@example.com'})
+        with self.assertRaises(KeyError):
+            template.render({'email': 'a@example.com'})
+
+class TestSendMerge(unittest.TestCase):
+    """Test mail-merge sending against the fake backend."""
+
+    def setUp(self):
+        """Use a fast scheduler and a fresh fake mailbox."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=2, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.backend = FakeGmail(seed=25)
+        self.service = self.backend.build_service(SENDER)
+
+    def test_sends_in_order_with_per_recipient_failures(self):
+        """Test that each row gets a result and bad rows do not stop the run."""
+        rows = [{'email': f'user{i}@example.com', 'name': f'User {i}'} for i in range(40)]
+        rows[5] = {'email': 'nameless@example.com'}
+        rows[9]['name'] = 'Eve\r\nBcc: victim@example.com'
+        template = MergeTemplate('Hello {name}', 'Hi {name}')
+        progress = []
+        with mock.patch('bmail.mailmerge.PROGRESS_INTERVAL', 0):
+            report = mailmerge.send_merge(self.service, template, iter(rows), max_workers=4, progress=progress.append)
+        self.assertEqual([r.index for r in report.results], list(range(40)))
+        self.assertEqual((report.sent, report.failed), (38, 2))
+        self.assertIn("missing field 'name'", report.results[5].result)
+        self.assertIn('line breaks', report.results[9].result)
+        self.assertEqual(report.results[9].to_addr, 'user9@example.com')
+        self.assertEqual(progress[-1][:3], (40, 38, 2))
+        self.assertEqual(len(progress), 41)
+        self.assertEqual(self.backend.calls['getProfile'], 1)
+        self.assertEqual(self.backend.calls['messages.send'], 38)
+        sent = self.service.users().messages().list(userId='me', q='subject:"Hello User 39"').execute()['messages']
+        self.assertEqual(len(sent), 1)
+
+    def test_streaming_report_and_handler(self):
+        """Test keep_results=False with on_result, and the email_handler wrapper."""
+        rows = [{'email': f'user{i}@example.com'} for i in range(10)]
+        seen = []
+        report = mailmerge.send_merge(self.service, MergeTemplate('Notice', 'Hello'), rows, on_result=seen.append, keep_results=False)
+        self.assertEqual((len(seen), report.sent, report.results), (10, 10, []))
+        self.assertTrue(str(report).startswith('Sent 10 of 10 emails'), str(report))
+        auth.install_service('creds.json', SENDER, self.service)
+        self.addCleanup(auth.invalidate_service)
+        with mock.patch.dict(os.environ, {'BMAIL_SENDER': SENDER}):
+            result = email_handler.mail_merge('creds.json', 'Hi {name}', 'Hello', [{'email': 'a@example.com', 'name': 'A'}, {'email': 'b@example.com'}])
+            invalid = email_handler.mail_merge('creds.json', '{x!r}', 'Hello', [])
+        self.assertEqual(result.splitlines()[1], "1:b@example.com:Failed to send email: missing field 'name'")
+        self.assertTrue(result.startswith('Sent 1 of 2 emails'), result)
+        self.assertTrue(invalid.startswith('Invalid template:'), invalid)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import base64
+import unittest
+from bmail.message import Attachment, Message, MessageSummary, html_to_text, parse_message, parse_summary, strip_quoted
+
+def encoded(text, charset='utf-8'):
+    return {'data': base64.urlsafe_b64encode(text.encode(charset)).decode().rstrip('='), 'size': len(text)}
+
+def part(mime_type, text=None, charset='utf-8', **extra):
+    node = {'mimeType': mime_type, 'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}], 'body': encoded(text, charset) if text is not None else {'size': 0}}
+    node.update(extra)
+    return node
+
+class TestParseMessage(unittest.TestCase):
+    """Test single-pass decoding of message payload trees."""
+
+    def resource(self, payload):
+        payload.setdefault('headers', [])
+        payload['headers'] = [{'name': 'From', 'value': 'a@example.com'}, {'name': 'Subject', 'value': 'Nested'}, {'name': 'Message-ID', 'value': '<m@example.com>'}] + payload['headers']
+        return {'id': 'm1', 'threadId': 't1', 'labelIds': ['INBOX'], 'payload': payload}
+
+    def test_nested_alternative_in_mixed(self):
+        """Test that text inside multipart/alternative inside multipart/mixed is found."""
+        alternative = {'mimeType': 'multipart/alternative', 'parts': [part('text/plain', 'Plain body'), part('text/html', '<p>HTML body</p>')]}
+        attachment = {'partId': '1', 'mimeType': 'application/pdf', 'filename': 'a.pdf', 'body': {'size': 1234, 'attachmentId': 'att1'}}
+        message = parse_message(self.resource({'mimeType': 'multipart/mixed', 'parts': [alternative, attachment]}))
+        self.assertIsInstance(message, Message)
+        self.assertEqual(message.body, 'Plain body')
+        self.assertEqual(message.attachments, [Attachment('1', 'a.pdf', 'application/pdf', 1234, 'att1')])
+        self.assertEqual((message.sender, message.subject, message.message_id, message.thread_id), ('a@example.com', 'Nested', '<m@example.com>', 't1'))
+
+    def test_html_only_and_charset(self):
+        """Test the HTML fallback and non-UTF-8 charsets."""
+        message = parse_message(self.resource(part('text/html', '<p>Caf\xe9 &amp; bar</p><script>x()</script>', charset='iso-8859-1')))
+        self.assertEqual(message.body, 'Café & bar')
+
+    def test_html_not_decoded_when_plain_exists(self):
+        """Test that only the returned parts are decoded."""
+        html = part('text/html')
+        html['body'] = {'data': '!!! not base64 !!!'}
+        message = parse_message(self.resource({'mimeType': 'multipart/alternative', 'parts': [part('text/plain', 'Plain'), html]}))
+        self.assertEqual(message.body, 'Plain')
+
+    def test_strip_quoted(self):
+        """Test that quoted history is dropped from reply bodies."""
+        self.assertEqual(strip_quoted('Thanks!\n\nOn Mon, Jan 1, 2024 at 10:00 AM Alice <\nalice@example.com> wrote:\n> Hi'), 'Thanks!')
+        self.assertEqual(strip_quoted('See below.\n> question\nanswer'), 'See below.\nanswer')
+        self.assertEqual(strip_quoted('Ok\n\n-----Original Message-----\nFrom: Bob\nSent: Monday'), 'Ok')
+        self.assertEqual(strip_quoted('From: Bob <bob@example.com>\nSent: Monday\nTo: me\n\nOld'), '')
+        self.assertEqual(strip_quoted('On second thought, no.'), 'On second thought, no.')
+
+    def test_html_to_text(self):
+        """Test tag stripping and line breaks."""
+        self.assertEqual(html_to_text('<div>One</div><div>Two<br>Three</div><style>p {}</style>'), 'One\nTwo\nThree')
+class TestMessageSummary(unittest.TestCase):
+    """Test inbox summaries and their string form."""
+
+    def test_parse_summary(self):
+        """Test header extraction, defaults and the line format."""
+        resource = {'id': 'm1', 'threadId': 't1', 'internalDate': '0', 'payload': {'headers': [{'name': 'Subject', 'value': 'Hi: there'}, {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:00:00 +0000'}]}}
+        summary = parse_summary('m1', resource)
+        self.assertEqual(summary, MessageSummary('m1', 'Mon, 1 Jan 2024 10:00:00 +0000', 'Hi: there', 't1'))
+        self.assertEqual(str(summary), 'm1:Mon, 1 Jan 2024 10:00:00 +0000:Hi: there')
+        bare = parse_summary('m2', {'internalDate': '0'})
+        self.assertEqual(bare.subject, 'No Subject')
+        self.assertRegex(bare.date, '^19[67]\\d-')
+        self.assertEqual(str(MessageSummary('m3', '', '', error='gone')), 'm3:Failed to fetch metadata: gone')
+        self.assertFalse(hasattr(summary, '__dict__'))
+
+    def test_message_summary_matches_metadata(self):
+        """Test that a full Message summarizes the same way as its metadata."""
+        resource = {'id': 'm1', 'threadId': 't1', 'payload': {'headers': [{'name': 'Subject', 'value': 'Same'}, {'name': 'Date', 'value': 'Tue, 2 Jan 2024'}], 'mimeType': 'text/plain', 'body': encoded('x')}}
+        self.assertEqual(parse_message(resource).summary(), parse_summary('m1', resource))
+
+class TestLazyDecoding(unittest.TestCase):
+    """Test raw-format parsing and body budgets."""
+
+    def raw_resource(self, text_body, attachment=b''):
+        from email.mime.application import MIMEApplication
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        mime = MIMEMultipart()
+        mime['From'] = 'a@example.com'
+        mime['Subject'] = 'Raw'
+        mime['Message-ID'] = '<r@example.com>'
+        mime.attach(MIMEText(text_body, 'plain', 'utf-8'))
+        if attachment:
+            part = MIMEApplication(attachment)
+            part.add_header('Content-Disposition', 'attachment', filename='big.bin')
+            mime.attach(part)
+        return {'id': 'r1', 'threadId': 't1', 'raw': base64.urlsafe_b64encode(mime.as_bytes()).decode()}
+
+    def test_raw_headers_then_body(self):
+        """Test that raw messages expose headers at once and parse the body on demand."""
+        message = parse_message(self.raw_resource('Hello raw \u00e9', attachment=b'x' * 1000))
+        self.assertEqual((message.sender, message.subject, message.message_id), ('a@example.com', 'Raw', '<r@example.com>'))
+        self.assertIsNone(message._text_parts)
+        self.assertEqual(message.body, 'Hello raw \u00e9')
+        self.assertEqual([a.filename for a in message.attachments], ['big.bin'])
+
+    def test_raw_budget_parses_prefix_only(self):
+        """Test that a budget on a large raw message is served from a prefix."""
+        resource = self.raw_resource('Report line\n' * 50000)
+        resource['raw'] = resource['raw'][:-40] + '!!!!'
+        message = parse_message(resource)
+        self.assertEqual(message.text(24), 'Report line\nReport line\n')
+        self.assertIsNone(message._text_parts)
+
+    def test_full_budget_decodes_prefix_only(self):
+        """Test that a budget on a full-format part decodes only the data it needs."""
+        body = encoded('x' * 10000)
+        body['data'] = body['data'][:4000] + '!!! corrupt tail !!!'
+        message = parse_message({'id': 'm1', 'payload': {'mimeType': 'text/plain', 'headers': [], 'body': body}})
+        self.assertEqual(message.text(100), 'x' * 100)
+
+    def test_format_email_truncates(self):
+        """Test the truncation marker in read_email output."""
+        from bmail.email_handler import format_email
+        message = parse_message({'id': 'm1', 'payload': {'mimeType': 'text/plain', 'headers': [{'name': 'Subject', 'value': 'Long'}], 'body': encoded('y' * 50)}})
+        self.assertTrue(format_email(message, 10).endswith('yyyyyyyyyy\n[Body truncated after 10 characters]'))
+        self.assertTrue(format_email(message, 50).endswith('y' * 50))
+        self.assertTrue(format_email(message).endswith('y' * 50))
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import base64
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from bmail import gmail_client, email_handler, message_cache
+from bmail.message_cache import MessageCache
+
+BOT = 'bot@example.com'
+OTHER = 'other@example.com'
+
+def full_message(message_id, body='Hello', labels=('INBOX',), padding=0):
+    data = base64.urlsafe_b64encode((body + 'x' * padding).encode()).decode()
+    headers = [{'name': 'From', 'value': 'a@example.com'}, {'name': 'To', 'value': 'b@example.com'}, {'name': 'Subject', 'value': 'Cached'}, {'name': 'Message-ID', 'value': f'<{message_id}@example.com>'}]
+    return {'id': message_id, 'threadId': 't' + message_id, 'labelIds': list(labels), 'payload': {'headers': headers, 'body': {'data': data}}}
+
+class TestMessageCache(unittest.TestCase):
+    """Test cases for the on-disk message cache."""
+
+    def setUp(self):
+        """Create a cache in a temporary directory."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = MessageCache(os.path.join(self.tmp.name, 'sub', 'messages.sqlite3'))
+        self.addCleanup(self.cache.close)
+
+    def test_round_trip(self):
+        """Test that a stored message comes back with its labels."""
+        message = full_message('m1')
+        self.cache.put(BOT, message)
+        self.assertEqual(self.cache.get('Bot@Example.com', 'm1'), message)
+        self.assertIsNone(self.cache.get(BOT, 'missing'))
+
+    def test_scoped_to_mailbox(self):
+        """Test that one mailbox never sees another mailbox's message with the same ID."""
+        self.cache.put(BOT, full_message('m1', body='Mine'))
+        self.assertIsNone(self.cache.get(OTHER, 'm1'))
+        self.cache.put(OTHER, full_message('m1', body='Theirs'))
+        self.cache.remove_labels(OTHER, ['m1'], ['INBOX'])
+        self.cache.evict(OTHER, 'm1')
+        self.assertEqual(self.cache.get(BOT, 'm1')['labelIds'], ['INBOX'])
+        self.assertIsNone(self.cache.get(OTHER, 'm1'))
+
+    def test_formats_stored_separately(self):
+        """Test that a 'full' lookup never returns a 'raw' resource and vice versa."""
+        raw = {'id': 'm1', 'labelIds': ['INBOX'], 'raw': base64.urlsafe_b64encode(b'Subject: Raw\r\n\r\nHi').decode()}
+        self.cache.put(BOT, full_message('m1'))
+        self.assertIsNone(self.cache.get(BOT, 'm1', 'raw'))
+        self.cache.put(BOT, raw)
+        self.assertEqual(self.cache.get(BOT, 'm1', 'raw'), raw)
+        self.assertIn('payload', self.cache.get(BOT, 'm1'))
+
+    def test_labels_stored_separately(self):
+        """Test that label changes do not require re-storing the content."""
+        self.cache.put(BOT, full_message('m1'))
+        self.cache.remove_labels(BOT, ['m1', 'unknown'], ['INBOX'])
+        self.assertEqual(self.cache.get(BOT, 'm1')['labelIds'], [])
+        self.cache.set_labels(BOT, 'm1', ['STARRED'])
+        self.assertEqual(self.cache.get(BOT, 'm1')['labelIds'], ['STARRED'])
+
+    def test_lru_eviction(self):
+        """Test that the least recently read messages are evicted past max_bytes."""
+        one_size = len(full_message('m0', padding=1000)['payload']['body']['data'])
+        self.cache.max_bytes = one_size * 3 + 1000
+        for i in range(3):
+            self.cache.put(BOT, full_message(f'm{i}', padding=1000))
+        self.cache.get(BOT, 'm0')
+        self.cache.put(BOT, full_message('m3', padding=1000))
+        self.assertIsNotNone(self.cache.get(BOT, 'm0'))
+        self.assertIsNone(self.cache.get(BOT, 'm1'))
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+
+    def test_persists_across_instances(self):
+        """Test that a new process (new instance) sees earlier writes."""
+        self.cache.put(BOT, full_message('m1'))
+        other = MessageCache(self.cache.path)
+        self.addCleanup(other.close)
+        self.assertEqual(other.get(BOT, 'm1')['id'], 'm1')
+
+    def test_unscoped_cache_file_is_emptied(self):
+        """Test that a cache file from before mailbox scoping is reset rather than trusted."""
+        self.cache.close()
+        path = os.path.join(self.tmp.name, 'old.sqlite3')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE messages (id TEXT PRIMARY KEY, data TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        conn.execute("INSERT INTO messages VALUES ('m1', '{}', 2, 0)")
+        conn.commit()
+        conn.close()
+        self.cache = MessageCache(path)
+        self.assertIsNone(self.cache.get(BOT, 'm1'))
+        self.assertEqual(self.cache.size(), 0)
+
+class TestCachedReads(unittest.TestCase):
+    """Test that get_email and receive_email read through the cache."""
+
+    def setUp(self):
+        """Point the default cache at a temporary directory."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        message_cache.reset_default_cache()
+        self.addCleanup(message_cache.reset_default_cache)
+        self.service = mock.MagicMock()
+        self.service.users().messages().get().execute.return_value = full_message('m1')
+        self.service.users().messages().get.reset_mock()
+        gmail_client.remember_sender_address(self.service, BOT)
+
+    def test_get_email_downloads_once(self):
+        """Test that the second read of a message makes no API call."""
+        first = gmail_client.get_email(self.service, 'm1')
+        second = gmail_client.get_email(self.service, 'm1')
+        self.assertEqual(first.message_id, second.message_id)
+        self.assertIn('Hello', second.body)
+        self.assertEqual(self.service.users().messages().get.call_count, 1)
+
+    def test_get_email_honours_format(self):
+        """Test that a cached 'full' message does not answer a 'raw' request."""
+        raw = {'id': 'm1', 'raw': base64.urlsafe_b64encode(b'Subject: Raw\r\n\r\nRaw body').decode()}
+        get = self.service.users().messages().get
+        get.side_effect = lambda **kwargs: mock.MagicMock(**{'execute.return_value': raw if kwargs['format'] == 'raw' else full_message('m1')})
+        self.assertEqual(gmail_client.get_email(self.service, 'm1').subject, 'Cached')
+        self.assertEqual(gmail_client.get_email(self.service, 'm1', format='raw').body, 'Raw body')
+        self.assertEqual(gmail_client.get_email(self.service, 'm1', format='raw').subject, 'Raw')
+        self.assertEqual(gmail_client.get_email(self.service, 'm1').subject, 'Cached')
+        self.assertEqual([call.kwargs['format'] for call in get.call_args_list], ['full', 'raw'])
+
+    def test_archive_email_updates_cached_labels(self):
+        """Test that archiving one message drops INBOX from its cached labels."""
+        gmail_client.get_email(self.service, 'm1')
+        self.service.users().messages().modify().execute.return_value = {'id': 'm1', 'labelIds': ['IMPORTANT']}
+        self.assertEqual(gmail_client.archive_email(self.service, 'm1'), 'Email m1 archived successfully')
+        self.assertEqual(gmail_client.get_email(self.service, 'm1').label_ids, ['IMPORTANT'])
+        self.assertEqual(message_cache.get_default_cache().get(BOT, 'm1')['labelIds'], ['IMPORTANT'])
+
+    def test_cache_bypass(self):
+        """Test that cache=False always downloads."""
+        gmail_client.get_email(self.service, 'm1', cache=False)
+        gmail_client.get_email(self.service, 'm1', cache=False)
+        self.assertEqual(self.service.users().messages().get.call_count, 2)
+
+    def test_receive_email_cache_hit(self):
+        """Test that a message cached for the caller's mailbox is formatted without an API call."""
+        message_cache.get_default_cache().put(BOT, full_message('m1', body='Cached body'))
+        with mock.patch.object(email_handler, '_get_service', return_value=self.service):
+            result = email_handler.receive_email('creds.json', 'm1')
+        self.assertEqual(self.service.users().messages().get.call_count, 0)
+        self.assertIn('Subject: Cached', result)
+        self.assertIn('Cached body', result)
+
+    def test_receive_email_checks_identity_first(self):
+        """Test that another mailbox's cached message is not served and auth errors are reported."""
+        message_cache.get_default_cache().put(OTHER, full_message('m1', body='Not yours'))
+        with mock.patch.object(email_handler, '_get_service', return_value=self.service):
+            result = email_handler.receive_email('creds.json', 'm1')
+        self.assertNotIn('Not yours', result)
+        self.assertEqual(self.service.users().messages().get.call_count, 1)
+        with mock.patch.object(email_handler, '_get_service', return_value='bad key'):
+            self.assertEqual(email_handler.receive_email('creds.json', 'm1'), 'Authentication error: bad key')
+
+    def test_disabled_by_zero_size(self):
+        """Test that BMAIL_CACHE_MAX_BYTES=0 turns the default cache off."""
+        message_cache.reset_default_cache()
+        with mock.patch.dict(os.environ, {'BMAIL_CACHE_MAX_BYTES': '0'}):
+            self.assertIsNone(message_cache.get_default_cache())
+if __name__ == '__main__':
+    unittest.main()
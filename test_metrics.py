@@ -0,0 +1,68 @@
+import unittest
+from googleapiclient.errors import HttpError
+from bmail import gmail_client, llm_email_tools, loadtest, metrics, ratelimit
+from bmail.fake_gmail import FakeGmail
+
+class TestMetrics(unittest.TestCase):
+    """Test call records and the metrics registry against the fake backend."""
+
+    def setUp(self):
+        """Collect records and metrics for this test only."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=2, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.records = []
+        self.registry = metrics.Registry()
+        for hook in (self.records.append, self.registry):
+            metrics.add_hook(hook)
+            self.addCleanup(metrics.remove_hook, hook)
+        self.backend = FakeGmail(seed=3)
+        loadtest.seed_mailbox(self.backend, 5)
+
+    def test_tool_calls_are_tagged(self):
+        """Test that a tool's calls, batches and quota are attributed to it."""
+        with loadtest.fake_environment(self.backend):
+            llm_email_tools.check_inbox()
+        self.assertEqual(self.registry.value('bmail_api_calls_total', method='messages.list', operation='check_inbox'), 1)
+        self.assertEqual(self.registry.value('bmail_api_calls_total', method='messages.get', operation='check_inbox'), 5)
+        self.assertEqual(self.registry.value('bmail_api_round_trips_total', operation='check_inbox'), 2)
+        self.assertEqual(self.registry.value('bmail_api_quota_units_total', operation='check_inbox'), 30)
+        batch = [r for r in self.records if r.method == metrics.BATCH][0]
+        self.assertEqual(batch.batch_size, 5)
+        self.assertTrue(all((r.response_bytes > 0 for r in self.records)))
+
+    def test_errors_and_retries(self):
+        """Test that retries and final error classes are recorded."""
+        service = self.backend.build_service(loadtest.MAILBOX)
+        self.backend.error_rate = 1.0
+        with self.assertRaises(HttpError):
+            with metrics.operation('probe'):
+                gmail_client.get_sender_address(service)
+        record = self.records[-1]
+        self.assertEqual((record.method, record.operation, record.retries, record.error, record.status), ('getProfile', 'probe', 2, 'HttpError', 503))
+        self.assertEqual(self.registry.value('bmail_api_errors_total', status=503), 1)
+        self.assertEqual(self.registry.value('bmail_api_retries_total'), 2)
+
+    def test_outermost_operation_wins(self):
+        """Test that nested tags keep the outer operation."""
+        with metrics.operation('outer'):
+            with metrics.operation('inner'):
+                self.assertEqual(metrics.current_operation(), 'outer')
+        self.assertIsNone(metrics.current_operation())
+
+    def test_dump_and_faulty_hook(self):
+        """Test the Prometheus rendering and that a failing hook does not break calls."""
+
+        def broken(record):
+            raise RuntimeError('hook failed')
+        metrics.add_hook(broken)
+        self.addCleanup(metrics.remove_hook, broken)
+        service = self.backend.build_service(loadtest.MAILBOX)
+        gmail_client.list_emails(service)
+        dump = self.registry.dump()
+        self.assertIn('# TYPE bmail_api_calls_total counter', dump)
+        self.assertIn('bmail_api_calls_total{method="messages.list"} 1', dump)
+        self.assertIn('bmail_api_latency_seconds_bucket{method="messages.get",le="+Inf"} 5', dump)
+        self.assertEqual(self.registry.snapshot()['histograms']['bmail_api_latency_seconds{method="messages.list"}']['count'], 1)
+if __name__ == '__main__':
+    unittest.main()
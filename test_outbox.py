@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+import tempfile
+import unittest
+from unittest import mock
+from bmail import auth, email_handler, outbox, ratelimit
+from bmail.fake_gmail import FakeGmail, FakeGmailHttp
+from bmail.outbox import Outbox, OutboxWorker
+
+SENDER = 'bot@example.com'
+
+class TestOutbox(unittest.TestCase):
+    """Test the persistent send queue against the fake backend."""
+
+    def setUp(self):
+        """Create a spool in a temporary directory and install a fake service."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=0, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(auth.invalidate_service)
+        self.backend = FakeGmail(seed=6)
+        auth.install_service('creds.json', SENDER, self.backend.build_service(SENDER))
+        self.outbox = Outbox(os.path.join(self.tmp.name, 'outbox.sqlite3'))
+        self.addCleanup(self.outbox.close)
+        self.worker = OutboxWorker(self.outbox)
+
+    def queue(self, subject='Hello'):
+        return self.outbox.enqueue('creds.json', SENDER, {'to_addr': 'alice@example.com', 'subject': subject, 'body': 'Hi'})
+
+    def sent(self):
+        service = self.backend.build_service(SENDER)
+        return service.users().messages().list(userId='me', q='subject:hello').execute().get('messages', [])
+
+    def test_drain_sends_with_message_id(self):
+        """Test that queued messages are sent once with their Message-ID."""
+        message_id = self.queue()
+        self.assertEqual(self.outbox.unsent(), 1)
+        self.assertEqual(self.worker.drain(), 1)
+        entry = self.outbox.get(message_id)
+        self.assertEqual((entry.status, entry.attempts), (outbox.SENT, 1))
+        service = self.backend.build_service(SENDER)
+        self.assertEqual(service.users().messages().list(userId='me', q=f'rfc822msgid:{message_id}').execute()['messages'][0]['id'], entry.result)
+        self.assertEqual(self.worker.drain(), 0)
+        self.assertEqual(self.backend.calls['messages.send'], 1)
+        self.assertEqual(self.backend.calls['messages.list'], 1)
+
+    def test_crash_after_send_is_not_resent(self):
+        """Test that a message left 'sending' by a dead process is found by Message-ID, not sent again."""
+        message_id = self.queue()
+        claimed = self.outbox.claim()
+        outbox.deliver(self.outbox, claimed)
+        self.outbox._finish(message_id, outbox.SENDING, 0, None)
+        with mock.patch('bmail.outbox.LEASE_SECONDS', 0):
+            self.assertEqual(self.worker.drain(), 1)
+        self.assertEqual(self.outbox.get(message_id).status, outbox.SENT)
+        self.assertEqual(self.backend.calls['messages.send'], 1)
+        self.assertEqual(len(self.sent()), 1)
+
+    def test_worker_thread_uses_its_own_transport(self):
+        """Test that a background drain never touches the cached service's shared transport."""
+        message_id = self.queue()
+        cached = auth.get_gmail_service('creds.json', SENDER)
+        private = FakeGmailHttp(self.backend, SENDER)
+        threads = []
+
+        def worker_http(service):
+            threads.append(threading.current_thread())
+            return private
+        with mock.patch.object(cached._http, 'request', side_effect=AssertionError('shared transport used')), mock.patch('bmail.bulk.worker_http', side_effect=worker_http):
+            thread = threading.Thread(target=self.worker.drain)
+            thread.start()
+            thread.join()
+        self.assertEqual(self.outbox.get(message_id).status, outbox.SENT)
+        self.assertEqual(threads, [thread])
+        self.assertIsNot(private, cached._http)
+
+    def test_transient_errors_retry_with_backoff(self):
+        """Test that failed sends are rescheduled and eventually delivered exactly once."""
+        message_id = self.queue()
+        self.backend.error_rate = 1.0
+        with mock.patch('bmail.outbox.BASE_DELAY', 0):
+            self.assertEqual(outbox.deliver(self.outbox, self.outbox.claim()), outbox.PENDING)
+            entry = self.outbox.get(message_id)
+            self.assertEqual((entry.status, entry.attempts), (outbox.PENDING, 1))
+            self.backend.error_rate = 0.0
+            self.worker.drain()
+        entry = self.outbox.get(message_id)
+        self.assertEqual((entry.status, entry.attempts), (outbox.SENT, 2))
+        self.assertEqual(len(self.sent()), 1)
+
+    def test_only_transport_errors_are_retried(self):
+        """Test that network errors are retried and programming or file errors fail the message."""
+        import socket
+        import httplib2
+        cases = [(ConnectionResetError('reset'), outbox.PENDING), (socket.timeout('timed out'), outbox.PENDING), (httplib2.ServerNotFoundError('no dns'), outbox.PENDING), (KeyError('to_addr'), outbox.FAILED), (AttributeError('oops'), outbox.FAILED), (FileNotFoundError('report.pdf'), outbox.FAILED)]
+        for error, status in cases:
+            with self.subTest(error=type(error).__name__):
+                message_id = self.queue()
+                with mock.patch('bmail.gmail_client.send_message', side_effect=error):
+                    self.assertEqual(outbox.deliver(self.outbox, self.outbox.claim()), status)
+                self.assertEqual(self.outbox.get(message_id).status, status)
+                self.outbox._finish(message_id, outbox.FAILED, 0, None)
+
+    def test_backoff_and_permanent_failure(self):
+        """Test that retries wait and that MAX_ATTEMPTS fails the message."""
+        message_id = self.queue()
+        self.outbox.retry_later(message_id, 1, 'boom')
+        self.assertIsNone(self.outbox.claim())
+        self.assertGreater(self.outbox.next_due(), time.time())
+        self.outbox.retry_later(message_id, outbox.MAX_ATTEMPTS, 'boom')
+        self.assertEqual(self.outbox.get(message_id).status, outbox.FAILED)
+        self.assertEqual(self.outbox.unsent(), 0)
+
+    def test_survives_reopen_and_rejects_unknown_fields(self):
+        """Test that queued messages persist across processes and duplicate IDs are ignored."""
+        message_id = self.queue()
+        self.outbox.enqueue('creds.json', SENDER, {'to_addr': 'x@example.com', 'subject': 'Other', 'body': ''}, message_id=message_id)
+        reopened = Outbox(self.outbox.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual([e.message_id for e in reopened.entries(outbox.PENDING)], [message_id])
+        with self.assertRaises(TypeError):
+            reopened.enqueue('creds.json', SENDER, {'to': 'x@example.com'})
+
+    def test_queue_email_returns_immediately(self):
+        """Test that email_handler.queue_email enqueues and the default worker delivers."""
+        with mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name, 'BMAIL_SENDER': SENDER}):
+            self.addCleanup(outbox.reset_default_outbox)
+            result = email_handler.queue_email('creds.json', 'alice@example.com', '', '', 'Hello queued', 'Hi')
+            self.assertTrue(result.startswith('Email queued. Message-ID: <'), result)
+            message_id = result.split(': ', 1)[1]
+            default = outbox.get_default_outbox()
+            deadline = time.monotonic() + 5
+            while default.get(message_id).status != outbox.SENT and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(default.get(message_id).status, outbox.SENT)
+if __name__ == '__main__':
+    unittest.main()
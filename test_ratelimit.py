@@ -0,0 +1,183 @@
+import time
+import unittest
+from unittest import mock
+import httplib2
+from googleapiclient.errors import HttpError
+from google.oauth2.credentials import Credentials
+from bmail import gmail_client, ratelimit
+from bmail.ratelimit import AIMDLimiter, Scheduler, TokenBucket
+from test_gmail_client_offline import metadata
+
+def http_error(status, content=b'{}', headers=None):
+    response = {'status': status}
+    response.update(headers or {})
+    return HttpError(httplib2.Response(response), content)
+
+def flaky_request(errors, result=None, method_id='gmail.users.messages.get'):
+    request = mock.MagicMock()
+    request.methodId = method_id
+    request.execute.side_effect = list(errors) + [result or {'id': 'ok'}]
+    return request
+
+class TestTokenBucket(unittest.TestCase):
+    """Test cases for the token bucket."""
+
+    def test_burst_then_rate(self):
+        """Test that a full bucket pays immediately and then refills at rate."""
+        bucket = TokenBucket(rate=1000, capacity=100)
+        self.assertEqual(bucket.acquire(100), 0.0)
+        started = time.monotonic()
+        bucket.acquire(50)
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_charge_above_capacity_goes_into_debt(self):
+        """Test that a charge larger than the capacity is taken in full, not clipped."""
+        bucket = TokenBucket(rate=1000, capacity=100)
+        self.assertEqual(bucket.acquire(200), 0.0)
+        self.assertAlmostEqual(bucket.tokens, -100, delta=5)
+        started = time.monotonic()
+        bucket.acquire(10)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+class TestAIMDLimiter(unittest.TestCase):
+    """Test cases for the AIMD concurrency limit."""
+
+    def test_increase_and_halve(self):
+        """Test additive increase on success and multiplicative decrease on throttling."""
+        limiter = AIMDLimiter(initial=4, maximum=8)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        self.assertAlmostEqual(limiter.limit, 5.0, delta=0.1)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertAlmostEqual(limiter.limit, 2.5, delta=0.1)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 1.0)
+
+class TestScheduler(unittest.TestCase):
+    """Test retries, backoff and quota metering."""
+
+    def setUp(self):
+        """Use a scheduler with tiny delays."""
+        self.scheduler = Scheduler(max_retries=3, base_delay=0.001, max_delay=0.01)
+        self.service = mock.MagicMock()
+
+    def test_retries_throttling_then_succeeds(self):
+        """Test that 429 and 503 are retried and halve the concurrency limit."""
+        request = flaky_request([http_error(429), http_error(503)])
+        self.assertEqual(self.scheduler.execute(self.service, request), {'id': 'ok'})
+        self.assertEqual(request.execute.call_count, 3)
+        self.assertLess(self.scheduler.limiter(self.service).limit, 4)
+
+    def test_concurrency_limit_per_user(self):
+        """Test that throttling one user leaves other users' concurrency limits alone."""
+        first, second = mock.MagicMock(), mock.MagicMock()
+        first._http.credentials = Credentials(token='a')
+        second._http.credentials = Credentials(token='b')
+        scheduler = Scheduler(user_units_per_second=None, project_units_per_second=None, max_retries=1, base_delay=0.001)
+        scheduler.execute(first, flaky_request([http_error(429)]))
+        self.assertLess(scheduler.limiter(first).limit, 4)
+        self.assertIs(scheduler.limiter(first), scheduler.limiter(first))
+        self.assertEqual(scheduler.limiter(second).limit, 4)
+
+    def test_rate_limit_403_is_retried(self):
+        """Test that a 403 userRateLimitExceeded is treated as throttling."""
+        request = flaky_request([http_error(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}')])
+        self.assertEqual(self.scheduler.execute(self.service, request), {'id': 'ok'})
+
+    def test_non_retryable_raises(self):
+        """Test that a 404 is raised at once."""
+        request = flaky_request([http_error(404)])
+        with self.assertRaises(HttpError):
+            self.scheduler.execute(self.service, request)
+        self.assertEqual(request.execute.call_count, 1)
+
+    def test_network_errors_retried_except_sends(self):
+        """Test that timeouts and reset connections are retried, but not for a send that may have gone out."""
+        request = flaky_request([TimeoutError('timed out'), ConnectionResetError('reset'), httplib2.ServerNotFoundError('dns')])
+        self.assertEqual(self.scheduler.execute(self.service, request), {'id': 'ok'})
+        self.assertGreaterEqual(self.scheduler.limiter(self.service).limit, 4)
+        send = flaky_request([ConnectionResetError('reset')], method_id='gmail.users.messages.send')
+        with self.assertRaises(ConnectionResetError):
+            self.scheduler.execute(self.service, send)
+        with self.assertRaises(KeyError):
+            self.scheduler.execute(self.service, flaky_request([KeyError('id')]))
+        self.assertFalse(ratelimit.is_transient(FileNotFoundError('a.pdf')))
+
+    def test_retries_exhausted(self):
+        """Test that the last error is raised once retries run out."""
+        request = flaky_request([http_error(500)] * 5)
+        with self.assertRaises(HttpError):
+            self.scheduler.execute(self.service, request)
+        self.assertEqual(request.execute.call_count, 4)
+
+    def test_retry_after_honoured(self):
+        """Test that Retry-After sets a floor on the backoff (capped by max_delay)."""
+        error = http_error(429, headers={'retry-after': '5'})
+        self.assertEqual(self.scheduler.backoff(0, error), 0.01)
+
+    def test_quota_units_per_method(self):
+        """Test that each call is charged its Gmail quota cost per user."""
+        service = mock.MagicMock()
+        service._http.credentials = Credentials(token='token')
+        scheduler = Scheduler(user_units_per_second=1000, project_units_per_second=None)
+        scheduler.execute(service, flaky_request([], method_id='gmail.users.messages.send'))
+        bucket = scheduler._buckets[('user', ratelimit.identity(service)[1])]
+        self.assertAlmostEqual(bucket.tokens, 900, delta=5)
+
+    def test_test_doubles_not_metered(self):
+        """Test that services without google-auth credentials skip the buckets."""
+        self.scheduler.execute(self.service, flaky_request([]))
+        self.assertEqual(self.scheduler._buckets, {})
+
+class TestBatchRetries(unittest.TestCase):
+    """Test that throttled calls inside a batch are retried on their own."""
+
+    def test_retry_failed_parts(self):
+        """Test that only the throttled part is re-sent in a second batch."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(Scheduler(max_retries=2, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        batches = []
+        answers = {'a': [metadata('A', 'd')], 'b': [http_error(429), metadata('B', 'd')], 'c': [http_error(404)]}
+
+        class Batch:
+
+            def __init__(self, callback):
+                self.callback = callback
+                self.ids = []
+
+            def add(self, request, request_id):
+                self.ids.append(request_id)
+
+            def execute(self, http=None):
+                batches.append(list(self.ids))
+                for request_id in self.ids:
+                    answer = answers[request_id].pop(0)
+                    if isinstance(answer, Exception):
+                        self.callback(request_id, None, answer)
+                    else:
+                        self.callback(request_id, answer, None)
+        service = mock.MagicMock()
+        service.new_batch_http_request.side_effect = lambda callback: Batch(callback)
+        lines = gmail_client.summarize_emails(service, ['a', 'b', 'c'])
+        self.assertEqual(batches, [['a', 'b', 'c'], ['b']])
+        self.assertLess(ratelimit.get_scheduler().limiter(service).limit, 4)
+        self.assertEqual(lines[:2], ['a:d:A', 'b:d:B'])
+        self.assertTrue(lines[2].startswith('c:Failed to fetch metadata'))
+    def test_retry_throttled_batch_request(self):
+        """Test that a 429 on the batch request itself is retried with backoff and backs off the limiter."""
+        scheduler = Scheduler(max_retries=2, base_delay=0.001)
+        batch = mock.MagicMock()
+        batch.execute.side_effect = [http_error(429), None]
+        scheduler.execute_batch(mock.MagicMock(), batch, 10)
+        self.assertEqual(batch.execute.call_count, 2)
+        self.assertLess(scheduler.limiter(mock.MagicMock()).limit, 4)
+        batch.execute.side_effect = [http_error(404)]
+        with self.assertRaises(HttpError):
+            scheduler.execute_batch(mock.MagicMock(), batch, 10)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+from bmail import email_handler, gmail_client, message_cache, ratelimit, search_index
+from bmail.fake_gmail import FakeGmail
+from bmail.message import MessageSummary
+from bmail.search_index import SearchIndex, parse_query
+
+@unittest.skipUnless(search_index.fts5_available(), 'SQLite lacks FTS5')
+class TestSearchIndex(unittest.TestCase):
+    """Test the local inbox index against the fake backend."""
+
+    def setUp(self):
+        """Seed an inbox and build an index in a temporary directory."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=1, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.backend = FakeGmail(seed=4)
+        self.service = self.backend.build_service('bot@example.com')
+        gmail_client.remember_sender_address(self.service, 'bot@example.com')
+        self.budget = self.backend.add_message('bot@example.com', sender='Alice <alice@example.com>', subject='Q3 plan', body='The budget is attached.', date=datetime(2024, 1, 5, 12))
+        self.lunch = self.backend.add_message('bot@example.com', sender='bob@example.com', subject='Lunch', body='Friday works for me.', date=datetime(2024, 2, 1, 12))
+        self.backend.add_message('bot@example.com', sender='alice@example.com', subject='Old news', body='budget', date=datetime(2023, 12, 1, 12), label_ids=('SENT',))
+        self.index = SearchIndex(os.path.join(self.tmp.name, 'search.sqlite3'), max_age=0, cache=False)
+        self.addCleanup(self.index.close)
+
+    def ids(self, query):
+        self.index.refresh(self.service)
+        summaries, _ = self.index.search(self.service, query)
+        return [summary.id for summary in summaries]
+
+    def test_query_forms(self):
+        """Test field, phrase, date and label queries against the inbox only."""
+        self.assertEqual(self.ids('budget'), [self.budget.id])
+        self.assertEqual(self.ids('from:alice'), [self.budget.id])
+        self.assertEqual(self.ids('from:alice@example.com subject:"q3 plan"'), [self.budget.id])
+        self.assertEqual(self.ids('to:bot@example.com'), [self.lunch.id, self.budget.id])
+        self.assertEqual(self.ids('after:2024/01/10'), [self.lunch.id])
+        self.assertEqual(self.ids('before:2024-01-10 is:unread'), [self.budget.id])
+        self.assertEqual(self.ids('"works for"'), [self.lunch.id])
+        self.assertEqual(self.ids('dinner'), [])
+        self.assertEqual(self.index.search(self.service, None, max_results=1), ([MessageSummary(self.lunch.id, self.lunch.header('Date'), 'Lunch')], 1))
+
+    def test_me_is_the_mailbox(self):
+        """Test that from:me and to:me search for the mailbox's own address, not the word "me"."""
+        mine = self.backend.add_message('bot@example.com', sender='Bot <bot@example.com>', subject='Note to self', body='Remind me')
+        self.assertEqual(self.ids('from:me'), [mine.id])
+        self.assertEqual(self.ids('to:me is:unread'), [mine.id, self.lunch.id, self.budget.id])
+        self.assertEqual(self.ids('me'), [mine.id, self.lunch.id])
+        self.assertIsNone(parse_query('from:me'))
+        self.assertEqual(parse_query('to:ME', 'bot@example.com')[0], 'recipients : "bot@example.com"')
+
+    def test_unsupported_queries_fall_back(self):
+        """Test that syntax the index cannot answer returns None without API calls."""
+        for query in ('-from:alice', 'has:attachment', 'label:Clients', 'budget OR lunch', 'newer_than:2d', 'after:yesterday'):
+            self.assertIsNone(parse_query(query), query)
+            self.assertIsNone(self.index.search(self.service, query))
+        self.assertEqual(self.backend.round_trips, 0)
+
+    def test_incremental_refresh(self):
+        """Test that arrivals, archives and deletions are applied from history."""
+        self.ids('budget')
+        gets = self.backend.calls['messages.get']
+        arrived = self.backend.add_message('bot@example.com', subject='Budget review', body='New numbers')
+        self.service.users().messages().modify(userId='me', id=self.lunch.id, body={'removeLabelIds': ['INBOX']}).execute()
+        self.assertEqual(self.ids('budget'), [arrived.id, self.budget.id])
+        self.assertEqual(self.ids(None), [arrived.id, self.budget.id])
+        self.assertEqual(self.backend.calls['messages.get'] - gets, 2)
+        self.assertEqual(self.backend.calls['messages.list'], 1)
+
+    def test_first_search_builds_in_background(self):
+        """Test that an unbuilt mailbox is answered by the server while the index builds."""
+        self.assertIsNone(self.index.search(self.service, 'budget'))
+        self.assertTrue(self.index.wait(5))
+        summaries, _ = self.index.search(self.service, 'budget')
+        self.assertEqual([summary.id for summary in summaries], [self.budget.id])
+
+    def test_failed_downloads_retried(self):
+        """Test that a message whose get failed is not silently missing and is fetched by the next refresh."""
+        from googleapiclient.errors import HttpError
+        import httplib2
+        real = search_index.gmail_client._execute_batch
+
+        def flaky(service, requests):
+            results = real(service, requests)
+            if self.budget.id in results:
+                results[self.budget.id] = (None, HttpError(httplib2.Response({'status': 503}), b'{}'))
+            return results
+        with mock.patch('bmail.search_index.gmail_client._execute_batch', side_effect=flaky):
+            self.index.refresh(self.service)
+        self.assertEqual(self.index.missing_ids('bot@example.com'), {self.budget.id})
+        self.index.max_age = 60
+        self.assertIsNone(self.index.search(self.service, 'lunch'))
+        self.index.max_age = 0
+        self.assertEqual(self.ids('budget'), [self.budget.id])
+        self.assertEqual(self.index.missing_ids('bot@example.com'), set())
+
+    def test_max_age_skips_refresh(self):
+        """Test that searches within max_age make no API calls."""
+        self.index.max_age = 60
+        self.ids('budget')
+        round_trips = self.backend.round_trips
+        self.ids('from:bob')
+        self.ids('lunch')
+        self.assertEqual(self.backend.round_trips, round_trips)
+
+    def test_check_inbox_uses_index(self):
+        """Test that list_emails answers from the index when enabled and pages with local cursors."""
+        environment = {'BMAIL_SEARCH_INDEX': '1', 'BMAIL_CACHE_DIR': self.tmp.name, 'BMAIL_SEARCH_MAX_AGE': '60'}
+        with mock.patch.dict(os.environ, environment), mock.patch('bmail.email_handler._get_service', return_value=self.service):
+            self.addCleanup(search_index.reset_default_index)
+            self.addCleanup(message_cache.reset_default_cache)
+            unbuilt = email_handler.list_emails('creds.json', max_results=1)
+            self.assertTrue(search_index.get_default_index().wait(5))
+            first = email_handler.list_emails('creds.json', max_results=1).splitlines()
+            round_trips = self.backend.round_trips
+            cursor = first[-1].split(': ', 1)[1]
+            second = email_handler.list_emails('creds.json', cursor=cursor, max_results=1)
+            self.assertEqual(second.split(':', 1)[0], self.budget.id)
+            self.assertEqual(self.backend.round_trips, round_trips)
+            email_handler.archive_emails('creds.json', [self.budget.id])
+            self.assertEqual(email_handler.list_emails('creds.json', query='budget'), 'No emails found')
+            server = email_handler.list_emails('creds.json', query='has:attachment')
+        self.assertEqual(unbuilt.split(':', 1)[0], self.lunch.id)
+        self.assertEqual(first[0].split(':', 1)[0], self.lunch.id)
+        self.assertEqual(server, 'No emails found')
+        self.assertEqual(self.backend.calls['messages.list'], 3)
+if __name__ == '__main__':
+    unittest.main()
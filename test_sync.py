@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import httplib2
+from googleapiclient.errors import HttpError
+from bmail import email_handler, message_cache, ratelimit, sync
+from bmail.message_cache import MessageCache
+from bmail.sync import MailboxSync
+from test_gmail_client_offline import FakeBatch, metadata
+
+def history_page(history, history_id, next_token=None):
+    page = {'history': history, 'historyId': history_id}
+    if next_token:
+        page['nextPageToken'] = next_token
+    return page
+
+def added(message_id, labels=('INBOX', 'UNREAD')):
+    return {'messagesAdded': [{'message': {'id': message_id, 'labelIds': list(labels)}}]}
+
+class TestMailboxSync(unittest.TestCase):
+    """Test cases for history-based incremental sync (no network)."""
+
+    def setUp(self):
+        """Create sync state and a message cache in a temporary directory."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = MessageCache(os.path.join(self.tmp.name, 'messages.sqlite3'))
+        self.addCleanup(self.cache.close)
+        self.sync = MailboxSync(os.path.join(self.tmp.name, 'sync.sqlite3'), cache=self.cache)
+        self.addCleanup(self.sync.close)
+        self.service = mock.MagicMock()
+        self.service.users().getProfile().execute.return_value = {'emailAddress': 'bot@example.com', 'historyId': '100'}
+        self.pages = []
+        self.history_calls = []
+        self.service.users().history().list.side_effect = self.history_list
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=2, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+
+    def history_list(self, **params):
+        self.history_calls.append(params)
+        request = mock.MagicMock()
+        page = self.pages.pop(0)
+        if isinstance(page, Exception):
+            request.execute.side_effect = page
+        else:
+            request.execute.return_value = page
+        return request
+
+    def test_first_sync_takes_baseline(self):
+        """Test that the first sync records the profile historyId and reports full."""
+        result = self.sync.sync(self.service, 'bot@example.com')
+        self.assertTrue(result.full)
+        self.assertEqual(self.sync.get_history_id('bot@example.com'), '100')
+        self.assertEqual(self.history_calls, [])
+
+    def test_incremental_changes(self):
+        """Test that added, deleted and relabeled messages are classified across pages."""
+        self.sync.set_history_id('bot@example.com', '100')
+        self.cache.put('bot@example.com', {'id': 'old', 'labelIds': ['INBOX'], 'payload': {}})
+        self.cache.put('bot@example.com', {'id': 'gone', 'payload': {}})
+        self.pages = [history_page([added('a'), added('sent', labels=('SENT',))], '105', 'p2'), history_page([added('b'), {'messagesDeleted': [{'message': {'id': 'b'}}, {'message': {'id': 'gone'}}]}, {'labelsRemoved': [{'message': {'id': 'old', 'labelIds': []}, 'labelIds': ['INBOX']}]}], '110')]
+        result = self.sync.sync(self.service, 'bot@example.com')
+        self.assertFalse(result.full)
+        self.assertEqual(result.added, ['a'])
+        self.assertEqual(result.deleted, ['b', 'gone'])
+        self.assertEqual(result.relabeled, ['old'])
+        self.assertEqual(self.sync.get_history_id('bot@example.com'), '110')
+        self.assertEqual(self.history_calls[0]['startHistoryId'], '100')
+        self.assertEqual(self.history_calls[1]['pageToken'], 'p2')
+        self.assertIsNone(self.cache.get('bot@example.com', 'gone'))
+        self.assertEqual(self.cache.get('bot@example.com', 'old')['labelIds'], [])
+
+    def test_expired_history_falls_back(self):
+        """Test that a 404 from history.list triggers a full resync."""
+        self.sync.set_history_id('bot@example.com', '1')
+        self.pages = [HttpError(httplib2.Response({'status': 404}), b'{}')]
+        result = self.sync.sync(self.service, 'bot@example.com')
+        self.assertTrue(result.full)
+        self.assertEqual(self.sync.get_history_id('bot@example.com'), '100')
+
+    def test_other_errors_raise(self):
+        """Test that non-404 errors are not mistaken for an expired history."""
+        self.sync.set_history_id('bot@example.com', '1')
+        self.pages = [HttpError(httplib2.Response({'status': 500}), b'{}')]
+        with self.assertRaises(HttpError):
+            self.sync.sync(self.service, 'bot@example.com')
+        self.assertEqual(self.sync.get_history_id('bot@example.com'), '1')
+
+class TestListNewEmails(unittest.TestCase):
+    """Test check_inbox(new_only=True) through email_handler (no network)."""
+
+    def setUp(self):
+        """Use temporary default state and a mock service."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BMAIL_CACHE_DIR': self.tmp.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for reset in (message_cache.reset_default_cache, sync.reset_default_sync):
+            reset()
+            self.addCleanup(reset)
+        self.service = mock.MagicMock()
+        self.service.users().getProfile().execute.return_value = {'emailAddress': 'bot@example.com', 'historyId': '100'}
+        self.service.users().messages().list().execute.return_value = {'messages': [{'id': 'x'}]}
+        self.batches = []
+        self.service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, {'x': metadata('Old', 'd'), 'n': metadata('New', 'd')}, self.batches)
+        get_service = mock.patch.object(email_handler, '_get_service', return_value=self.service)
+        get_service.start()
+        self.addCleanup(get_service.stop)
+
+    def test_new_since_last_check(self):
+        """Test baseline listing, then only new mail, then nothing."""
+        self.assertEqual(email_handler.list_new_emails('creds.json'), 'x:d:Old')
+        self.service.users().history().list().execute.return_value = history_page([added('n')], '101')
+        self.assertEqual(email_handler.list_new_emails('creds.json'), 'n:d:New')
+        self.service.users().history().list().execute.return_value = history_page([], '101')
+        self.assertEqual(email_handler.list_new_emails('creds.json'), 'No new emails')
+        self.assertEqual(len(self.batches), 2)
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import queue
+import tempfile
+import unittest
+from bmail import message_cache, ratelimit
+from bmail.fake_gmail import FakeGmail
+from bmail.sync import MailboxSync
+from bmail.watcher import InboxWatcher, NewMessage
+
+class TestInboxWatcher(unittest.TestCase):
+    """Test the adaptive inbox watcher against the fake backend."""
+
+    def setUp(self):
+        """Watch one fake mailbox with history state in a temporary directory."""
+        scheduler = ratelimit.get_scheduler()
+        ratelimit.set_scheduler(ratelimit.Scheduler(max_retries=1, base_delay=0.001))
+        self.addCleanup(ratelimit.set_scheduler, scheduler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = message_cache.MessageCache(os.path.join(self.tmp.name, 'messages.sqlite3'))
+        self.addCleanup(self.cache.close)
+        self.sync = MailboxSync(os.path.join(self.tmp.name, 'watcher.sqlite3'), cache=self.cache)
+        self.addCleanup(self.sync.close)
+        self.backend = FakeGmail(seed=2)
+        self.backend.add_message('bot@example.com', subject='Before')
+        self.service = self.backend.build_service('bot@example.com')
+        self.events = []
+        self.errors = []
+        self.watcher = InboxWatcher(self.events.append, min_interval=1.0, max_interval=8.0, sync=self.sync, on_error=lambda mailbox, e: self.errors.append(e))
+        self.addCleanup(self.watcher.close)
+
+    def test_reports_only_new_messages(self):
+        """Test that the first poll takes a baseline and later polls deliver arrivals once."""
+        self.watcher.watch(self.service)
+        self.assertEqual(self.watcher.poll(), [])
+        first = self.backend.add_message('bot@example.com', subject='New 1')
+        second = self.backend.add_message('bot@example.com', subject='New 2')
+        self.backend.add_message('bot@example.com', subject='Sent', label_ids=('SENT',))
+        self.watcher.poll()
+        self.assertEqual(self.events, [NewMessage('bot@example.com', first.id), NewMessage('bot@example.com', second.id)])
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.backend.calls['messages.list'], 0)
+        self.assertEqual(self.backend.calls['messages.get'], 0)
+
+    def test_interval_adapts_to_traffic(self):
+        """Test that idle polls back off to max_interval and new mail resets the interval."""
+        self.watcher.watch(self.service)
+        intervals = []
+        for _ in range(5):
+            self.watcher.poll()
+            intervals.append(self.watcher.interval('bot@example.com'))
+        self.assertEqual(intervals, [2.0, 4.0, 8.0, 8.0, 8.0])
+        self.backend.add_message('bot@example.com', subject='Wake up')
+        self.watcher.poll()
+        self.assertEqual(self.watcher.interval('bot@example.com'), 1.0)
+
+    def test_fetch_and_queue(self):
+        """Test that fetch=True delivers decoded messages to a queue."""
+        events = queue.Queue()
+        watcher = InboxWatcher(queue=events, fetch=True, sync=self.sync)
+        watcher.watch(self.service, 'bot@example.com')
+        watcher.poll()
+        self.backend.add_message('bot@example.com', subject='Fetched', body='Hello there')
+        watcher.poll()
+        event = events.get_nowait()
+        self.assertEqual((event.message.subject, event.message.body), ('Fetched', 'Hello there'))
+
+    def test_errors_back_off_and_are_reported(self):
+        """Test that failing polls and callbacks go to on_error without stopping the watcher."""
+        self.watcher.watch(self.service)
+        self.watcher.poll()
+        self.backend.error_rate = 1.0
+        self.watcher.poll()
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(self.watcher.interval('bot@example.com'), 4.0)
+        self.backend.error_rate = 0.0
+        self.watcher.callback = lambda event: 1 / 0
+        self.backend.add_message('bot@example.com', subject='Boom')
+        self.assertEqual(len(self.watcher.poll()), 1)
+        self.assertIsInstance(self.errors[-1], ZeroDivisionError)
+
+    def test_background_thread(self):
+        """Test that a started watcher picks up mail on its own."""
+        events = queue.Queue()
+        watcher = InboxWatcher(queue=events, min_interval=0.01, max_interval=0.02, sync=self.sync)
+        watcher.watch(self.service)
+        with watcher:
+            while self.sync.get_history_id('bot@example.com') is None:
+                pass
+            message = self.backend.add_message('bot@example.com', subject='Live')
+            self.assertEqual(events.get(timeout=5).message_id, message.id)
+if __name__ == '__main__':
+    unittest.main()